@@ -0,0 +1,50 @@
+r"""
+@file   collection_memory_report.py
+@author Peter M Bach <peterbach@gmail.com>
+@section LICENSE
+
+Urban Biophysical Environments and Technologies Simulator (UrbanBEATS)
+Copyright (C) 2017-2022  Peter M. Bach
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Peter M. Bach"
+__copyright__ = "Copyright 2017-2022. Peter M. Bach"
+
+# The following script prints the memory report of one or more saved asset collections (.ubcol files) from the
+# 'collections' folder of a project, showing which asset types and attributes take up the most space.
+#
+# Usage: python collection_memory_report.py <path to .ubcol file> [<path to .ubcol file> ...]
+
+# PYTHON IMPORTS
+import os
+import sys
+
+# URBANBEATS IMPORTS
+from model.ublibs import ubdatatypes as ubdata
+
+if len(sys.argv) < 2:
+    print("Usage: python collection_memory_report.py <path to .ubcol file> [<path to .ubcol file> ...]")
+    sys.exit(1)
+
+for filepath in sys.argv[1:]:
+    collection = ubdata.load_asset_collection(filepath)
+    if collection is None:
+        print("Could not find asset collection: " + str(filepath))
+        continue
+    if os.path.exists(filepath):
+        print("File size on disk: %.2f MB" % (os.path.getsize(filepath) / (1024.0 * 1024.0)))
+    print(ubdata.format_memory_report(collection.memory_report()))
+    print("")
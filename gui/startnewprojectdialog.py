@@ -209,6 +209,12 @@ class Ui_ProjectSetupDialog(object):
         self.keepcopy_check = QtWidgets.QCheckBox(self.path_widget)
         self.keepcopy_check.setObjectName("keepcopy_check")
         self.gridLayout_3.addWidget(self.keepcopy_check, 2, 1, 1, 1)
+        self.rastercache_check = QtWidgets.QCheckBox(self.path_widget)
+        self.rastercache_check.setObjectName("rastercache_check")
+        self.gridLayout_3.addWidget(self.rastercache_check, 3, 1, 1, 1)
+        self.rasteroverviews_check = QtWidgets.QCheckBox(self.path_widget)
+        self.rasteroverviews_check.setObjectName("rasteroverviews_check")
+        self.gridLayout_3.addWidget(self.rasteroverviews_check, 4, 1, 1, 1)
         self.verticalLayout_5.addWidget(self.path_widget)
         self.synopsis_lbl = QtWidgets.QLabel(self.general_scrollAreaContents)
         self.synopsis_lbl.setObjectName("synopsis_lbl")
@@ -313,7 +319,9 @@ class Ui_ProjectSetupDialog(object):
         ProjectSetupDialog.setTabOrder(self.projectlog_compreh, self.projpath_line)
         ProjectSetupDialog.setTabOrder(self.projpath_line, self.projpath_button)
         ProjectSetupDialog.setTabOrder(self.projpath_button, self.keepcopy_check)
-        ProjectSetupDialog.setTabOrder(self.keepcopy_check, self.buttonBox)
+        ProjectSetupDialog.setTabOrder(self.keepcopy_check, self.rastercache_check)
+        ProjectSetupDialog.setTabOrder(self.rastercache_check, self.rasteroverviews_check)
+        ProjectSetupDialog.setTabOrder(self.rasteroverviews_check, self.buttonBox)
 
     def retranslateUi(self, ProjectSetupDialog):
         _translate = QtCore.QCoreApplication.translate
@@ -401,6 +409,8 @@ class Ui_ProjectSetupDialog(object):
         self.projpath_button.setText(_translate("ProjectSetupDialog", "Browse..."))
         self.projpath_line.setText(_translate("ProjectSetupDialog", "(none)"))
         self.keepcopy_check.setText(_translate("ProjectSetupDialog", "Keep a copy of data sets wtihin project path"))
+        self.rastercache_check.setText(_translate("ProjectSetupDialog", "Cache imported rasters as memory-mapped files for faster mapping"))
+        self.rasteroverviews_check.setText(_translate("ProjectSetupDialog", "Build overviews of imported rasters (requires a copy of data sets)"))
         self.synopsis_lbl.setText(_translate("ProjectSetupDialog", "<html><head/><body><p><span style=\" font-weight:600;\">Project Synopsis</span></p></body></html>"))
         self.synopsis_descr_lbl.setWhatsThis(_translate("ProjectSetupDialog", "Width of the square cell in the city grid in metres"))
         self.synopsis_descr_lbl.setText(_translate("ProjectSetupDialog", "<!DOCTYPE HTML PUBLIC \"-//W3C//DTD HTML 4.0//EN\" \"http://www.w3.org/TR/REC-html40/strict.dtd\">\n"
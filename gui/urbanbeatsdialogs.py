@@ -761,6 +761,8 @@ class NewProjectDialogLaunch(QtWidgets.QDialog):
 
         self.ui.projpath_line.setText(self.simulation.get_project_parameter("projectpath"))
         self.ui.keepcopy_check.setChecked(int(self.simulation.get_project_parameter("keepcopy")))
+        self.ui.rastercache_check.setChecked(int(self.simulation.get_project_parameter("rastercache") or 0))
+        self.ui.rasteroverviews_check.setChecked(int(self.simulation.get_project_parameter("rasteroverviews") or 0))
 
         self.ui.synopsis_box.setPlainText(self.simulation.get_project_parameter("synopsis"))
 
@@ -883,13 +885,16 @@ class NewProjectDialogLaunch(QtWidgets.QDialog):
         """Disabled several key input parameters that cannot be modified if the project
         has already been created. The method is called if the GUI is being opened as a viewer
         rather than for the setup of a new proejct. Items disabled include the project name,
-        the log settings, the path and whether to copy data into the project folder."""
+        the log settings, the path, whether to copy data into the project folder and the
+        raster cache and overview options."""
         self.ui.projname_line.setEnabled(0)
         self.ui.projectlog_compreh.setEnabled(0)
         self.ui.projectlog_simple.setEnabled(0)
         self.ui.projpath_line.setEnabled(0)
         self.ui.projpath_button.setEnabled(0)
         self.ui.keepcopy_check.setEnabled(0)
+        self.ui.rastercache_check.setEnabled(0)
+        self.ui.rasteroverviews_check.setEnabled(0)
         self.ui.coords_widget.setEnabled(0)
 
     def disable_all_parameters(self):
@@ -950,6 +955,8 @@ class NewProjectDialogLaunch(QtWidgets.QDialog):
         self.simulation.set_project_parameter("otherpersons", self.ui.otherpersons_box.toPlainText())
         self.simulation.set_project_parameter("projectpath", self.ui.projpath_line.text())
         self.simulation.set_project_parameter("keepcopy", int(self.ui.keepcopy_check.isChecked()))
+        self.simulation.set_project_parameter("rastercache", int(self.ui.rastercache_check.isChecked()))
+        self.simulation.set_project_parameter("rasteroverviews", int(self.ui.rasteroverviews_check.isChecked()))
         self.simulation.set_project_parameter("synopsis", self.ui.synopsis_box.toPlainText())
         self.simulation.set_project_parameter("project_coord_sys", self.ui.coords_combo.currentText())
         self.simulation.set_project_parameter("project_epsg", int(self.ui.epsg_line.text()))
@@ -43,6 +43,7 @@ import random
 import xml.etree.ElementTree as ET
 import shutil
 import tempfile
+import multiprocessing
 
 # --- URBANBEATS LIBRARY IMPORTS ---
 import model.progref.ubglobals as ubglobals
@@ -1440,6 +1441,7 @@ sys.excepthook = exception_hook
 
 # --- MAIN PROGRAM RUNTIME ---
 if __name__ == "__main__":
+    multiprocessing.freeze_support()    # Worker processes of the zonal statistics in frozen (PyInstaller) builds
 
     # --- OBTAIN AND STORE PATH DATA FOR PROGRAM ---
     UBEATSROOT = os.path.dirname(sys.argv[0])  # Obtains the program's root directory
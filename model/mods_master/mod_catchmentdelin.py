@@ -29,7 +29,8 @@ import model.ublibs.ubdatatypes as ubdata
 import model.ublibs.ubspatial as ubspatial
 
 import numpy as np
-from shapely.geometry import Polygon, LineString
+from shapely.geometry import Polygon
+from shapely.prepared import prep
 
 class DelineateFlowSubCatchments(UBModule):
     """ Delineates water flow paths and sub-catchments across the simulation grid. These flowpaths are topogrpahically
@@ -53,6 +54,7 @@ class DelineateFlowSubCatchments(UBModule):
         # KEY GUIDING VARIABLES
         self.assets = None
         self.griditems = None
+        self.elevations = None      # Elev_Avg of all grid assets, indexed by asset ID
         self.meta = None
         self.xllcorner = None
         self.yllcorner = None
@@ -187,6 +189,15 @@ class DelineateFlowSubCatchments(UBModule):
         drainfeats = ubspatial.import_linear_network(fullpath, "LINES", (self.xllcorner, self.yllcorner))
         self.notify("Total Drainage Features to check: "+str(len(drainfeats)))
 
+        if self.assetident in ["BlockID", "HexID", "CellID"]:     # REGULAR GRID - Walk the lines across the cells
+            drainids = self.find_drain_cells_on_regular_grid(drainfeats)
+            for i in range(len(self.griditems)):
+                curasset = self.griditems[i]
+                if curasset.get_attribute("Status") == 0:
+                    continue
+                curasset.add_attribute("HasDrain", int(curasset.get_attribute(self.assetident) in drainids))
+            return True
+
         assets_with_drainage_data = []
         for i in range(len(self.griditems)):
             curasset = self.griditems[i]
@@ -194,12 +205,12 @@ class DelineateFlowSubCatchments(UBModule):
             if curasset.get_attribute("Status") == 0:
                 continue
             coordinates = curasset.get_points()
-            gridpoly = Polygon([(c[0], c[1]) for c in coordinates])
+            gridpoly = prep(Polygon([(c[0], c[1]) for c in coordinates]))
 
             hasdrain = 0
             for j in range(len(drainfeats)):
-                path = LineString(drainfeats[j].get_points())
-                if not path.intersects(gridpoly):
+                path = drainfeats[j].get_shapely_geometry()     # Cached, created only once per drainage line
+                if not gridpoly.intersects(path):
                     continue
                 else:
                     hasdrain = 1
@@ -207,6 +218,46 @@ class DelineateFlowSubCatchments(UBModule):
             curasset.add_attribute("HasDrain", hasdrain)
         return True
 
+    def find_drain_cells_on_regular_grid(self, drainfeats):
+        """Traverses each segment of the drainage lines across the SQUARES, HEXAGONS or RASTER (fishnet) grid and
+        returns the set of IDs of all grid cells the lines pass through or touch. Cells are found directly from the grid
+        layout, so the work is proportional to the length of the drainage network rather than the size of the grid.
+
+        :param drainfeats: list of UBVector() drainage lines
+        :return: set of asset IDs (integers) of the grid cells containing drainage
+        """
+        if self.assetident == "HexID":
+            layout = ubspatial.get_hex_grid_layout(self.meta)
+            cols = self.meta.get_attribute("HexWide")
+        elif self.assetident == "BlockID":
+            cellsize = self.meta.get_attribute("BlockSize")
+            cols, rows = self.meta.get_attribute("BlocksWide"), self.meta.get_attribute("BlocksTall")
+        else:
+            cellsize = self.meta.get_attribute("Cellsize")
+            cols, rows = self.meta.get_attribute("Columns"), self.meta.get_attribute("Rows")
+
+        drainids = set()
+        for j in range(len(drainfeats)):
+            coordinates = drainfeats[j].get_shapely_geometry().coords
+            for k in range(max(len(coordinates) - 1, 1)):   # Single-point lines are treated as a zero-length segment
+                p0 = coordinates[k][:2]
+                p1 = coordinates[min(k + 1, len(coordinates) - 1)][:2]
+                if self.assetident != "HexID":
+                    drainids.update([r * cols + c + 1 for c, r in ubspatial.get_segment_square_cells(p0, p1, cellsize,
+                                                                                                     cols, rows)])
+                    continue
+
+                # Hexes near the segment are checked against their geometry as they do not tile by rows and columns
+                for c, r in ubspatial.get_segment_hex_candidates(p0, p1, layout):
+                    hexid = r * cols + c + 1
+                    if hexid in drainids:
+                        continue
+                    curhex = self.assets.get_asset_by_id("HexID", hexid)
+                    if curhex is not None and \
+                            ubspatial.segment_intersects_convex_polygon(p0, p1, curhex.get_points()):
+                        drainids.add(hexid)
+        return drainids
+
     def regular_grid_flowpath_delineation(self):
         """Delineates the flow paths according to the chosen method and saves the information to the blocks.
 
@@ -216,6 +267,11 @@ class DelineateFlowSubCatchments(UBModule):
         river_blocks = []
         lake_ids =[]
 
+        # Read the elevations of all assets in one call, neighbourhoods are then looked up by ID in this array
+        ids = self.assets.get_asset_ids(self.assetident)
+        self.elevations = np.full(int(ids.max()) + 1 if len(ids) else 1, np.nan)
+        self.elevations[ids] = self.assets.get_attribute_array(self.assetident, "Elev_Avg", ids=ids)
+
         for i in range(len(self.griditems)):
             curasset = self.griditems[i]
             curassetid = curasset.get_attribute(self.assetident)
@@ -254,12 +310,9 @@ class DelineateFlowSubCatchments(UBModule):
             if self.guide_natural or self.guide_built:      # If we use natural or built features as a guide, then...
                 neighbours_z = self.get_modified_neighbours_z(curasset) # ret. [[ID], [Elevation]]
                 if neighbours_z is None:        # If the current asset has no natural or built features adjacent...
-                    neighbours_z = self.assets.retrieve_attribute_value_list(self.assetident, "Elev_Avg",
-                                                                               curasset.get_attribute(
-                                                                                   "Neighbours"))
+                    neighbours_z = self.get_neighbours_z(curasset.get_attribute("Neighbours"))
             else:
-                neighbours_z = self.assets.retrieve_attribute_value_list(self.assetident, "Elev_Avg",
-                                                                           curasset.get_attribute("Neighbours"))
+                neighbours_z = self.get_neighbours_z(curasset.get_attribute("Neighbours"))
             print(f"Neighbour Z: {neighbours_z}")
 
             # Find the downstream block unless it's a sink
@@ -276,7 +329,7 @@ class DelineateFlowSubCatchments(UBModule):
             if flow_id == -9999:
                 avg_slope = 0
             else:
-                down_block = self.assets.get_asset_with_name(self.assetident + str(downstream_id))
+                down_block = self.assets.get_asset_by_id(self.assetident, downstream_id)
                 dx = curasset.get_attribute("CentreX") - down_block.get_attribute("CentreX")
                 dy = curasset.get_attribute("CentreY") - down_block.get_attribute("CentreY")
                 dist = float(np.sqrt((dx * dx) + (dy * dy)))
@@ -300,6 +353,19 @@ class DelineateFlowSubCatchments(UBModule):
             self.connect_river_assets(river_blocks)  # [TO DO]
         return True
 
+    def get_neighbours_z(self, nhd):
+        """Retrieves the z-values of the given neighbours from the elevation array of all assets. Neighbours without
+        elevation data are left out.
+
+        :param nhd: list of the IDs of the neighbouring assets
+        :return: a list of z-values for the neighbours in ascending order of their IDs [ [BlockID], [Z-value] ]
+        """
+        nhd = np.unique(np.asarray(nhd, dtype=np.int64))
+        nhd = nhd[(nhd >= 0) & (nhd < len(self.elevations))]
+        nhd_z = self.elevations[nhd]
+        valid = ~np.isnan(nhd_z)
+        return [nhd[valid].tolist(), nhd_z[valid].tolist()]
+
     def get_modified_neighbours_z(self, curasset):
         """Retrieves the z-values of all adjacent blocks within the current block's neighbourhood accounting for
         the presence of drainage infrastructure or natural features.
@@ -310,16 +376,16 @@ class DelineateFlowSubCatchments(UBModule):
         nhd = curasset.get_attribute("Neighbours")
         nhd_z = [[], []]
         # Scan neighbourhood for Blocks with Rivers/Lakes
-        for n in nhd:
-            nblock = self.assets.get_asset_with_name(self.assetident + str(n))
+        nblocks = self.assets.get_many(self.assetident, nhd)
+        for n, nblock in zip(nhd, nblocks):
             if self.guide_natural:
                 if nblock.get_attribute("HasRiver") or nblock.get_attribute("HasLake"):
                     nhd_z[0].append(n)
-                    nhd_z[1].append(nblock.get_attribute("Elev_Avg"))
+                    nhd_z[1].append(float(self.elevations[n]))
             if self.guide_built:
                 if nblock.get_attribute("HasDrain") and n not in nhd_z[0]:
                     nhd_z[0].append(n)
-                    nhd_z[1].append(nblock.get_attribute("Elev_Avg"))
+                    nhd_z[1].append(float(self.elevations[n]))
         if len(nhd_z[0]) == 0:
             return None
         else:
@@ -349,7 +415,7 @@ class DelineateFlowSubCatchments(UBModule):
         for i in range(len(sink_ids)):
             current_sinkid = sink_ids[i]
             self.notify("Attemtping to unblock flow from "+ self.assetident + str(current_sinkid))
-            curasset = self.assets.get_asset_with_name(self.assetident + str(current_sinkid))
+            curasset = self.assets.get_asset_by_id(self.assetident, current_sinkid)
 
             if curasset.get_attribute("HasRiver") or curasset.get_attribute("HasLake"):
                 # If the Block is a river or lake block, do not attempt to unblock it
@@ -362,8 +428,7 @@ class DelineateFlowSubCatchments(UBModule):
             possible_id_z = []
             possibility = 0
 
-            for j in nhd:
-                nhd_blk = self.assets.get_asset_with_name(self.assetident+str(j))
+            for j, nhd_blk in zip(nhd, self.assets.get_many(self.assetident, nhd)):
                 if nhd_blk.get_attribute("Status") == 0:
                     continue    # Continue if nhd block has zero status
 
@@ -395,7 +460,7 @@ class DelineateFlowSubCatchments(UBModule):
         """
         current_id = curasset.get_attribute(self.assetident)
         downstream_id = curasset.get_attribute("downID")
-        down_block = self.assets.get_asset_with_name(self.assetident+str(downstream_id))
+        down_block = self.assets.get_asset_by_id(self.assetident, downstream_id)
 
         x_up = curasset.get_attribute(pt_attribute+"X")
         y_up = curasset.get_attribute(pt_attribute+"Y")
@@ -408,7 +473,6 @@ class DelineateFlowSubCatchments(UBModule):
         down_point = (x_down, y_down, z_down)
 
         network_link = ubdata.UBVector((up_point, down_point))
-        network_link.determine_geometry((up_point, down_point))
         network_link.add_attribute("FlowpathID", current_id)
         network_link.add_attribute(self.assetident, current_id)
         network_link.add_attribute("DownID", downstream_id)
@@ -429,14 +493,13 @@ class DelineateFlowSubCatchments(UBModule):
         :param nhd_z: elevation of all its neighbours and corresponding IDs [[IDs], [Z-values]]
         :return: down_id: block ID that water drains to, min(dz) the largest elevation difference.
         """
-        dz = []
-        for i in range(len(nhd_z[1])):
-            dz.append(nhd_z[1][i] - z)     # Calculate the elevation difference
-        if min(dz) < 0:    # If there is a drop in elevation - this also means the area cannot be flat!
-            down_id = nhd_z[0][dz.index(min(dz))]    # The ID corresponds to the minimum elevation difference
+        dz = np.asarray(nhd_z[1], dtype=np.float64) - z     # Calculate the elevation difference
+        lowest = int(np.argmin(dz))     # First occurrence of the minimum elevation difference
+        if dz[lowest] < 0:    # If there is a drop in elevation - this also means the area cannot be flat!
+            down_id = nhd_z[0][lowest]    # The ID corresponds to the minimum elevation difference
         else:
             down_id = -9999  # Otherwise there is a sink in the current Block
-        return down_id, min(dz)
+        return down_id, float(dz[lowest])
 
     def delineate_basin_structures(self):
         """Delineates sub-basins across the entire blocksmap specified by the collection of blocks in 'blockslist'.
@@ -503,8 +566,7 @@ class DelineateFlowSubCatchments(UBModule):
                 basin_id += 1
                 curasset.add_attribute("BasinID", basin_id)  # Set the current Basin ID
                 curasset.add_attribute("Outlet", 1)  # Outlet = TRUE at current Block
-                for j in upstream_ids:
-                    upblock = self.assets.get_asset_with_name(self.assetident + str(j))
+                for upblock in self.assets.get_many(self.assetident, upstream_ids):
                     upblock.add_attribute("BasinID", basin_id)  # Assign basin ID to all upstream blocks
                     upblock.add_attribute("Outlet", 0)  # Upstream blocks are NOT outlets!
 
@@ -82,6 +82,16 @@ class MapLandUseToSimGrid(UBModule):
         self.singlelu = 0
         self.spatialmetrics = 0
 
+        self.create_parameter("zonalstats", BOOL, "Mask all assets in a single pass with the zonal statistics engine?")
+        self.create_parameter("zonalprocesses", DOUBLE, "Zonal statistics processes, each reads its own raster tiles")
+        self.zonalstats = 0
+        self.zonalprocesses = 1
+
+        self.create_parameter("useoverviews", BOOL, "Map from the coarsest raster overview fine enough for the grid?")
+        self.create_parameter("overviewtolerance", DOUBLE, "Times finer than the grid cells an overview must be")
+        self.useoverviews = 0
+        self.overviewtolerance = 10.0
+
     def set_module_data_library(self, datalib):
         self.datalibrary = datalib
 
@@ -130,7 +140,9 @@ class MapLandUseToSimGrid(UBModule):
             self.notify_progress(30)
         else:
             # RASTER FORMAT - OPEN THE FILE
-            self.landusemap = rasterio.open(fullpath)
+            cellsize = ubspatial.get_simgrid_cell_size(self.meta) if self.useoverviews else None
+            self.landusemap = ubspatial.open_raster(fullpath, self.datalibrary.get_raster_cache_file(lumap), cellsize,
+                                                    self.overviewtolerance)
             self.nodata = self.landusemap.nodata
             lufmt = "RASTER"
 
@@ -166,89 +178,87 @@ class MapLandUseToSimGrid(UBModule):
     # ==========================================
     def map_polygonal_landuse_to_simgrid(self):
         griditems = self.assets.get_assets_with_identifier(self.assetident)
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        lucarea = np.zeros((len(activeitems), len(UBLANDUSENAMES)))     # Class-area matrix of all active assets
+        assetareas = np.zeros(len(activeitems))
 
-        for i in range(len(griditems)):
-            if griditems[i].get_attribute("Status") == 0:
-                continue
+        # Index the land use features once, each asset then only overlays the features near it
+        lufeatures = [feat.get_geometry_as_shapely_polygon() for feat in self.landusemap]
+        overlayindex = ubspatial.build_overlay_index(lufeatures)
+        lucclasses = {}     # Land use category of each feature, looked up the first time the feature is overlaid
 
+        for i in range(len(activeitems)):
             # Get the current asset's UBVector() Object and Geometry
-            curasset = griditems[i]
-            curassetid = curasset.get_attribute(self.assetident)
+            curasset = activeitems[i]
             curassetpoly = curasset.get_geometry_as_shapely_polygon()
+            assetareas[i] = curassetpoly.area
 
             mdata = []          # Trackers of land use within the asset
             areavector = []
 
-            for j in self.landusemap:           # Loop across the land use map
-                feat = j.get_geometry_as_shapely_polygon()
-                if not feat.intersects(curassetpoly):
-                    continue
-                isectionarea = feat.intersection(curassetpoly).area
+            overlap = ubspatial.calculate_overlay_areas(overlayindex, curassetpoly)
+            for j, isectionarea in zip(overlap[0].tolist(), overlap[1].tolist()):
+                if j not in lucclasses:
+                    lucclasses[j] = self.get_luc_category(self.landusemap[j].get_attribute(self.landuseattr))
+                if lucclasses[j] is None:
+                    continue    # Unrecognised land use, skip
+                mdata.append(lucclasses[j])
+                areavector.append(isectionarea)
 
-                if isectionarea != 0:
-                    # Add information to the landuse tally - get the class and reclassify if necessary
-                    lucclass = j.get_attribute(self.landuseattr)
-                    if self.lureclass:
-                        lucclass = self.lureclasssystem[lucclass]       # Reclassify before figuring out the number
-
-                    if lucclass in UBLANDUSEABBR:       # Check for the abbreviated form first...
-                        luccat = UBLANDUSEABBR.index(lucclass) + 1
-                    elif lucclass in UBLANDUSENAMES:       # Check for the full name form
-                        luccat = UBLANDUSENAMES.index(lucclass) + 1
-                    elif int(lucclass) >= 1 and int(lucclass) <= 16:    # Could be the number code for the category
-                        luccat = int(lucclass)
-                    else:
-                        continue    # Unrecognised land use, skip
-                    mdata.append(luccat)
-                    areavector.append(isectionarea)
-
-            if len(mdata) == 0 or mdata is None:
-                self.notify(self.assetident+ str(curassetid) + " not within bounds or has no land use data, skipping!")
-                self.set_landuse_to_none(curasset)
-                continue
+            lucarea[i] = self.tally_luc_areas(mdata, areavector)
 
-            if self.singlelu:
-                luc, activity = self.find_dominant_luc(mdata, curassetpoly.area, areavector)
-                curasset.add_attribute("Activity", activity)
-                curasset.add_attribute("LandUse", UBLANDUSENAMES[luc-1])
-            else:
-                luc, activity = self.tally_lu_frequency(mdata, curassetpoly.area, areavector)
-                curasset.add_attribute("Activity", activity)
-                self.write_lu_prop_attributes(curasset, luc)
-                if self.spatialmetrics:
-                    self.calculate_spatial_metrics(curasset, mdata, areavector)
+        self.write_landuse_attributes(activeitems, lucarea, assetareas)
         return True
 
+    def get_luc_category(self, lucclass):
+        """Returns the land use category number (1 to 16) of a land use class given as abbreviation, full name or number
+        code, reclassifying it first if the module uses a reclassification system. Returns None if unrecognised."""
+        if self.lureclass:
+            lucclass = self.lureclasssystem[lucclass]       # Reclassify before figuring out the number
+
+        if lucclass in UBLANDUSEABBR:       # Check for the abbreviated form first...
+            return UBLANDUSEABBR.index(lucclass) + 1
+        elif lucclass in UBLANDUSENAMES:       # Check for the full name form
+            return UBLANDUSENAMES.index(lucclass) + 1
+        elif int(lucclass) >= 1 and int(lucclass) <= 16:    # Could be the number code for the category
+            return int(lucclass)
+        return None
+
     def map_raster_landuse_to_simgrid(self):
         """Maps the land use raster data to the simulation grid using raster masking."""
         griditems = self.assets.get_assets_with_identifier(self.assetident)
-
-        for i in range(len(griditems)):
-            if griditems[i].get_attribute("Status") == 0:
-                continue
-
-            curasset = griditems[i]
-            curassetid = curasset.get_attribute(self.assetident)
-            curassetpoly = curasset.get_geometry_as_shapely_polygon()
-
-            mdata = ubspatial.retrieve_raster_data_from_mask(self.landusemap, curasset, self.xllcorner, self.yllcorner)
-
-            if mdata is None or len(mdata) == 0:
-                self.notify(self.assetident + str(curassetid) + " not within bounds or has no land use data, skipping!")
-                self.set_landuse_to_none(curasset)
-                continue
-
-            # Tally Land Use Frequency or Find the Dominant Land use + spatial metrics
-            if self.singlelu:
-                luc, activity = self.find_dominant_luc(mdata, curassetpoly.area)
-                curasset.add_attribute("Activity", activity)
-                curasset.add_attribute("LandUse", UBLANDUSENAMES[luc-1])
-            else:
-                luc, activity = self.tally_lu_frequency(mdata, curassetpoly.area)
-                curasset.add_attribute("Activity", activity)
-                self.write_lu_prop_attributes(curasset, luc)
-                if self.spatialmetrics:
-                    self.calculate_spatial_metrics(curasset, mdata)
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        if self.zonalstats:     # Stream the map in tiles once and tally the land use classes of all active assets
+            self.notify("Calculating zonal statistics for all assets")
+            cachepath = ubspatial.get_label_cache_path(self.activesim.get_project_path())
+            squaregrid = ubspatial.get_square_grid_from_meta(self.meta)
+            lucategories = np.arange(1, len(UBLANDUSENAMES) + 1)
+            zonal = ubspatial.retrieve_zonal_statistics(self.landusemap, activeitems, self.xllcorner, self.yllcorner,
+                                                        categories=lucategories, cachepath=cachepath,
+                                                        squaregrid=squaregrid,
+                                                        processes=int(self.zonalprocesses))
+
+        # Tally the area of each land use class in all assets: number of cells of the class x cell area
+        cellarea = self.landusemap.res[0] * self.landusemap.res[1]
+        assetareas = np.array([asset.get_geometry_as_shapely_polygon().area for asset in activeitems])
+        if self.zonalstats:
+            lucarea = zonal["histogram"] * cellarea
+            unclassified = int(zonal["count"].sum() - zonal["histogram"].sum())
+        else:
+            lucarea = np.zeros((len(activeitems), len(UBLANDUSENAMES)))
+            unclassified = 0
+            for i in range(len(activeitems)):
+                mdata = ubspatial.retrieve_raster_data_from_mask(self.landusemap, activeitems[i], self.xllcorner,
+                                                                 self.yllcorner)
+                if mdata is not None:
+                    lucarea[i] = self.tally_luc_areas(mdata) * cellarea
+                    unclassified += self.count_unclassified_cells(mdata)
+
+        if unclassified > 0:
+            self.notify("Warning! "+str(unclassified)+" cells of the land use map have a value outside the 16 land "
+                        "use categories and were not counted")
+
+        self.write_landuse_attributes(activeitems, lucarea, assetareas)
         return True
 
     def polygonize_raster_data(self):
@@ -288,14 +298,14 @@ class MapLandUseToSimGrid(UBModule):
 
     def map_polygonized_raster_to_simgrid(self, lupolygons):
         griditems = self.assets.get_assets_with_identifier(self.assetident)
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        lucarea = np.zeros((len(activeitems), len(UBLANDUSENAMES)))     # Class-area matrix of all active assets
+        assetareas = np.zeros(len(activeitems))
 
-        for i in range(len(griditems)):
-            if griditems[i].get_attribute("Status") == 0:
-                continue
-
-            curasset = griditems[i]
-            curassetid = curasset.get_attribute(self.assetident)
+        for i in range(len(activeitems)):
+            curasset = activeitems[i]
             curassetpoly = curasset.get_geometry_as_shapely_polygon()
+            assetareas[i] = curassetpoly.area
 
             mdata = []
             areavector = []
@@ -314,25 +324,13 @@ class MapLandUseToSimGrid(UBModule):
                     if j[1].area == isectionarea:  # If the polygon is fully within the feature...
                         lutracker.append(j)    # Add to the list of items to remove at the end of the loop
 
-            if len(mdata) == 0 or mdata is None:
-                self.notify(self.assetident+ str(curassetid) + " not within bounds or has no land use data, skipping!")
-                self.set_landuse_to_none(curasset)
-                continue
-
-            if self.singlelu:
-                luc, activity = self.find_dominant_luc(mdata, curassetpoly.area, areavector)
-                curasset.add_attribute("Activity", activity)
-                curasset.add_attribute("LandUse", UBLANDUSENAMES[luc-1])
-            else:
-                luc, activity = self.tally_lu_frequency(mdata, curassetpoly.area, areavector)
-                curasset.add_attribute("Activity", activity)
-                self.write_lu_prop_attributes(curasset, luc)
-                if self.spatialmetrics:
-                    self.calculate_spatial_metrics(curasset, mdata, areavector)
+            lucarea[i] = self.tally_luc_areas(mdata, areavector)
 
             # Before end of loop, remove scanned LU items that will not intersect with future polygons
             for item in lutracker:
                 lupolygons.pop(lupolygons.index(item))
+
+        self.write_landuse_attributes(activeitems, lucarea, assetareas)
         return True
 
     def set_landuse_to_none(self, asset):
@@ -346,90 +344,77 @@ class MapLandUseToSimGrid(UBModule):
                 asset.add_attribute("pLU_"+UBLANDUSEABBR[i], 0)
         return True
 
-    def write_lu_prop_attributes(self, asset, luprops):
-        """Writes all land use proportion attributes"""
-        for i in range(len(UBLANDUSEABBR)):
-            asset.add_attribute("pLU_"+UBLANDUSEABBR[i], luprops[i])
-        return True
-
-    def tally_lu_frequency(self, masklist, assetarea, areavector=None):
-        """Tallies the frequency of each land use category in the masklist and returns the proportions of total area
-        and the total activity for the specified asset. Areavector is specified if the masklist items do not have
-        uniform area."""
-        luclist = self.count_luc_data(masklist, areavector)      # This returns the frequency matrix
-
-        sum_luc = sum(luclist)  # Global sum across the classes - either a count or an area depending on raster/vect
-        for i in range(len(luclist)):
-            luclist[i] = float(luclist[i] / sum_luc)      # Relative proportion of LUCs... pLU_??? attribute
-
-        activity = self.calculate_asset_activity(masklist, assetarea, areavector)
-        return luclist, activity
-
-    def find_dominant_luc(self, masklist, assetarea, areavector=None):
-        """Finds the dominant land use based on area within a provided mask list and returns the single dominant land
-        use category. If the areavector is provided, then items in the masklist do not have the same uniform area. Also
-        returns total Activity of the current data tallied."""
-        luclist = self.count_luc_data(masklist, areavector)
-        luccat = luclist.index(max(luclist)) + 1        # Category is +1
-        activity = self.calculate_asset_activity(masklist, assetarea, areavector)
-        return luccat, activity
-
-    def calculate_asset_activity(self, masklist, assetarea, areavector=None):
-        """Determines the amount of the cell for which data is available, max of 1.0"""
-        if areavector is None:  # RASTER - COUNT * RESOLUTION / ASSET AREA
-            cellarea = self.landusemap.res[0] * self.landusemap.res[1]
-            activity = min((float(len(masklist)) * cellarea) / assetarea, 1.0)  # N * Acell / Assetarea
-        else:  # VECTOR - AREAS DIVIDED BY EACH OTHER
-            activity = min(sum(areavector) / assetarea, 1.0)  # Sum of the area vector
-        return activity
-
-    def count_luc_data(self, masklist, areavector=None):
-        """A counting algorithm to sort the input mask list land uses into the 16 classes."""
-        luclist = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # Holds counts for all 16 land uses
-
-        for i in range(len(masklist)):
-            if areavector is None:  # If raster...
-                luclist[masklist[i] - 1] += 1  # Tally frequency
-            else:  # Vector data...
-                luclist[masklist[i] - 1] += areavector[i]  # Tally total area
-        return luclist
-
-    def calculate_spatial_metrics(self, asset, masklist, areavector=None):
-        """Calculates the Richness, Shannon Dominance, Evenness and Diversity indices for the specified asset given
-        its masklist. If the areavector is specified, then the items in the masklist do not have uniform area."""
-        lucprops = self.count_luc_data(masklist, areavector)
-        sumluc = sum(lucprops)
-        for i in range(len(lucprops)):
-            lucprops[i] = lucprops[i] / sumluc
-
-        # Richness Index
-        # The total number of unique categories in the asset
-        richness = 0
-        for i in lucprops:
-            if i != 0:
-                richness += 1
-
-        # Shannon Diversity Index - measures diversity in categorical data, the information entropy of
-        # the distribution: H = -sum(pi ln(pi)) - where pi is the proportion of land use i
-        shandiv = 0
-        for sdiv in lucprops:
-            if sdiv != 0:
-                shandiv += sdiv * math.log(sdiv)
-        shandiv *= -1
-
-        # Shannon Dominance Index - The degree to which a single class dominates in the area, 0 = evenness
-        shandom = math.log(richness) - shandiv
-
-        # Shannon Evenness Index: Similar to dominance, the level of evenness among the land classes
-        if richness == 1:
-            shaneven = 1
-        else:
-            shaneven = shandiv / math.log(richness)
+    def tally_luc_areas(self, masklist, areavector=None):
+        """Tallies the input mask list land uses into the 16 classes. Returns the count of each class or, if the
+        areavector is specified (i.e. the masklist items do not have uniform area), the total area of each class.
+        Values outside the 16 classes are not counted, see count_unclassified_cells()."""
+        masklist = np.asarray(masklist, dtype=np.int64).ravel()
+        inrange = (masklist >= 1) & (masklist <= len(UBLANDUSENAMES))
+        weights = None if areavector is None else np.asarray(areavector, dtype=np.float64)[inrange]
+        return np.bincount(masklist[inrange] - 1, weights=weights, minlength=len(UBLANDUSENAMES)).astype(np.float64)
+
+    def count_unclassified_cells(self, masklist):
+        """Returns the number of items in the mask list whose value is not one of the 16 land use classes."""
+        masklist = np.asarray(masklist, dtype=np.int64).ravel()
+        return int(np.count_nonzero((masklist < 1) | (masklist > len(UBLANDUSENAMES))))
+
+    def calculate_landuse_metrics(self, lucarea, assetareas):
+        """Calculates the land use proportions, dominant land use, Activity and the Richness, Shannon Diversity,
+        Dominance and Evenness indices of all assets at once from their class-area matrix.
+
+        :param lucarea: numpy array (assets x 16) of the area of each land use class within each asset
+        :param assetareas: numpy array of the area of each asset
+        :return: dict of numpy arrays with one entry per asset, rows without any land use are NaN
+        """
+        total = lucarea.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            props = lucarea / total[:, None]        # Relative proportion of LUCs... pLU_??? attribute
+            activity = np.minimum(total / assetareas, 1.0)      # Area with land use data / asset area, max of 1.0
+
+            # Richness Index - the total number of unique categories in the asset
+            richness = (props > 0).sum(axis=1)
+
+            # Shannon Diversity Index - measures diversity in categorical data, the information entropy of
+            # the distribution: H = -sum(pi ln(pi)) - where pi is the proportion of land use i
+            diversity = -np.where(props > 0, props * np.log(np.where(props > 0, props, 1.0)), 0.0).sum(axis=1)
+
+            # Shannon Dominance Index - The degree to which a single class dominates in the area, 0 = evenness
+            dominance = np.log(richness) - diversity
+
+            # Shannon Evenness Index: Similar to dominance, the level of evenness among the land classes
+            evenness = np.where(richness == 1, 1.0, diversity / np.log(richness))
+
+        return {"total": total, "props": props, "activity": activity, "dominant": np.argmax(lucarea, axis=1) + 1,
+                "richness": richness, "diversity": diversity, "dominance": dominance, "evenness": evenness}
+
+    def write_landuse_attributes(self, assets, lucarea, assetareas):
+        """Writes the Activity and either the dominant LandUse or the pLU_ proportions (and spatial metrics if
+        selected) to all assets based on their class-area matrix. Assets without land use are set to none.
+
+        :param assets: list of assets, one for each row of lucarea
+        :param lucarea: numpy array (assets x 16) of the area of each land use class within each asset
+        :param assetareas: numpy array of the area of each asset
+        """
+        metrics = self.calculate_landuse_metrics(lucarea, np.asarray(assetareas, dtype=np.float64))
+        for i in range(len(assets)):
+            curasset = assets[i]
+            if metrics["total"][i] <= 0:
+                self.notify(self.assetident + str(curasset.get_attribute(self.assetident)) +
+                            " not within bounds or has no land use data, skipping!")
+                self.set_landuse_to_none(curasset)
+                continue
 
-        asset.add_attribute("Richness", richness)
-        asset.add_attribute("Diversity", shandiv)
-        asset.add_attribute("Dominance", shandom)
-        asset.add_attribute("Evenness", shaneven)
+            curasset.add_attribute("Activity", float(metrics["activity"][i]))
+            if self.singlelu:
+                curasset.add_attribute("LandUse", UBLANDUSENAMES[int(metrics["dominant"][i]) - 1])
+                continue
+            for j in range(len(UBLANDUSEABBR)):
+                curasset.add_attribute("pLU_"+UBLANDUSEABBR[j], float(metrics["props"][i][j]))
+            if self.spatialmetrics:
+                curasset.add_attribute("Richness", int(metrics["richness"][i]))
+                curasset.add_attribute("Diversity", float(metrics["diversity"][i]))
+                curasset.add_attribute("Dominance", float(metrics["dominance"][i]))
+                curasset.add_attribute("Evenness", float(metrics["evenness"][i]))
         return True
 
     # DEBUG FUNCTION - EXPORTS THE POLYGONIZED MAP TO A SHAPEFILE
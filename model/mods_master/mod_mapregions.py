@@ -25,6 +25,7 @@ __copyright__ = "Copyright 2017-2022. Peter M. Bach"
 
 # --- PYTHON LIBRARY IMPORTS ---
 from shapely.geometry import Polygon
+import numpy as np
 
 from model.ubmodule import *
 import model.ublibs.ubspatial as ubspatial
@@ -116,18 +117,18 @@ class MapRegionsToSimGrid(UBModule):
 
         # METADATA
         self.notify("Total assets to map data to: "+str(len(griditems)))
-        self.notify_progress(10)    # 20 to 100% progress spaced out depending on number of boundaries...
-        current_progress = 10
-        progress_increment = 80.0 / float(len(self.boundaries_to_map))
+        self.notify_progress(10)
 
         stakeholders = self.assets.get_assets_with_identifier("Stakeholder")
         stakeholderIDcount = len(stakeholders)+1      # Start the stakeholder ID count
 
+        # --- SECTION 1 - LOAD ALL BOUNDARY LAYERS AND INDEX THEIR FEATURES TOGETHER
+        layers = []     # The boundary features of each entry of boundaries_to_map
+        features = []   # Geometries of all features of all layers and the layer and feature index of each
+        featurelayer = []
+        featureindex = []
         for i in range(len(self.boundaries_to_map)):
-            stakeholderlist = []
             boundary = self.boundaries_to_map[i]
-            self.notify("Mapping current boundary: "+str(boundary["label"]))
-
             dataidindex = boundary_datarefs[0].index(boundary['datafile'])       # Get the Data Library ID
             dataid = boundary_datarefs[1][dataidindex]
             dataref = self.datalibrary.get_data_with_id(dataid)             # Get the Data reference
@@ -135,27 +136,48 @@ class MapRegionsToSimGrid(UBModule):
 
             boundaryfeats = ubspatial.import_polygonal_map(fullpath, "native", "Boundary",
                                                            (self.xllcorner, self.yllcorner))
-
             self.notify("Total features in "+str(boundary["datafile"])+": "+str(len(boundaryfeats)))
 
-            for a in range(len(griditems)):
-                if griditems[a].get_attribute("Status") == 0:
-                    continue
+            layers.append(boundaryfeats)
+            for b in range(len(boundaryfeats)):
+                features.append(boundaryfeats[b].get_geometry_as_shapely_polygon())
+                featurelayer.append(i)
+                featureindex.append(b)
+        featurelayer = np.array(featurelayer, dtype=np.int64)
+        featureindex = np.array(featureindex, dtype=np.int64)
+        overlayindex = ubspatial.build_overlay_index(features)
+
+        # --- SECTION 2 - FIND THE FEATURE OF LARGEST OVERLAP IN EACH LAYER FOR ALL ACTIVE ASSETS IN ONE PASS
+        self.notify("Overlaying "+str(len(features))+" boundary features with the simulation grid")
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        largestoverlap = np.full((len(activeitems), len(self.boundaries_to_map)), -1, dtype=np.int64)
+        for a in range(len(activeitems)):
+            overlap = ubspatial.calculate_overlay_areas(overlayindex, activeitems[a].get_geometry_as_shapely_polygon())
+            if len(overlap[0]) == 0:
+                continue
+            # Sort by layer, then largest area first, ties going to the first feature as in a sequential search
+            order = np.lexsort((overlap[0], -overlap[1], featurelayer[overlap[0]]))
+            ranked = overlap[0][order]
+            first = np.flatnonzero(np.diff(featurelayer[ranked], prepend=-1))
+            largestoverlap[a, featurelayer[ranked[first]]] = featureindex[ranked[first]]
+        current_progress = 50     # 50 to 90% progress spaced out depending on number of boundaries...
+        self.notify_progress(current_progress)
+        progress_increment = 40.0 / float(len(self.boundaries_to_map))
+
+        # --- SECTION 3 - WRITE THE REGION LABELS AND CREATE STAKEHOLDERS FOR EACH BOUNDARY LAYER
+        for i in range(len(self.boundaries_to_map)):
+            stakeholderlist = []
+            boundary = self.boundaries_to_map[i]
+            boundaryfeats = layers[i]
+            self.notify("Mapping current boundary: "+str(boundary["label"]))
 
-                cur_asset = griditems[a]
-                assetpoly = cur_asset.get_geometry_as_shapely_polygon()
-                intersectarea = 0
+            for a in range(len(activeitems)):
+                cur_asset = activeitems[a]
                 intersectname = ""
-                for b in boundaryfeats:
-                    feat = b.get_geometry_as_shapely_polygon()
-                    if not feat.intersects(assetpoly):
-                        continue
-                    newisectarea = feat.intersection(assetpoly).area
-                    if newisectarea > intersectarea:
-                        intersectarea = newisectarea
-                        intersectname = str(b.get_attribute(boundary["attname"]))
-
-                if intersectname != "" and intersectarea > 0:
+                if largestoverlap[a, i] != -1:
+                    intersectname = str(boundaryfeats[largestoverlap[a, i]].get_attribute(boundary["attname"]))
+
+                if intersectname != "":
                     cur_asset.add_attribute(boundary["label"], intersectname)
                     if intersectname not in stakeholderlist:
                         stakeholderlist.append(intersectname)
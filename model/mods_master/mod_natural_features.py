@@ -24,7 +24,7 @@ __author__ = "Peter M. Bach"
 __copyright__ = "Copyright 2017-2022. Peter M. Bach"
 
 # --- PYTHON LIBRARY IMPORTS ---
-from shapely.geometry import Polygon, LineString
+from shapely.geometry import Polygon
 
 from model.ubmodule import *
 import model.ublibs.ubspatial as ubspatial
@@ -135,21 +135,22 @@ class MapNaturalFeaturesToSimGrid(UBModule):
         self.notify("Total River Features to check: "+str(len(riverfeats)))
         self.notify_progress(20)
 
+        # Index the rivers once, each asset then only checks the rivers near it
+        overlayindex = ubspatial.build_overlay_index([feat.get_shapely_geometry() for feat in riverfeats])
+
         griditems = self.assets.get_assets_with_identifier(self.assetident)
         for i in range(len(griditems)):
             if griditems[i].get_attribute("Status") == 0:
                 continue
 
             curasset = griditems[i]
-            assetpts = curasset.get_points()
-            assetpoly = Polygon([c[:2] for c in assetpts])
+            assetpoly = Polygon([c[:2] for c in curasset.get_points()])    # Outline only, as in the original check
 
             hasriver = 0
             rivernames = []
-            for j in range(len(riverfeats)):
-                path = LineString(riverfeats[j].get_points())
-                if not path.intersects(assetpoly):
-                    continue
+            riverlength = 0.0       # Total length of rivers within the asset [m]
+            overlap = ubspatial.calculate_overlay_lengths(overlayindex, assetpoly)
+            for j, pathlength in zip(overlap[0].tolist(), overlap[1].tolist()):
                 rivername = riverfeats[j].get_attribute(self.rivermapattr)
                 if rivername in ["", None, " "] and self.riverignorenoname:
                     continue
@@ -159,6 +160,7 @@ class MapNaturalFeaturesToSimGrid(UBModule):
                     else:
                         rivernames.append(rivername)
                 hasriver = 1
+                riverlength += pathlength
 
             if hasriver:
                 curasset.add_attribute("HasRiver", 1)
@@ -166,6 +168,7 @@ class MapNaturalFeaturesToSimGrid(UBModule):
             else:
                 curasset.add_attribute("HasRiver", 0)
                 curasset.add_attribute("RiverNames", [])
+            curasset.add_attribute("RiverLength", riverlength)
 
         self.notify("Mapping of rivers completed!")
         self.notify_progress(50)
@@ -182,6 +185,9 @@ class MapNaturalFeaturesToSimGrid(UBModule):
         self.notify("Polygon features in lakes map: "+str(len(lakefeats)))
         self.notify_progress(70)
 
+        # Index the lakes once, each asset then only overlays the lakes near it
+        overlayindex = ubspatial.build_overlay_index([feat.get_geometry_as_shapely_polygon() for feat in lakefeats])
+
         griditems = self.assets.get_assets_with_identifier(self.assetident)
         for i in range(len(griditems)):
             if griditems[i].get_attribute("Status") == 0:
@@ -191,10 +197,9 @@ class MapNaturalFeaturesToSimGrid(UBModule):
 
             haslake = 0
             lakenames = []
-            for j in range(len(lakefeats)):
-                poly = lakefeats[j].get_geometry_as_shapely_polygon()
-                if (not poly.intersects(assetpoly)) or (poly.intersection(assetpoly).area == 0):
-                    continue    # Continue if no intersection or if the intersection area is 0 (i.e. boundary intersect)
+            lakearea = 0.0      # Total area of lakes within the asset [sqm]
+            overlap = ubspatial.calculate_overlay_areas(overlayindex, assetpoly)   # Boundary-only contacts left out
+            for j, isectionarea in zip(overlap[0].tolist(), overlap[1].tolist()):
                 lakename = lakefeats[j].get_attribute(self.lakemapattr)
                 if lakename in ["", None, " "] and self.lakeignorenoname:
                     continue
@@ -204,6 +209,7 @@ class MapNaturalFeaturesToSimGrid(UBModule):
                     else:
                         lakenames.append(lakename)
                 haslake = 1
+                lakearea += isectionarea
 
             if haslake:
                 curasset.add_attribute("HasLake", 1)
@@ -211,6 +217,7 @@ class MapNaturalFeaturesToSimGrid(UBModule):
             else:
                 curasset.add_attribute("HasLake", 0)
                 curasset.add_attribute("Lakenames", [])
+            curasset.add_attribute("LakeArea", lakearea)
 
         self.notify("Mapping of lakes completed!")
         self.notify_progress(90)
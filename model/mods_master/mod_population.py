@@ -59,6 +59,7 @@ class MapPopulationToSimGrid(UBModule):
         self.yllcorner = None
         self.assetident = ""
         self.populationmap = None
+        self.popmappath = None
         self.nodata = None
 
         # MODULE PARAMETERS
@@ -85,6 +86,16 @@ class MapPopulationToSimGrid(UBModule):
         self.landusemapdataid = "(select land use map)"
         self.landuseattr = "(attribute name)"
 
+        self.create_parameter("zonalstats", BOOL, "Map all assets in a single pass with the zonal statistics engine?")
+        self.create_parameter("zonalprocesses", DOUBLE, "Zonal statistics processes, each reads its own raster tiles")
+        self.zonalstats = 0
+        self.zonalprocesses = 1
+
+        self.create_parameter("useoverviews", BOOL, "Map from the coarsest raster overview fine enough for the grid?")
+        self.create_parameter("overviewtolerance", DOUBLE, "Times finer than the grid cells an overview must be")
+        self.useoverviews = 0
+        self.overviewtolerance = 10.0
+
     def set_module_data_library(self, datalib):
         self.datalibrary = datalib
 
@@ -118,6 +129,7 @@ class MapPopulationToSimGrid(UBModule):
         popmap = self.datalibrary.get_data_with_id(self.popmapdataid)
         filename = popmap.get_metadata("filename")
         fullpath = popmap.get_data_file_path() + filename
+        self.popmappath = fullpath
         self.notify("Loading Population Map: "+str(filename))
 
         # Determine data format... (1) Vector vs. (2) Raster
@@ -133,7 +145,11 @@ class MapPopulationToSimGrid(UBModule):
             print(self.populationmap)
         else:
             # RASTER FORMAT - OPEN THE FILE
-            self.populationmap = rasterio.open(fullpath)
+            cellsize = None
+            if self.useoverviews and self.popdataformat == "DEN":     # Averaged overviews would not keep totals
+                cellsize = ubspatial.get_simgrid_cell_size(self.meta)
+            cachefile = self.datalibrary.get_raster_cache_file(popmap)
+            self.populationmap = ubspatial.open_raster(fullpath, cachefile, cellsize, self.overviewtolerance)
             self.nodata = self.populationmap.nodata
             popfmt = "RASTER"
 
@@ -181,22 +197,38 @@ class MapPopulationToSimGrid(UBModule):
 
         map_population = 0
 
-        for i in range(len(griditems)):
-            if griditems[i].get_attribute("Status") == 0:
-                continue    # Skip if status is zero, could have resulted from another module switching it off.
-
-            asset = griditems[i]
+        # Skip if status is zero, could have resulted from another module switching it off.
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        if self.zonalstats:     # Rasterize all active assets once and sum the population map in a single pass
+            self.notify("Calculating zonal statistics for all assets")
+            cachepath = ubspatial.get_label_cache_path(self.activesim.get_project_path())
+            squaregrid = ubspatial.get_square_grid_from_meta(self.meta)
+            zonal = ubspatial.retrieve_zonal_statistics(self.populationmap, activeitems, self.xllcorner,
+                                                        self.yllcorner, cachepath=cachepath, squaregrid=squaregrid,
+                                                        processes=int(self.zonalprocesses))
+
+        for i in range(len(activeitems)):
+            asset = activeitems[i]
             assetid = asset.get_attribute(self.assetident)
 
-            # Mask and grab the data
-            mdata = ubspatial.retrieve_raster_data_from_mask(self.populationmap, asset, self.xllcorner, self.yllcorner)
-
-            if mdata is None:
+            # Mask and grab the data, only its total is needed
+            if self.zonalstats:
+                withinbounds = zonal["pixels"][i] > 0
+                popcount = zonal["count"][i]
+                popsum = zonal["sum"][i]
+            else:
+                mdata = ubspatial.retrieve_raster_data_from_mask(self.populationmap, asset, self.xllcorner,
+                                                                 self.yllcorner)
+                withinbounds = mdata is not None
+                popcount = 0 if mdata is None else mdata.size
+                popsum = 0 if popcount == 0 else mdata.sum()
+
+            if not withinbounds:
                 self.notify(self.assetident + str(assetid) + " not within bounds, skipping!")
                 asset.add_attribute("Population", 0)
                 continue
 
-            if mdata.size == 0:
+            if popcount == 0:
                 asset.add_attribute("Population", 0)
                 continue
             else:       # Work out metric
@@ -207,12 +239,12 @@ class MapPopulationToSimGrid(UBModule):
                     assetarea = asset.get_attribute("Area") / 10000.0       # [ha]
 
                     if assetarea < resarea:
-                        totalpop = assetarea * mdata.sum()
+                        totalpop = assetarea * popsum
                     else:
-                        totalpop = sum([mdata[i] * resarea for i in range(len(mdata))])
+                        totalpop = popsum * resarea
                     totalpop = totalpop * self.popcorrectfact   # CORRECTION?
                 else:   # COUNT
-                    totalpop = mdata.sum() * self.popcorrectfact    # CORRECTION?
+                    totalpop = popsum * self.popcorrectfact    # CORRECTION?
 
                 asset.add_attribute("Population", round(totalpop))
                 map_population += totalpop
@@ -228,30 +260,25 @@ class MapPopulationToSimGrid(UBModule):
 
         map_population = 0
 
-        for i in range(len(griditems)):
-            if griditems[i].get_attribute("Status") == 0:
-                continue
-
-            asset = griditems[i]
-            assetpoly = asset.get_geometry_as_shapely_polygon()
-
-            totalpop = 0   # Total population tally for this feature
-
-            for p in self.populationmap:                # For each population map feature
-                feat = p.get_geometry_as_shapely_polygon()
-                if not feat.intersects(assetpoly):      # No intersect - continue
-                    continue
-                isectionarea = feat.intersection(assetpoly).area
-
-                # Add total population to the tally for this block
-                data = float(p.get_attribute(self.popdataattr))
-                if self.popdataformat == "DEN":
-                    totalpop += (data * isectionarea/10000)    # [people/ha]
-                else:
-                    totalpop += data*(isectionarea/feat.area)  # area-weighted
+        # Intersection areas of all active assets and population features, cached for reruns with other attributes
+        activeitems = [asset for asset in griditems if asset.get_attribute("Status") != 0]
+        features = [p.get_geometry_as_shapely_polygon() for p in self.populationmap]
+        cachepath = ubspatial.get_label_cache_path(self.activesim.get_project_path())
+        overlap = ubspatial.retrieve_overlay_matrix(self.popmappath, features,
+                                                    [asset.get_geometry_as_shapely_polygon() for asset in activeitems],
+                                                    self.xllcorner, self.yllcorner, cachepath)
+
+        data = np.array([float(p.get_attribute(self.popdataattr)) for p in self.populationmap])
+        if self.popdataformat == "DEN":
+            weights = data / 10000      # [people/ha]
+        else:
+            featareas = np.array([feat.area for feat in features])
+            weights = np.divide(data, featareas, out=np.zeros(len(data)), where=featareas != 0)    # area-weighted
+        populations = overlap.dot(weights) * self.popcorrectfact
 
-            totalpop = totalpop * self.popcorrectfact
-            asset.add_attribute("Population", totalpop)
+        for i in range(len(activeitems)):
+            totalpop = float(populations[i])
+            activeitems[i].add_attribute("Population", totalpop)
             map_population += totalpop
         self.meta.add_attribute("Population", map_population)
         self.notify("Total Population mapped within boundary: "+str(int(map_population)))
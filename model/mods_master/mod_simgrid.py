@@ -28,6 +28,8 @@ from shapely.geometry import Polygon, LineString, Point
 from osgeo import ogr, osr
 from geolib import geohash as gh
 import math
+import numpy as np
+import scipy.sparse as sparse
 
 from model.ubmodule import *
 import model.ublibs.ubspatial as ubspatial
@@ -74,6 +76,13 @@ class CreateSimGrid(UBModule):
         self.boundaryname = "(select simulation boundary)"
         self.geometry_type = "SQUARES"  # SQUARES, HEXAGONS, VECTORPATCH, RASTER
 
+        self.create_parameter("columnar_store", BOOL, "Store asset attributes in columnar arrays?")
+        self.columnar_store = 0     # Recommended for large grids, attributes are kept in one array per asset type
+        self.create_parameter("compact_geometry", BOOL, "Store fishnet and parcel geometry in a shared buffer?")
+        self.compact_geometry = 0   # Recommended for large fishnets and parcel maps, reduces memory per polygon
+        self.create_parameter("build_adjacency", BOOL, "Build sparse adjacency matrices of the grid's neighbourhood?")
+        self.build_adjacency = 1
+
         # (1) Geometry Type: Square Blocks
         self.create_parameter("blocksize", DOUBLE, "Size of the square blocks")
         self.create_parameter("blocksize_auto", BOOL, "Determine the block size automatically?")
@@ -127,10 +136,14 @@ class CreateSimGrid(UBModule):
         # Get the asset collection, if it doesn't yet exist, create it.
         self.assets = self.activesim.get_asset_collection_by_name(self.gridname)
         if self.assets is None:
-            self.assets = ubdata.UBCollection(self.gridname, "Standalone")
+            self.assets = ubdata.UBCollection(self.gridname, "Standalone", columnar=bool(self.columnar_store))
             self.activesim.add_asset_collection_to_project(self.assets)
         else:
             self.assets.reset_assets()
+            if self.columnar_store:
+                self.assets.enable_columnar_store()
+            else:
+                self.assets.disable_columnar_store()
 
         # Metadata check - Any module that creates a new asset collection should do this check
         self.meta = self.assets.get_asset_with_name("meta")
@@ -197,6 +210,10 @@ class CreateSimGrid(UBModule):
             self.notify("Error, no geometry type specified")    # Should technically NEVER GET TO HERE
             return True
 
+        if self.build_adjacency:
+            self.notify("Building neighbourhood adjacency matrix")
+            self.build_adjacency_matrix()
+
         self.notify("Finished SimGrid Creation")
         self.meta.add_attribute("AssetIdent", self.assetident)  # Write the final identifier to the metadata
         self.notify_progress(100)    # Must notify of 100% progress if the 'close' button is to be renabled.
@@ -287,7 +304,7 @@ class CreateSimGrid(UBModule):
                 if direction_names[d] in exceptions:
                     continue
                 nhd_id = curblock_id + directional_factors[d]
-                if self.assets.get_asset_with_name("BlockID"+str(nhd_id)) is None:
+                if self.assets.get_asset_by_id("BlockID", nhd_id) is None:
                     blockslist[i].add_attribute(direction_names[d], 0)
                 else:
                     blockslist[i].add_attribute(direction_names[d], nhd_id)
@@ -351,6 +368,84 @@ class CreateSimGrid(UBModule):
         else:   # Block not within boundary, do not return anything
             return None
 
+    def build_adjacency_matrix(self):
+        """Builds sparse CSR adjacency matrices of the simulation grid from the neighbourhood of each asset and stores
+        them in the asset collection. Three edge weights are stored: "connectivity" (1 for each neighbour), "distance"
+        (centroid to centroid distance) and "sharededge" (length of the shared boundary, 0 for corner neighbours).
+        Raster cells have no neighbour lists, their Moore neighbourhood is derived from the rows and columns.
+
+        Neighbourhoods are symmetric, so the weights are calculated once per pair of neighbours and mirrored. Squares
+        and hexagons share a whole edge with their neighbours (squares share none with corner neighbours), only the
+        other geometries need the shared boundary from their polygons."""
+        if self.geometry_type == "RASTER":
+            return self.build_raster_adjacency_matrix()
+
+        assets = self.assets.get_assets_with_identifier(self.assetident)
+        ids = [assets[i].get_attribute(self.assetident) for i in range(len(assets))]
+        rowlookup = dict([(ids[i], i) for i in range(len(ids))])
+        centres = np.array([(a.get_attribute("CentreX"), a.get_attribute("CentreY")) for a in assets],
+                           dtype=np.float64).reshape(-1, 2)
+
+        pairs = set()       # Each pair of neighbours once as (i, j) with i < j
+        for i in range(len(assets)):
+            for nhd in assets[i].get_attribute("Neighbours") or []:
+                j = rowlookup.get(nhd)
+                if j is not None and j != i:
+                    pairs.add((min(i, j), max(i, j)))
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        dxy = centres[pairs[:, 0]] - centres[pairs[:, 1]]
+        distances = np.sqrt((dxy * dxy).sum(axis=1))
+
+        if self.geometry_type == "SQUARES":     # Edge neighbours are offset along one axis only
+            bs = self.meta.get_attribute("BlockSize")
+            sharededges = np.where(np.abs(dxy).min(axis=1) < 0.5 * bs, float(bs), 0.0)
+        elif self.geometry_type == "HEXAGONS":  # Hex neighbours always share one full side
+            sharededges = np.full(len(pairs), float(self.meta.get_attribute("HexSize")))
+        else:
+            sharededges = np.zeros(len(pairs))
+            for k in range(len(pairs)):
+                curgeom = assets[pairs[k, 0]].get_geometry_as_shapely_polygon()
+                nhdgeom = assets[pairs[k, 1]].get_geometry_as_shapely_polygon()
+                if curgeom is not None and nhdgeom is not None:
+                    sharededges[k] = curgeom.boundary.intersection(nhdgeom.boundary).length
+
+        # Mirror the pairs so that both directions of each link are in the matrices
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        shape = (len(assets), len(assets))
+        matrices = {"connectivity": sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape),
+                    "distance": sparse.csr_matrix((np.tile(distances, 2), (rows, cols)), shape=shape),
+                    "sharededge": sparse.csr_matrix((np.tile(sharededges, 2), (rows, cols)), shape=shape)}
+        self.assets.set_adjacency_matrix(self.assetident, ids, matrices)
+        self.notify("Adjacency matrix: "+str(len(assets))+" assets, "+str(len(rows))+" neighbour links")
+        return True
+
+    def build_raster_adjacency_matrix(self):
+        """Builds the Moore neighbourhood adjacency matrices of the raster cells, see build_adjacency_matrix(). Cell
+        IDs run row by row from the bottom left, so the neighbours are found by offsetting rows and columns."""
+        ncols = self.meta.get_attribute("Columns")
+        nrows = self.meta.get_attribute("Rows")
+        res = float(self.rastersize)
+        cellrows, cellcols = np.divmod(np.arange(ncols * nrows), ncols)
+
+        rows, cols, distances, sharededges = [], [], [], []
+        for dy, dx in [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]:
+            valid = (cellrows + dy >= 0) & (cellrows + dy < nrows) & (cellcols + dx >= 0) & (cellcols + dx < ncols)
+            source = np.nonzero(valid)[0]
+            rows.append(source)
+            cols.append(source + dy * ncols + dx)
+            distances.append(np.full(len(source), res * math.sqrt(dx * dx + dy * dy)))
+            sharededges.append(np.full(len(source), res if dx == 0 or dy == 0 else 0.0))
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        shape = (ncols * nrows, ncols * nrows)
+        matrices = {"connectivity": sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape),
+                    "distance": sparse.csr_matrix((np.concatenate(distances), (rows, cols)), shape=shape),
+                    "sharededge": sparse.csr_matrix((np.concatenate(sharededges), (rows, cols)), shape=shape)}
+        self.assets.set_adjacency_matrix("CellID", np.arange(1, ncols * nrows + 1), matrices)
+        self.notify("Adjacency matrix: "+str(ncols * nrows)+" cells, "+str(len(rows))+" neighbour links")
+        return True
+
     def generate_block_network(self, blockslist):
         """Generates the neighbourhood network for the block centroids and saves the links to the asset collection."""
         networklist = []
@@ -364,7 +459,7 @@ class CreateSimGrid(UBModule):
                     continue
                 if str(nhd_blockID)+","+str(curblockID) not in networklist:
                     p1 = (curblock.get_attribute("CentreX"), curblock.get_attribute("CentreY"))
-                    nhd_block = self.assets.get_asset_with_name(self.assetident+str(nhd_blockID))
+                    nhd_block = self.assets.get_asset_by_id(self.assetident, nhd_blockID)
                     p2 = (nhd_block.get_attribute("CentreX"), nhd_block.get_attribute("CentreY"))
 
                     # Asset creation
@@ -463,9 +558,10 @@ class CreateSimGrid(UBModule):
             # Get neighbours that always apply
             for j in range(len(directions)):   # For IDs that might be neighbours, check geometry
                 check_id = int(curhex_id + directions[j])
-                if self.assets.get_asset_with_name("HexID" + str(check_id)) is None:
+                check_hex = self.assets.get_asset_by_id("HexID", check_id)
+                if check_hex is None:
                     continue
-                if hexlist[i].shares_geometry(self.assets.get_asset_with_name("HexID"+str(check_id)), "edges", "all"):
+                if hexlist[i].shares_geometry(check_hex, "edges", "all"):
                     neighbourhood_ids.append(check_id)
 
             hexlist[i].add_attribute("Neighbours", neighbourhood_ids)
@@ -603,6 +699,20 @@ class CreateSimGrid(UBModule):
         else:
             return None     # Hex not within boundary, do not return anything
 
+    def create_polygon_asset(self, points, edges, interiors=None):
+        """Creates the UBVector() of a grid polygon. If compact geometry is enabled, a UBCompactVector() is created
+        instead, which keeps its coordinates in the collection's shared coordinate buffer and derives its edges from
+        the points.
+
+        :param points: exterior coordinates as a tuple list, closed (first point = last point)
+        :param edges: tuple list of edges, only used by the standard UBVector()
+        :param interiors: list of interior rings (holes) of the polygon
+        :return: UBVector() or UBCompactVector() object
+        """
+        if self.compact_geometry:
+            return ubdata.UBCompactVector(points, self.assets.get_coordinate_buffer(), interiors=interiors)
+        return ubdata.UBVector(points, edges, interiors=[] if interiors is None else interiors)
+
     def generate_centroid(self, asset_attr):
         asset_id = asset_attr.get_attribute(self.assetident)
         cp = ubdata.UBVector([(asset_attr.get_attribute("CentreX"), asset_attr.get_attribute("CentreY"))])
@@ -624,7 +734,7 @@ class CreateSimGrid(UBModule):
             for nhd in curasset.get_attribute("Neighbours"):
                 if str(nhd)+","+str(curassetID) not in networklist:
                     p1 = (curasset.get_attribute("CentreX"), curasset.get_attribute("CentreY"))
-                    nhd_asset = self.assets.get_asset_with_name(self.assetident+str(nhd))
+                    nhd_asset = self.assets.get_asset_by_id(self.assetident, nhd)
                     p2 = (nhd_asset.get_attribute("CentreX"), nhd_asset.get_attribute("CentreY"))
 
                     # Asset creation
@@ -640,15 +750,18 @@ class CreateSimGrid(UBModule):
         self.notify("Total number of links generated: "+str(len(networklist)))
         return True
 
-    def find_neighbours_by_geometry(self, curasset, assetlist):
-        """Performs the neighbourhood scan based on shared edges or points."""
+    def find_neighbours_by_geometry(self, curasset):
+        """Performs the neighbourhood scan based on shared edges or points. Only the assets that touch the current
+        asset according to the collection's spatial index are checked."""
         nhd = []
-        for i in range(len(assetlist)):
-            cur_id = curasset.get_attribute(self.assetident)
-            comp_id = assetlist[i].get_attribute(self.assetident)
-            if cur_id == comp_id or assetlist[i].get_attribute("Status") == 0:
+        curpoly = Polygon(curasset.get_points())
+        cur_id = curasset.get_attribute(self.assetident)
+        candidates = self.assets.query_intersecting(self.assetident, curpoly)
+        for i in range(len(candidates)):
+            comp_id = candidates[i].get_attribute(self.assetident)
+            if cur_id == comp_id or candidates[i].get_attribute("Status") == 0:
                 continue    # Identical IDs or no status? Skip
-            if Polygon.intersection(Polygon(curasset.get_points()), Polygon(assetlist[i].get_points())).length > 0.0:
+            if Polygon.intersection(curpoly, Polygon(candidates[i].get_points())).length > 0.0:
                 # If the length of the intersection is not 0 (i.e. shared edges)
                 nhd.append(comp_id)
         return nhd
@@ -683,7 +796,7 @@ class CreateSimGrid(UBModule):
         # Identify Neighbourhoods
         for i in range(len(patchlist)):
             self.notify("Scanning Neighbourhood for PatchID"+str(patchlist[i].get_attribute("PatchID")))
-            nhd = self.find_neighbours_by_geometry(patchlist[i], patchlist)
+            nhd = self.find_neighbours_by_geometry(patchlist[i])
             patchlist[i].add_attribute("Neighbours", nhd)
             patchlist[i].add_attribute("Neighb_num", len(nhd))
 
@@ -962,8 +1075,8 @@ class CreateSimGrid(UBModule):
             n3 = ((x+1) * res, (y+1) * res)
             n4 = (x * res, (y+1) * res)
 
-            fish_attr = ubdata.UBVector((n1, n2, n3, n4, n1),
-                                        ((n1, n2), (n2, n3), (n3, n4), (n4, n1)))
+            fish_attr = self.create_polygon_asset((n1, n2, n3, n4, n1),
+                                                  ((n1, n2), (n2, n3), (n3, n4), (n4, n1)))
             fish_attr.add_attribute("FishID", int(idnum))
             attr.add_attribute("Row", y)
             attr.add_attribute("Col", x)
@@ -1147,7 +1260,8 @@ class CreateSimGrid(UBModule):
                 edges = [(points[i], points[i+1]) for i in range(len(points)-1)]
                 rp = parcelpoly.representative_point()
 
-                parcel_attr = ubdata.UBVector(parcels[i].get_points(), edges, interiors=parcels[i].get_interiors())
+                parcel_attr = self.create_polygon_asset(parcels[i].get_points(), edges,
+                                                        interiors=parcels[i].get_interiors())
                 parcel_attr.add_attribute("ParcelID", parcelIDcount)
                 parcel_attr.add_attribute("CentreX", rp.x)
                 parcel_attr.add_attribute("CentreY", rp.y)
@@ -1175,7 +1289,7 @@ class CreateSimGrid(UBModule):
         self.notify("Determining neighbourhoods")
         for i in range(len(parcellist)):
             self.notify("Scanning Neighbourhood for ParcelID"+str(parcellist[i].get_attribute("ParcelID")))
-            nhd = self.find_neighbours_by_geometry(parcellist[i], parcellist)
+            nhd = self.find_neighbours_by_geometry(parcellist[i])
             parcellist[i].add_attribute("Neighbours", nhd)
             parcellist[i].add_attribute("Neighb_num", len(nhd))
 
@@ -87,6 +87,16 @@ class MapTopographyToSimGrid(UBModule):
         self.slope = 0
         self.aspect = 0
 
+        self.create_parameter("zonalstats", BOOL, "Map all assets in a single pass with the zonal statistics engine?")
+        self.create_parameter("zonalprocesses", DOUBLE, "Zonal statistics processes, each reads its own raster tiles")
+        self.zonalstats = 0
+        self.zonalprocesses = 1
+
+        self.create_parameter("useoverviews", BOOL, "Map from the coarsest raster overview fine enough for the grid?")
+        self.create_parameter("overviewtolerance", DOUBLE, "Times finer than the grid cells an overview must be")
+        self.useoverviews = 0
+        self.overviewtolerance = 10.0
+
     def set_module_data_library(self, datalib):
         self.datalibrary = datalib
 
@@ -122,7 +132,9 @@ class MapTopographyToSimGrid(UBModule):
         fullpath = elevmap.get_data_file_path() + elevmap.get_metadata("filename")
         self.notify("Loading Elevation Map: "+str(elevmap.get_metadata("filename")))
 
-        self.elevationmap = rasterio.open(fullpath)     # Variable assignment
+        cellsize = ubspatial.get_simgrid_cell_size(self.meta) if self.useoverviews else None
+        self.elevationmap = ubspatial.open_raster(fullpath, self.datalibrary.get_raster_cache_file(elevmap), cellsize,
+                                                  self.overviewtolerance)
         self.nodata = self.elevationmap.nodata
 
         # Program Notifications
@@ -143,6 +155,14 @@ class MapTopographyToSimGrid(UBModule):
             highest_elev = [-9999, 0]
             # Create the asset collection Localities...
 
+        if self.zonalstats:     # Rasterize all assets once and reduce the elevation map in a single pass
+            self.notify("Calculating zonal statistics for all assets")
+            cachepath = ubspatial.get_label_cache_path(self.activesim.get_project_path())
+            squaregrid = ubspatial.get_square_grid_from_meta(self.meta)
+            zonal = ubspatial.retrieve_zonal_statistics(self.elevationmap, griditems, self.xllcorner, self.yllcorner,
+                                                        cachepath=cachepath, squaregrid=squaregrid,
+                                                        processes=int(self.zonalprocesses))
+
         exceptions = []     # To hold asset exceptions where no data was found
         for i in range(len(griditems)):     # Loop across all polygon assets
             # Get the asset object
@@ -150,8 +170,20 @@ class MapTopographyToSimGrid(UBModule):
             assetid = asset.get_attribute(self.assetident)
             self.notify("Currently Mapping: " + str(self.assetident) + str(assetid))
 
-            mdata = ubspatial.retrieve_raster_data_from_mask(self.elevationmap, asset, self.xllcorner, self.yllcorner)
-            if mdata is None:
+            if self.zonalstats:
+                withinbounds = zonal["pixels"][i] > 0
+                elevstats = None
+                if zonal["count"][i] > 0:
+                    elevstats = [zonal["mean"][i], zonal["min"][i], zonal["max"][i]]
+            else:
+                mdata = ubspatial.retrieve_raster_data_from_mask(self.elevationmap, asset, self.xllcorner,
+                                                                 self.yllcorner)
+                withinbounds = mdata is not None
+                elevstats = None
+                if withinbounds and mdata.size > 0:
+                    elevstats = [mdata.mean(), mdata.min(), mdata.max()]
+
+            if not withinbounds:
                 self.notify(self.assetident + str(assetid) + " does not fall within the bounds, skipping.")
                 asset.add_attribute("Elev_Avg", float(self.nodata))
                 asset.add_attribute("Elev_Min", float(self.nodata))
@@ -163,7 +195,7 @@ class MapTopographyToSimGrid(UBModule):
                 continue
 
             # Write the basic extracted data to the attributes list
-            if mdata.size == 0:       # If no data leftover, assign cells as self.nodata
+            if elevstats is None:       # If no data leftover, assign cells as self.nodata
                 asset.add_attribute("Elev_Avg", self.nodata)
                 asset.add_attribute("Elev_Min", self.nodata)
                 asset.add_attribute("Elev_Max", self.nodata)
@@ -173,16 +205,16 @@ class MapTopographyToSimGrid(UBModule):
                     exceptions.append(asset)
                 continue
             else:       # Calculate metrics and transfer elevation to asset
-                asset.add_attribute("Elev_Avg", float(mdata.mean()))
-                asset.add_attribute("Elev_Min", float(mdata.min()))
-                asset.add_attribute("Elev_Max", float(mdata.max()))
+                asset.add_attribute("Elev_Avg", float(elevstats[0]))
+                asset.add_attribute("Elev_Min", float(elevstats[1]))
+                asset.add_attribute("Elev_Max", float(elevstats[2]))
 
             # Work out some map-wide stats
             if self.demminmax:
-                if mdata.mean() < lowest_elev[0]:
-                    lowest_elev = [mdata.mean(), assetid]
-                if mdata.mean() > highest_elev[0]:
-                    highest_elev = [mdata.mean(), assetid]
+                if elevstats[0] < lowest_elev[0]:
+                    lowest_elev = [elevstats[0], assetid]
+                if elevstats[0] > highest_elev[0]:
+                    highest_elev = [elevstats[0], assetid]
 
         if self.demminmax:
             self.notify("Lowest elevation in ID"+str(lowest_elev[1])+": "+str(lowest_elev[0])+"m")
@@ -250,13 +282,10 @@ class MapTopographyToSimGrid(UBModule):
 
     def get_neighbourhood_elevations(self, nhd):
         """Returns min, max and avg elevation of all neighbours in the input list"""
-        elev_avg, elev_min, elev_max = [], [], []
-        for i in range(len(nhd)):
-            asset = self.assets.get_asset_with_name(self.assetident+str(nhd[i]))
-            elev_avg.append(asset.get_attribute("Elev_Avg"))
-            elev_min.append(asset.get_attribute("Elev_Min"))
-            elev_max.append(asset.get_attribute("Elev_Max"))
-        return np.array(elev_avg), np.array(elev_min), np.array(elev_max)
+        elev_avg = self.assets.get_attribute_array(self.assetident, "Elev_Avg", nhd, nodata=self.nodata)
+        elev_min = self.assets.get_attribute_array(self.assetident, "Elev_Min", nhd, nodata=self.nodata)
+        elev_max = self.assets.get_attribute_array(self.assetident, "Elev_Max", nhd, nodata=self.nodata)
+        return elev_avg, elev_min, elev_max
 
     def perform_dem_smoothing(self, assets):
         """Runs through all items in the assets list and calculates average elevation from it and
@@ -672,9 +672,8 @@ class UrbanFormAbstraction(UBModule):
                 block_attr.add_attribute("Blk_TIF", -9999)
                 block_attr.add_attribute("Blk_RoofsA", -9999)
                 nhd = block_attr.get_attribute("Neighbours")
-                for n in nhd:
-                    ubmethods.remove_neighbour_from_block(self.scenario.get_asset_with_name("BlockID"+str(n)),
-                                                          currentID)
+                for nhd_block in self.assets.get_many("BlockID", nhd):
+                    ubmethods.remove_neighbour_from_block(nhd_block, currentID)
                 continue
 
             # Determine whether to update the Block at all using Dynamics Parameters
@@ -29,10 +29,16 @@ import shutil
 import pickle
 import xml.etree.ElementTree as ET
 
+# --- URBANBEATS LIBRARY IMPORTS ---
+from .ublibs import ubspatial
+
 
 # --- URBANBEATS DATA LIBRARY CLASS DEFINITION ---
 class UrbanBeatsDataLibrary(object):
-    def __init__(self, projectpath, keepcopy):
+    __rastercache = 0   # Defaults for data libraries saved before the raster cache and overviews existed
+    __rasteroverviews = 0
+
+    def __init__(self, projectpath, keepcopy, rastercache=0, rasteroverviews=0):
         # Data containers
         self.__spatial_data = []        # A list containing data reference objects for spatial data
         self.__temporal_data = []    # List for data reference of time series data
@@ -43,6 +49,8 @@ class UrbanBeatsDataLibrary(object):
         self.__data_library_idcount = 0 # Tracks the current ID number
         self.__projectpath = projectpath    # The active project path - includes project name
         self.__keepcopy = keepcopy  # Tracks whether to copy each data to the project folder
+        self.__rastercache = rastercache    # Tracks whether to convert raster data to memory-mapped .npy on import
+        self.__rasteroverviews = rasteroverviews    # Tracks whether to build overview levels of raster data on import
 
         # Create the data directory
         if os.path.isdir(projectpath+"/datalib"):  # Creates the data folder in the project path
@@ -84,6 +92,8 @@ class UrbanBeatsDataLibrary(object):
         if count_incr:
             self.__data_library_idcount += 1
             self.copy_data_to_project_folder(dataref)
+            self.cache_raster_data(dataref)
+            self.build_raster_overviews(dataref)
 
     def copy_data_to_project_folder(self, dataref):
         """Copies the different data formats to the project folder depending on what has been selected."""
@@ -110,6 +120,38 @@ class UrbanBeatsDataLibrary(object):
             else:   # For any other normal file, we just copy source path to destination.
                 shutil.copyfile(sourcepath, destination)
 
+    def cache_raster_data(self, dataref):
+        """Converts a raster data set into an uncompressed memory-mapped .npy file with a JSON sidecar in the project's
+        data folder if the raster cache is enabled, so that modules can read it without decoding the raster again.
+
+        :param dataref: the data reference object of the data set
+        :return: True if the raster was cached, False otherwise
+        """
+        if not self.__rastercache or dataref.get_metadata("dataformat") != "RASTER":
+            return False
+        sourcepath = dataref.get_data_file_path() + dataref.get_metadata("filename")
+        return ubspatial.convert_raster_to_memmap(sourcepath, self.get_raster_cache_file(dataref))
+
+    def build_raster_overviews(self, dataref):
+        """Builds the overview levels of a raster data set copied into the project folder if raster overviews are
+        enabled, so that mapping onto coarse simulation grids can read fewer cells. Land use and cover maps are
+        resampled by nearest neighbour to keep their categories, all other rasters by averaging. Data sets outside the
+        project folder are not modified, but existing overviews of them are still used.
+
+        :param dataref: the data reference object of the data set
+        :return: True if the raster has overviews, False otherwise
+        """
+        if not self.__rasteroverviews or not self.__keepcopy or dataref.get_metadata("dataformat") != "RASTER":
+            return False
+        resampling = "NEAREST" if dataref.get_metadata("type") == "Land Use/Cover" else "AVERAGE"
+        sourcepath = dataref.get_data_file_path() + dataref.get_metadata("filename")
+        return len(ubspatial.build_raster_overviews(sourcepath, resampling)) > 0
+
+    def get_raster_cache_file(self, dataref):
+        """Returns the full path (without extension) of the memory-mapped cache of a raster data set, which may not
+        exist. Pass it to ubspatial.open_raster() to use the cache whenever it is available."""
+        return self.__projectdatafolder + dataref.get_metadata("filename")
+
     def delete_data(self, dataID):
         """Removes a data set from the library by searching for its unique dataID.
 
@@ -150,6 +192,9 @@ class UrbanBeatsDataLibrary(object):
             else:
                 if os.path.isfile(fulldatapath):
                     os.remove(fulldatapath)
+        for i in RASTERCACHEEXT:        # Cached rasters are always in the project folder
+            if os.path.isfile(self.get_raster_cache_file(dataref)+i):
+                os.remove(self.get_raster_cache_file(dataref)+i)
 
     def get_all_data_of_class(self, dataclass):
         """Returns one of the three data lists based on the input dataclass.
@@ -384,4 +429,7 @@ SHAPEFILEEXT = [".shp", ".shx", ".dbf", ".prj", ".sbn", ".sbx", ".fbn", ".fbx",
 # (2) -- GEOTIFF --
 # So far, noticing 4 key file formatst that may go hand in hand with the geotiff
 GEOTIFF = [".tif", ".tfw", "tif.aux.xml", ".tif.ovr"]   # Need not necessarily use all, but used for checking
+# (3) -- RASTER CACHE --
+# Memory-mapped copy of a raster's band and its JSON sidecar, appended to the full filename e.g. dem.tif.npy
+RASTERCACHEEXT = ubspatial.RASTER_CACHE_EXT
 
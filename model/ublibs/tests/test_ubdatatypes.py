@@ -0,0 +1,219 @@
+r"""
+@file   test_ubdatatypes.py
+@author Peter M Bach <peterbach@gmail.com>
+@section LICENSE
+
+Urban Biophysical Environments and Technologies Simulator (UrbanBEATS)
+Copyright (C) 2017-2022  Peter M. Bach
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Peter M. Bach"
+__copyright__ = "Copyright 2017-2022. Peter M. Bach"
+
+# --- PYTHON LIBRARY IMPORTS ---
+import pickle
+import numpy as np
+import pytest
+
+# --- URBANBEATS LIBRARY IMPORTS ---
+from model.ublibs import ubdatatypes as ubdata
+
+
+def build_blocks(columnar, count=5):
+    """Returns a collection of 'count' Blocks with an integer attribute "X" equal to their BlockID."""
+    collection = ubdata.UBCollection("Test", "Scenario", columnar)
+    for i in range(1, count + 1):
+        block = ubdata.UBComponent()
+        block.add_attribute("BlockID", i)
+        block.add_attribute("Status", 1)
+        block.add_attribute("X", i)
+        collection.add_asset("BlockID" + str(i), block)
+    return collection
+
+
+def assert_same_array(dictarray, columnararray):
+    """Checks that the dictionary and the columnar store returned the same values with the same dtype."""
+    assert dictarray.dtype == columnararray.dtype
+    assert np.array_equal(dictarray, columnararray, equal_nan=dictarray.dtype.kind == "f")
+
+
+# --- MIXED NUMERIC ATTRIBUTES ---
+def test_mixed_int_float_column_matches_dictionary_store():
+    arrays = []
+    for columnar in [False, True]:
+        collection = build_blocks(columnar)
+        collection.set_attribute_array("Block", "X", 7.5, ids=[2, 4])
+        arrays.append(collection.get_attribute_array("Block", "X"))
+        assert collection.get_asset_with_name("BlockID1").get_attribute("X") == 1
+        assert type(collection.get_asset_with_name("BlockID1").get_attribute("X")) is int
+        assert collection.get_asset_with_name("BlockID2").get_attribute("X") == 7.5
+    assert arrays[1].dtype == np.float64
+    assert_same_array(arrays[0], arrays[1])
+
+
+def test_mixed_column_dtype_follows_the_values_read():
+    for columnar in [False, True]:
+        collection = build_blocks(columnar)
+        collection.get_asset_with_name("BlockID5").add_attribute("X", 0.5)
+        subset = collection.get_attribute_array("Block", "X", ids=[1, 3])
+        assert subset.dtype == np.int64
+        assert subset.tolist() == [1, 3]
+
+
+def test_bools_keep_their_type_next_to_integers():
+    for columnar in [False, True]:
+        collection = build_blocks(columnar)
+        collection.get_asset_with_name("BlockID1").add_attribute("Flag", True)
+        collection.get_asset_with_name("BlockID2").add_attribute("Flag", 2)
+        assert collection.get_asset_with_name("BlockID1").get_attribute("Flag") is True
+        assert collection.get_attribute_array("Block", "Flag", ids=[1, 2]).tolist() == [1, 2]
+
+
+def test_numbers_keep_their_type_when_column_becomes_object():
+    collection = build_blocks(True)
+    collection.get_asset_with_name("BlockID2").add_attribute("X", 2.5)
+    collection.get_asset_with_name("BlockID3").add_attribute("X", "three")
+    values = [collection.get_asset_with_name("BlockID" + str(i)).get_attribute("X") for i in [1, 2, 3]]
+    assert values == [1, 2.5, "three"]
+    assert type(values[0]) is int
+
+
+def test_mixed_column_survives_pickling_and_growth():
+    collection = build_blocks(True)
+    collection.get_asset_with_name("BlockID2").add_attribute("X", 2.5)
+    collection = pickle.loads(pickle.dumps(collection))
+    for i in range(6, 200):     # Grows the table beyond its initial capacity
+        block = ubdata.UBComponent()
+        block.add_attribute("BlockID", i)
+        block.add_attribute("X", float(i))
+        collection.add_asset("BlockID" + str(i), block)
+    assert type(collection.get_asset_with_name("BlockID1").get_attribute("X")) is int
+    assert collection.get_asset_with_name("BlockID150").get_attribute("X") == 150.0
+
+
+# --- BULK ATTRIBUTE ACCESS ---
+@pytest.mark.parametrize("columnar", [False, True])
+def test_get_and_set_attribute_array_round_trip(columnar):
+    collection = build_blocks(columnar)
+    assert collection.get_asset_ids("BlockID").tolist() == [1, 2, 3, 4, 5]
+    assert collection.set_attribute_array("Block", "Elev", np.array([10.0, 20.0, 30.0, 40.0, 50.0])) == 5
+    assert collection.get_attribute_array("BlockID", "Elev").tolist() == [10.0, 20.0, 30.0, 40.0, 50.0]
+    assert collection.get_attribute_array("Block", "Elev", ids=[5, 1]).tolist() == [50.0, 10.0]
+    assert collection.get_asset_with_name("BlockID3").get_attribute("Elev") == 30.0
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_set_attribute_array_with_ids_skips_unknown_assets(columnar):
+    collection = build_blocks(columnar)
+    assert collection.set_attribute_array("Block", "Elev", [1.0, 2.0, 3.0], ids=[4, 99, 2]) == 2
+    elev = collection.get_attribute_array("Block", "Elev", nodata=-9999.0)
+    assert elev.tolist() == [-9999.0, 3.0, -9999.0, 1.0, -9999.0]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_status_only_and_nodata_fill(columnar):
+    collection = build_blocks(columnar)
+    collection.get_asset_with_name("BlockID2").add_attribute("Status", 0)
+    assert collection.set_attribute_array("Block", "Elev", 5.0, status_only=True) == 4
+    assert collection.get_asset_with_name("BlockID2").get_attribute("Elev") is None
+    assert collection.get_attribute_array("Block", "Elev", status_only=True).tolist() == [5.0, 5.0, 5.0, 5.0]
+    elev = collection.get_attribute_array("Block", "Elev", ids=[1, 2, 7], status_only=True)
+    assert elev[0] == 5.0 and np.isnan(elev[1]) and np.isnan(elev[2])
+    assert np.isnan(collection.get_attribute_array("Block", "Missing")).all()
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_set_attribute_array_with_list_values(columnar):
+    collection = build_blocks(columnar, 3)
+    neighbours = [[2], [1, 3], [2]]
+    assert collection.set_attribute_array("Block", "Neighbours", neighbours) == 3
+    assert collection.get_asset_with_name("BlockID2").get_attribute("Neighbours") == [1, 3]
+    values = collection.get_attribute_array("Block", "Neighbours")
+    assert values.dtype == object and values.tolist() == neighbours
+    collection.set_attribute_array("Block", "UpstrIDs", ([], [1]), ids=[1, 2])
+    assert collection.get_asset_with_name("BlockID2").get_attribute("UpstrIDs") == [1]
+    with pytest.raises(ValueError):
+        collection.set_attribute_array("Block", "Neighbours", [[1], [2]])
+
+
+def test_bulk_access_matches_between_stores():
+    arrays = []
+    for columnar in [False, True]:
+        collection = build_blocks(columnar)
+        collection.get_asset_with_name("BlockID3").add_attribute("Status", 0)
+        collection.set_attribute_array("Block", "pLU_RES", [0.5, 0.25, 1.0], ids=[1, 2, 4])
+        collection.set_attribute_array("Block", "pLU_RES", 0, ids=[5])
+        arrays.append([collection.get_attribute_array("Block", "pLU_RES"),
+                       collection.get_attribute_array("Block", "pLU_RES", status_only=True),
+                       collection.get_attribute_array("Block", "X", ids=[5, 3, 1], nodata=-1)])
+    for dictarray, columnararray in zip(arrays[0], arrays[1]):
+        assert_same_array(dictarray, columnararray)
+
+
+# --- TYPE AND ID INDEXES ---
+@pytest.mark.parametrize("columnar", [False, True])
+def test_type_and_id_indexes(columnar):
+    collection = build_blocks(columnar)
+    collection.add_asset("meta", ubdata.UBComponent())
+    assert [a.get_attribute("BlockID") for a in collection.get_assets_with_identifier("BlockID")] == [1, 2, 3, 4, 5]
+    assert collection.get_asset_by_id("Block", 3) is collection.get_asset_with_name("BlockID3")
+    assert [None if a is None else a.get_attribute("BlockID") for a in collection.get_many("Block", [4, 9, 1])] == \
+        [4, None, 1]
+    collection.remove_asset_by_name("BlockID2")
+    assert collection.get_asset_ids("Block").tolist() == [1, 3, 4, 5]
+    assert collection.get_asset_by_id("Block", 2) is None
+
+
+def test_spatial_queries():
+    collection = ubdata.UBCollection("Test", "Scenario")
+    for i in range(1, 5):
+        block = ubdata.UBVector([(i, 0), (i + 1, 0), (i + 1, 1), (i, 1), (i, 0)])
+        block.add_attribute("BlockID", i)
+        collection.add_asset("BlockID" + str(i), block)
+    found = collection.query_intersecting("Block", [2.2, 3.5, 0.2, 0.8])
+    assert [a.get_attribute("BlockID") for a in found] == [2, 3]
+    assert collection.query_nearest("Block", (10.0, 0.5), 1)[0].get_attribute("BlockID") == 4
+
+
+# --- SNAPSHOTS ---
+@pytest.mark.parametrize("columnar", [False, True])
+def test_snapshot_is_isolated_from_parent(columnar):
+    collection = build_blocks(columnar)
+    collection.get_asset_with_name("BlockID1").add_attribute("Neighbours", [2])
+    snapshot = collection.snapshot("Variant")
+
+    collection.get_asset_with_name("BlockID1").add_attribute("X", 100)        # Parent writes after the snapshot
+    collection.set_attribute_array("Block", "Elev", 1.0)
+    assert snapshot.get_asset_with_name("BlockID1").get_attribute("X") == 1
+    assert snapshot.get_asset_with_name("BlockID1").get_attribute("Elev") is None
+
+    snapshot.get_asset_with_name("BlockID1").get_attribute("Neighbours").append(3)     # In-place snapshot change
+    snapshot.get_asset_with_name("BlockID2").add_attribute("X", -2)
+    assert collection.get_asset_with_name("BlockID1").get_attribute("Neighbours") == [2]
+    assert collection.get_asset_with_name("BlockID2").get_attribute("X") == 2
+    assert snapshot.get_attribute_array("Block", "X").tolist() == [1, -2, 3, 4, 5]
+
+
+def test_snapshot_geometry_change_updates_its_spatial_index():
+    collection = ubdata.UBCollection("Test", "Scenario")
+    for i in range(1, 5):
+        collection.add_asset("BlockID" + str(i), ubdata.UBVector([(i, 0), (i + 1, 0), (i + 1, 1), (i, 1), (i, 0)]))
+    collection.query_intersecting("Block", [0, 10, 0, 10])      # Builds the index before the snapshot is taken
+    snapshot = collection.snapshot("Variant")
+    snapshot.get_asset_with_name("BlockID1").change_coordinates([(50, 50), (51, 50), (51, 51), (50, 51), (50, 50)])
+    assert len(snapshot.query_intersecting("Block", [49, 52, 49, 52])) == 1
+    assert len(collection.query_intersecting("Block", [49, 52, 49, 52])) == 0
+    assert collection.get_asset_with_name("BlockID1").get_points()[0][:2] == (1, 0)
@@ -0,0 +1,223 @@
+r"""
+@file   test_ubspatial.py
+@author Peter M Bach <peterbach@gmail.com>
+@section LICENSE
+
+Urban Biophysical Environments and Technologies Simulator (UrbanBEATS)
+Copyright (C) 2017-2022  Peter M. Bach
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Peter M. Bach"
+__copyright__ = "Copyright 2017-2022. Peter M. Bach"
+
+# --- PYTHON LIBRARY IMPORTS ---
+import math
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+pytest.importorskip("geopandas")
+rasterio = pytest.importorskip("rasterio")
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, Polygon, box
+
+# --- URBANBEATS LIBRARY IMPORTS ---
+from model.ublibs import ubspatial
+from model.ublibs import ubdatatypes as ubdata
+
+XLL, YLL = 1000.0, 2000.0       # Lower left corner of the simulation map in the raster's coordinates
+CELLSIZE = 10.0
+BLOCKSIZE = 50.0                # Blocks of 5 x 5 cells
+NODATA = -9999.0
+
+
+class MetaStub(dict):
+    """Stands in for the 'meta' asset of a HEXAGONS simulation grid."""
+    def get_attribute(self, name):
+        return self[name]
+
+
+@pytest.fixture
+def rasterfile(tmp_path):
+    """Writes a 30 x 40 cell GeoTIFF of land use like values from 1 to 5 with a few nodata cells, whose lower left
+    corner is the simulation map's (XLL, YLL)."""
+    rng = np.random.default_rng(7)
+    data = rng.integers(1, 6, size=(30, 40)).astype(np.float32)
+    data[rng.random(data.shape) < 0.05] = NODATA
+    filename = str(tmp_path / "landuse.tif")
+    rastermap = rasterio.open(filename, "w", driver="GTiff", width=40, height=30, count=1, dtype="float32",
+                              nodata=NODATA, transform=from_origin(XLL, YLL + 30 * CELLSIZE, CELLSIZE, CELLSIZE))
+    rastermap.write(data, 1)
+    rastermap.close()
+    return filename
+
+
+def build_blocks(wide, tall):
+    """Returns a list of square UBVector Blocks of a SQUARES grid in simulation map coordinates."""
+    blocks = []
+    for y in range(tall):
+        for x in range(wide):
+            x0, y0 = x * BLOCKSIZE, y * BLOCKSIZE
+            block = ubdata.UBVector([(x0, y0, 0), (x0 + BLOCKSIZE, y0, 0), (x0 + BLOCKSIZE, y0 + BLOCKSIZE, 0),
+                                     (x0, y0 + BLOCKSIZE, 0), (x0, y0, 0)])
+            block.add_attribute("BlockID", y * wide + x + 1)
+            blocks.append(block)
+    return blocks
+
+
+def get_mask_statistics(rastermap, blocks):
+    """Returns the count, sum, min and max of each block from the per-asset raster masking."""
+    stats = []
+    for block in blocks:
+        data = ubspatial.retrieve_raster_data_from_mask(rastermap, block, XLL, YLL)
+        data = np.array([]) if data is None else data.astype(np.float64)
+        stats.append([len(data), data.sum(), data.min() if len(data) else np.nan, data.max() if len(data) else np.nan])
+    return np.array(stats)
+
+
+def assert_matches_mask(zonal, expected):
+    assert zonal["count"].tolist() == expected[:, 0].astype(int).tolist()
+    assert np.allclose(zonal["sum"], expected[:, 1])
+    valid = expected[:, 0] > 0
+    assert np.allclose(zonal["min"][valid], expected[valid, 2])
+    assert np.allclose(zonal["max"][valid], expected[valid, 3])
+
+
+# --- ZONAL STATISTICS ---
+def test_label_zonal_statistics_match_raster_mask(rasterfile):
+    rastermap = rasterio.open(rasterfile)
+    blocks = build_blocks(8, 6)
+    expected = get_mask_statistics(rastermap, blocks)
+    assert_matches_mask(ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL), expected)
+    tiled = ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL, maxpixels=100)   # Many small tiles
+    assert_matches_mask(tiled, expected)
+    rastermap.close()
+
+
+def test_square_grid_statistics_match_raster_mask(rasterfile):
+    rastermap = rasterio.open(rasterfile)
+    blocks = build_blocks(8, 6)
+    zonal = ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL, squaregrid=[BLOCKSIZE, 8, 6])
+    assert_matches_mask(zonal, get_mask_statistics(rastermap, blocks))
+    rastermap.close()
+
+
+def test_category_histograms_match_raster_mask(rasterfile):
+    rastermap = rasterio.open(rasterfile)
+    blocks = build_blocks(8, 6)
+    categories = np.arange(1, 6)
+    zonal = ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL, categories=categories)
+    for i in range(len(blocks)):
+        data = ubspatial.retrieve_raster_data_from_mask(rastermap, blocks[i], XLL, YLL)
+        assert zonal["histogram"][i].tolist() == [int(np.count_nonzero(data == c)) for c in categories]
+    rastermap.close()
+
+
+def test_cached_and_parallel_statistics_are_identical(rasterfile, tmp_path):
+    rastermap = rasterio.open(rasterfile)
+    blocks = build_blocks(8, 6)
+    cachepath = str(tmp_path / ubspatial.LABEL_CACHE_FOLDER)
+    serial = ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL, maxpixels=100)
+    for processes in [1, 1, 2]:     # Writes the label cache, then reads it serially and in parallel
+        zonal = ubspatial.retrieve_zonal_statistics(rastermap, blocks, XLL, YLL, maxpixels=100, cachepath=cachepath,
+                                                    processes=processes)
+        for key in ["pixels", "count", "sum", "min", "max"]:
+            assert np.array_equal(serial[key], zonal[key], equal_nan=True), key
+    cached = os.listdir(cachepath)
+    assert len(cached) == 1 and cached[0].endswith(".npy")
+    rastermap.close()
+
+
+# --- VECTOR OVERLAY ---
+def test_overlay_matrix_is_cached(tmp_path):
+    sourcepath = str(tmp_path / "features.shp")
+    open(sourcepath, "w").close()
+    features = [box(0, 0, 10, 10), box(5, 5, 20, 20)]
+    geometries = [box(0, 0, 10, 10), box(10, 10, 20, 20), box(50, 50, 60, 60)]
+    matrix = ubspatial.retrieve_overlay_matrix(sourcepath, features, geometries, 0, 0, cachepath=str(tmp_path))
+    expected = [[g.intersection(f).area for f in features] for g in geometries]
+    assert np.allclose(matrix.toarray(), expected)
+    cached = ubspatial.retrieve_overlay_matrix(sourcepath, features, geometries, 0, 0, cachepath=str(tmp_path))
+    assert np.allclose(cached.toarray(), expected)
+    assert len([f for f in os.listdir(str(tmp_path)) if f.startswith(ubspatial.OVERLAY_CACHE_PREFIX)]) == 1
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith(".tmp")]
+
+
+# --- GRID TRAVERSAL ---
+def get_random_segments(rng, cellsize, count):
+    """Returns random segments, many of them starting or ending on grid lines and corners."""
+    segments = []
+    for i in range(count):
+        p0, p1 = list(rng.uniform(-50, 1050, 2)), list(rng.uniform(-50, 1050, 2))
+        if i % 4 == 0:
+            p0[0], p1[1] = round(p0[0] / cellsize) * cellsize, round(p1[1] / cellsize) * cellsize
+        elif i % 4 == 1:
+            p0 = [round(v / cellsize) * cellsize for v in p0]
+        elif i % 4 == 2:
+            p1[0] = p0[0]
+        segments.append((tuple(p0), tuple(p1)))
+    return segments + [((600.0, 559.3), (400.0, 200.0))]
+
+
+@pytest.mark.parametrize("cellsize", [200.0, 133.3, 50.0])
+def test_square_cells_match_shapely(cellsize):
+    cols, rows = int(1000 // cellsize), int(900 // cellsize)
+    cells = dict([((c, r), box(c * cellsize, r * cellsize, (c + 1) * cellsize, (r + 1) * cellsize))
+                  for c in range(cols) for r in range(rows)])
+    for p0, p1 in get_random_segments(np.random.default_rng(3), cellsize, 300):
+        found = set([tuple(c) for c in ubspatial.get_segment_square_cells(p0, p1, cellsize, cols, rows)])
+        segment = LineString([p0, p1])
+        assert found == set([k for k, cell in cells.items() if cell.intersects(segment)]), (p0, p1)
+
+
+def build_hexagons(orient, hs, wide, tall, mapheight):
+    """Returns {(col, row): ring} of a HEXAGONS simulation grid, built the same way as the grid's geometry."""
+    width = float('%.5f' % (math.sqrt(3) * hs))
+    hexes = {}
+    for y in range(tall):
+        for x in range(wide):
+            if orient == "EW":
+                shift = float('%.5f' % (0.5 * width * (y % 2)))
+                ax, ay = x * width - 0.5 * width + shift, y * 1.5 * hs + 0.5 * hs
+                ring = [(ax, ay), (ax, ay - hs), (ax + 0.5 * width, ay - 1.5 * hs), (ax + width, ay - hs),
+                        (ax + width, ay), (ax + 0.5 * width, ay + 0.5 * hs), (ax, ay)]
+            else:
+                shift = float('%.5f' % (0.5 * width * (x % 2)))
+                ax, ay = x * 1.5 * hs, y * width + (mapheight - tall * width) + shift
+                ring = [(ax, ay), (ax + hs, ay), (ax + 1.5 * hs, ay + 0.5 * width), (ax + hs, ay + width),
+                        (ax, ay + width), (ax - 0.5 * hs, ay + 0.5 * width), (ax, ay)]
+            hexes[(x, y)] = ring
+    return hexes
+
+
+@pytest.mark.parametrize("orient", ["EW", "NS"])
+def test_hex_candidates_match_shapely(orient):
+    hs, mapwidth, mapheight = 100.0, 1000.0, 900.0
+    if orient == "NS":
+        wide, tall = int(math.ceil(mapwidth / (1.5 * hs))), int(math.ceil(mapheight / (hs * math.sqrt(3))))
+    else:
+        wide, tall = int(math.ceil(mapwidth / (hs * math.sqrt(3)))), int(math.ceil(mapheight / (1.5 * hs))) + 1
+    meta = MetaStub(HexSize=hs, Area=1.5 * math.sqrt(3) * hs * hs, HexOrient=orient, HexWide=wide, HexTall=tall,
+                    mapheight=mapheight)
+    layout = ubspatial.get_hex_grid_layout(meta)
+    hexes = build_hexagons(orient, hs, wide, tall, mapheight)
+    polygons = dict([(k, Polygon(ring)) for k, ring in hexes.items()])
+    for p0, p1 in get_random_segments(np.random.default_rng(5), hs, 200):
+        found = set([tuple(c) for c in ubspatial.get_segment_hex_candidates(p0, p1, layout)
+                     if ubspatial.segment_intersects_convex_polygon(p0, p1, hexes[tuple(c)])])
+        segment = LineString([p0, p1])
+        assert found == set([k for k, poly in polygons.items() if poly.intersects(segment)]), (p0, p1)
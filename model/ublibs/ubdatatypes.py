@@ -29,11 +29,16 @@ __copyright__ = "Copyright 2017-2022. Peter M. Bach"
 
 # --- PYTHON LIBRARY IMPORTS ---
 import ast
+import copy
 import numpy as np
 import gc
 import pickle
 import os
-from shapely.geometry import Polygon, Point
+import sys
+import weakref
+from shapely.geometry import Polygon, Point, LineString, box
+from shapely.strtree import STRtree
+from shapely.prepared import prep
 
 # --- URBANBEATS LIBRARY IMPORTS ---
 
@@ -42,6 +47,8 @@ class UBRasterData(object):
     """The UrbanBEATS Raster Data Object, which holds raster information and allows querying of raster cell
     values.
     """
+    __nodatamask = None     # Cached boolean mask of nodata cells, built on first use
+
     def __init__(self, metadata, rasterdata, rw):
         """ Initialises the UBRasterData Class, takes two arguments that are created either in ubspatial.py or can
         be formatted by the user.
@@ -87,19 +94,39 @@ class UBRasterData(object):
             return False
 
     def get_value(self, col, row):
-        """Returns the cells value of the given column 'col' (x) and row (y), if there is an index error,
+        """Returns the cells value of the given column 'col' (x) and row (y), if the cell lies outside the raster,
         then function return the corresponding 'nodata value'."""
-        try:
+        if 0 <= row < self.__nrows and 0 <= col < self.__ncols:
             return self.__data[row, col]  # data[y][x]
-        except IndexError:
-            return "ERROR" #self.__nodatavalue
+        return self.__nodatavalue
+
+    def get_values(self, cols, rows):
+        """Returns the values of many cells at once as a numpy array in the raster's dtype. Cells outside the raster
+        return the nodata value.
+
+        :param cols: array-like of column indices (x)
+        :param rows: array-like of row indices (y), same length as cols
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        inside = (rows >= 0) & (rows < self.__nrows) & (cols >= 0) & (cols < self.__ncols)
+        dtype = self.__data.dtype
+        if np.array(self.__nodatavalue).astype(dtype) != self.__nodatavalue:   # Nodata must fit the raster's dtype
+            dtype = np.result_type(dtype, np.float64)
+        values = np.full(cols.shape, self.__nodatavalue, dtype=dtype)
+        values[inside] = self.__data[rows[inside], cols[inside]]
+        return values
 
     def get_data(self):
         """Returns the full numpy raster array."""
         return self.__data
 
     def get_data_square(self, col_start, row_start, cells_wide, cells_tall):
-        """Returns an entire rectangular section of the raster at the given coordinates.
+        """Returns an entire rectangular section of the raster at the given coordinates as a view of the raster data,
+        i.e. without copying and in the raster's dtype. The section is clipped to the raster's extent, a window
+        starting outside the raster only returns its cells that lie inside. Callers must not modify the returned
+        view in place, as this changes the raster itself (this function used to return a float32 copy). Take a copy
+        with np.array() first if the values need to be changed.
 
         :param col_start: the starting column index
         :param row_start: the starting row index
@@ -109,14 +136,46 @@ class UBRasterData(object):
         """
         if cells_tall == 0 and cells_wide == 0:      # If the resolutions are identical or the input resolution > cells
             return self.__data[row_start, col_start]
-        datamatrix = self.__data[row_start:row_start + cells_tall, col_start:col_start+cells_wide].astype('float32')
-        return datamatrix
+        row_stop, col_stop = max(row_start + cells_tall, 0), max(col_start + cells_wide, 0)   # Before clipping
+        row_start, col_start = max(row_start, 0), max(col_start, 0)
+        return self.__data[row_start:row_stop, col_start:col_stop]
+
+    def iterate_blocks(self, cells_wide, cells_tall, halo=0):
+        """Iterates over the raster in blocks of cells_wide x cells_tall cells, row by row from the top left. Each
+        block is returned as a view, optionally extended by a halo of neighbouring cells on all sides (clipped to the
+        raster) for neighbourhood operations.
+
+        :param cells_wide: number of columns per block
+        :param cells_tall: number of rows per block
+        :param halo: number of extra cells to include around each block
+        :return: generator of [window, view, offset], where window is [row_start, row_stop, col_start, col_stop] of
+                the block itself and offset is the (row, col) of the block's first cell within the view
+        """
+        for row in range(0, self.__nrows, cells_tall):
+            for col in range(0, self.__ncols, cells_wide):
+                window = [row, min(row + cells_tall, self.__nrows), col, min(col + cells_wide, self.__ncols)]
+                viewrow, viewcol = max(row - halo, 0), max(col - halo, 0)
+                view = self.__data[viewrow:min(window[1] + halo, self.__nrows),
+                                   viewcol:min(window[3] + halo, self.__ncols)]
+                yield [window, view, (row - viewrow, col - viewcol)]
+
+    def get_nodata_mask(self):
+        """Returns a read-only boolean array marking all nodata cells of the raster. The mask is built once and kept
+        until the data is changed through set_value(), replace_nodatavalues() or reset_data()."""
+        if self.__nodatamask is None and self.__data is not None:
+            mask = self.__data == self.__nodatavalue
+            if np.issubdtype(self.__data.dtype, np.floating) and np.isnan(self.__nodatavalue):
+                mask = np.isnan(self.__data)
+            mask.flags.writeable = False
+            self.__nodatamask = mask
+        return self.__nodatamask
 
     def set_value(self, col, row, value):
         """Sets the value in the given column 'col' (x) and row (y) to the provided 'value'. If the raster
         is read-only, it does not carry out this operation and simply ends the function."""
         if self.__setdata_option:
             self.__data[row, col] = value
+            self.__nodatamask = None
         return True
 
     def get_nodatavalue(self):
@@ -138,11 +197,13 @@ class UBRasterData(object):
     def reset_data(self):
         """Erases the data matrix (to free up memory), use only if necessary!"""
         self.__data = None
+        self.__nodatamask = None
         return True
 
     def replace_nodatavalues(self, value):
         """Replaces the entire raster's nodata value with the specified 'value'"""
-        self.__data[self.__data == self.__nodatavalue] = value
+        self.__data[self.get_nodata_mask()] = value
+        self.__nodatamask = None
         return True
 
     def get_nonzero_count(self):
@@ -154,11 +215,330 @@ class UBRasterData(object):
         return self.__data.sum()
 
 
-class UBComponent(object):
-    """The most basic data container in UrbanBEATS, the UBComponent(), which can be used to store and manage
-    any form of non-spatial data, e.g. an attributes list. It has several functions that allows its children
-    to access when inherited.
+class UBAttributeTable(object):
+    """Columnar attribute store for all assets of a single asset type (e.g. all "BlockID" assets). Each attribute is
+    held as one typed numpy array (a column) with one row (slot) per asset, plus a boolean array that tracks whether
+    the asset actually has a value for that attribute. Assets attached to the table keep working through the normal
+    UBComponent attribute methods, which simply proxy to their slot in the table.
     """
+    def __init__(self, assettype, capacity=64):
+        """Initialises an empty table.
+
+        :param assettype: the asset type the table belongs to, e.g. "Block", "Hex", "Patch"
+        :param capacity: the initial number of slots to allocate, grows automatically as assets are attached
+        """
+        self.__assettype = assettype
+        self.__capacity = max(int(capacity), 1)
+        self.__size = 0                 # High-water mark of slots in use, columns are only valid up to this index
+        self.__freeslots = []           # Slots released by removed assets, recycled before growing the table
+        self.__occupied = np.zeros(self.__capacity, dtype=bool)
+        self.__slotnames = np.full(self.__capacity, None, dtype=object)     # Asset name for each slot
+        self.__columns = {}             # Attribute name: [values array, present array]
+        self.__valuetypes = {}          # Attribute name: int8 array of value type codes, only for mixed numerics
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_UBAttributeTable__valuetypes", {})    # Tables pickled before mixed columns
+
+    def get_asset_type(self):
+        """Returns the asset type the table holds attributes for."""
+        return self.__assettype
+
+    def get_slot_count(self):
+        """Returns the number of slots currently in use, i.e. the length of all column views."""
+        return self.__size
+
+    def get_asset_count(self):
+        """Returns the number of assets currently attached to the table."""
+        return int(np.count_nonzero(self.__occupied[:self.__size]))
+
+    def get_occupied_slots(self):
+        """Returns a numpy array of all slots that hold an attached asset, in ascending order."""
+        return np.flatnonzero(self.__occupied[:self.__size])
+
+    def get_slot_name(self, slot):
+        """Returns the asset name stored in the given slot, None if the slot is empty."""
+        return self.__slotnames[slot]
+
+    def get_column_names(self):
+        """Returns a list of all attribute names that have a column in the table."""
+        return list(self.__columns.keys())
+
+    def get_nbytes(self, name=None):
+        """Returns the memory of the array data in bytes, including unused capacity, of the column 'name' or of the
+        slot bookkeeping arrays if name is None. Python objects referenced by object columns are not included."""
+        if name is None:
+            return self.__occupied.nbytes + self.__slotnames.nbytes
+        values, present = self.__columns[name]
+        valuetypes = self.__valuetypes.get(name)
+        return values.nbytes + present.nbytes + (0 if valuetypes is None else valuetypes.nbytes)
+
+    def allocate_slot(self, name):
+        """Reserves a slot for the asset 'name' and returns its index. Free slots are reused first."""
+        if len(self.__freeslots) > 0:
+            slot = self.__freeslots.pop()
+        else:
+            if self.__size == self.__capacity:
+                self.__grow(self.__capacity * 2)
+            slot = self.__size
+            self.__size += 1
+        self.__occupied[slot] = True
+        self.__slotnames[slot] = name
+        return slot
+
+    def release_slot(self, slot):
+        """Frees a slot and returns all its attributes as a dictionary so that the detached asset keeps its data."""
+        attributes = self.get_slot_attributes(slot)
+        for column in self.__columns.values():
+            column[1][slot] = False
+            if column[0].dtype == object:
+                column[0][slot] = None      # Drop the reference so lists and strings can be collected
+        self.__occupied[slot] = False
+        self.__slotnames[slot] = None
+        self.__freeslots.append(slot)
+        return attributes
+
+    def set_value(self, slot, name, value):
+        """Writes 'value' for the attribute 'name' into the given slot, creating or promoting the column's dtype
+        if the value does not fit the current column type. Columns that mix bools, integers and floats stay numeric
+        and remember the type of each value, so that values come back with the type they were written with."""
+        column = self.__prepare_column(name, infer_column_dtype(value), slot)
+        column[0][slot] = value
+        column[1][slot] = True
+        return True
+
+    def __prepare_column(self, name, dtype, slots):
+        """Creates the column 'name' or promotes its dtype so that it can hold values of 'dtype', which are about to
+        be written to 'slots'. If the column mixes bools, integers and floats, the type of each value is recorded in
+        a type code array (see VALUE_TYPES). Mixing numbers with other objects turns the column into an object
+        column.
+
+        :return: the column [values array, present array]
+        """
+        if name not in self.__columns:
+            self.__columns[name] = [self.__empty_array(dtype, self.__capacity), np.zeros(self.__capacity, dtype=bool)]
+        column = self.__columns[name]
+        newdtype = promote_column_dtype(column[0].dtype, dtype)
+        if newdtype == object:
+            if column[0].dtype != object:
+                column[0] = self.__get_object_values(name)
+                self.__valuetypes.pop(name, None)
+            return column
+        code = get_value_type_code(dtype)
+        if name not in self.__valuetypes and code != get_value_type_code(column[0].dtype):
+            self.__valuetypes[name] = np.full(self.__capacity, get_value_type_code(column[0].dtype), dtype=np.int8)
+        if newdtype != column[0].dtype:
+            column[0] = column[0].astype(newdtype)
+        if name in self.__valuetypes:
+            self.__valuetypes[name][slots] = code
+        return column
+
+    def __get_object_values(self, name):
+        """Returns the values of the numeric column 'name' as an object array of Python values of their own type."""
+        values = np.full(self.__capacity, None, dtype=object)
+        for slot in np.flatnonzero(self.__columns[name][1]):
+            values[slot] = self.get_value(slot, name)
+        return values
+
+    def get_value(self, slot, name):
+        """Returns the value of attribute 'name' in the given slot as a native Python type, None if not present."""
+        try:
+            values, present = self.__columns[name]
+        except KeyError:
+            return None
+        if not present[slot]:
+            return None
+        if values.dtype == object:
+            return values[slot]
+        if name in self.__valuetypes:
+            return VALUE_TYPES[self.__valuetypes[name][slot]](values[slot].item())
+        return values[slot].item()
+
+    def remove_value(self, slot, name):
+        """Removes attribute 'name' from the given slot, returns True if there was a value to remove."""
+        try:
+            values, present = self.__columns[name]
+        except KeyError:
+            return False
+        if not present[slot]:
+            return False
+        present[slot] = False
+        if values.dtype == object:
+            values[slot] = None
+        return True
+
+    def get_slot_attributes(self, slot):
+        """Returns a new dictionary of all attributes present in the given slot."""
+        attributes = {}
+        for name in self.__columns.keys():
+            if self.__columns[name][1][slot]:
+                attributes[name] = self.get_value(slot, name)
+        return attributes
+
+    def get_column(self, name):
+        """Returns views of the values and presence arrays of the attribute column 'name' up to the number of slots in
+        use. Use for vectorized operations, but note that empty slots and absent values contain filler data, always
+        mask with the presence array. Returns None, None if the column does not exist."""
+        try:
+            values, present = self.__columns[name]
+        except KeyError:
+            return None, None
+        return values[:self.__size], present[:self.__size]
+
+    def get_column_dtype(self, name, slots=None):
+        """Returns the dtype of the values written to the column 'name', i.e. that of the column itself unless the
+        column mixes bools, integers and floats, in which case it is the smallest dtype holding the values present in
+        'slots' (all slots if None). Returns None if the column does not exist."""
+        if name not in self.__columns:
+            return None
+        values, present = self.__columns[name]
+        if name not in self.__valuetypes:
+            return values.dtype
+        slots = np.arange(self.__size) if slots is None else np.asarray(slots, dtype=np.int64)
+        codes = self.__valuetypes[name][slots][present[slots]]
+        if len(codes) == 0:
+            return values.dtype
+        return np.dtype([None, bool, np.int64, np.float64][int(codes.max())])
+
+    def set_column(self, name, values, slots=None):
+        """Writes an entire array of values to the attribute column 'name' in a single operation.
+
+        :param name: the attribute name
+        :param values: array-like of values, one per slot in 'slots'
+        :param slots: array of slot indices to write to, if None, writes to all occupied slots in ascending order
+        """
+        if slots is None:
+            slots = self.get_occupied_slots()
+        values = np.asarray(values)
+        if values.dtype.kind in "USO":      # Strings and other Python objects are kept as objects
+            values = values.astype(object)
+        column = self.__prepare_column(name, values.dtype, slots)
+        column[0][slots] = values
+        column[1][slots] = True
+        return True
+
+    def reset_table(self):
+        """Erases all columns and slots."""
+        self.__init__(self.__assettype)
+
+    def __grow(self, capacity):
+        """Enlarges all arrays in the table to the new capacity."""
+        extra = capacity - self.__capacity
+        self.__occupied = np.concatenate([self.__occupied, np.zeros(extra, dtype=bool)])
+        self.__slotnames = np.concatenate([self.__slotnames, np.full(extra, None, dtype=object)])
+        for column in self.__columns.values():
+            column[0] = np.concatenate([column[0], self.__empty_array(column[0].dtype, extra)])
+            column[1] = np.concatenate([column[1], np.zeros(extra, dtype=bool)])
+        for name in self.__valuetypes.keys():
+            self.__valuetypes[name] = np.concatenate([self.__valuetypes[name], np.zeros(extra, dtype=np.int8)])
+        self.__capacity = capacity
+
+    @staticmethod
+    def __empty_array(dtype, length):
+        if dtype == object:
+            return np.full(length, None, dtype=object)
+        return np.zeros(length, dtype=dtype)
+
+
+class UBCoordinateBuffer(object):
+    """A growable float64 array that holds the coordinates of many UBCompactVector() objects back to back. Each vector
+    only keeps the offset and length of its rings in the buffer, so that large grids of polygons do not need a tuple
+    object per point. Coordinates are appended only, space of changed or removed geometries is not reclaimed.
+
+    :param capacity: initial number of values the buffer can hold before it has to grow
+    """
+    def __init__(self, capacity=1024):
+        self.__data = np.zeros(max(int(capacity), 1), dtype=np.float64)
+        self.__size = 0
+
+    def __getstate__(self):
+        """Only pickles the used part of the buffer."""
+        return {"data": self.__data[:self.__size].copy(), "size": self.__size}
+
+    def __setstate__(self, state):
+        self.__data = state["data"]
+        self.__size = state["size"]
+        if len(self.__data) == 0:
+            self.__data = np.zeros(1, dtype=np.float64)
+
+    def get_size(self):
+        """Returns the number of values stored in the buffer."""
+        return self.__size
+
+    def get_nbytes(self):
+        """Returns the memory taken up by the buffer's array in bytes, including unused capacity."""
+        return self.__data.nbytes
+
+    def append_points(self, points):
+        """Appends a list of (x, y) or (x, y, z) tuples to the buffer.
+
+        :param points: list or tuple of coordinate tuples, all having the same number of dimensions
+        :return: the offset of the first value in the buffer
+        """
+        values = np.asarray(points, dtype=np.float64).ravel()
+        offset = self.__size
+        if offset + len(values) > len(self.__data):
+            capacity = len(self.__data)
+            while offset + len(values) > capacity:
+                capacity *= 2
+            self.__data = np.concatenate([self.__data, np.zeros(capacity - len(self.__data), dtype=np.float64)])
+        self.__data[offset:offset + len(values)] = values
+        self.__size += len(values)
+        return offset
+
+    def get_array(self, offset, count, ndims):
+        """Returns a read-only (count x ndims) view of 'count' points starting at 'offset'."""
+        view = self.__data[offset:offset + count * ndims].reshape(count, ndims)
+        view.flags.writeable = False
+        return view
+
+
+VALUE_TYPES = [None, bool, int, float]     # Python types of the codes of mixed numeric columns, see UBAttributeTable
+
+
+def infer_column_dtype(value):
+    """Returns the numpy dtype that a column needs to hold 'value'. Numbers are stored in typed arrays, everything
+    else (strings, lists, None, etc.) is stored as Python objects."""
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype(bool)
+    elif isinstance(value, (int, np.integer)):
+        return np.dtype(np.int64)
+    elif isinstance(value, (float, np.floating)):
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def get_value_type_code(dtype):
+    """Returns the index in VALUE_TYPES of the Python type that values of a numeric dtype are read back as, 0 for
+    all other dtypes."""
+    return {"b": 1, "i": 2, "u": 2, "f": 3}.get(np.dtype(dtype).kind, 0)
+
+
+def promote_column_dtype(current, new):
+    """Returns the smallest dtype that can hold values of both the 'current' and 'new' column dtypes."""
+    current, new = np.dtype(current), np.dtype(new)
+    if current == new:
+        return current
+    if current == object or new == object:
+        return np.dtype(object)
+    if current.kind in "biu" and new.kind in "biu":
+        return np.dtype(np.int64)
+    if current.kind in "biuf" and new.kind in "biuf":
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+class UBAttributeContainer(object):
+    """The attribute methods shared by UBComponent and UBCompactVector. Attributes are held in a private dictionary
+    or, if the container belongs to a columnar UBCollection, in that collection's UBAttributeTable, in which case all
+    attribute methods act as proxies to the container's slot in the table. Has no instance storage of its own, so that
+    slotted subclasses stay slotted.
+    """
+    __slots__ = ()
+    __store = None      # Class-level defaults keep components pickled before the columnar store was added loadable
+    __slot = None
+    __registry = None   # UBOverlayRegistry of the collection, only set once a snapshot of the collection is taken
+
     def __init__(self):
         """Only contains the attribute property, but this is a private dictionary and can only be accessed
         through the class methods."""
@@ -166,11 +546,17 @@ class UBComponent(object):
 
     def add_attribute(self, name, value):
         """Adds attribute of name and value to the self.__attribute dictionary."""
+        self.prepare_attribute_write(name)
+        if self.__store is not None:
+            return self.__store.set_value(self.__slot, name, value)
         self.__attributes[name] = value
         return True
 
     def set_attribute(self, name, value):
         """Allows setting of the attribute 'name' value to value only if that attribute exists."""
+        self.prepare_attribute_write(name)
+        if self.__store is not None:
+            return self.__store.set_value(self.__slot, name, value)
         try:
             self.__attributes[name] = value
         except KeyError:
@@ -181,30 +567,94 @@ class UBComponent(object):
         """Changes an attribute of the Component() with name and value, if the attribute doesn't exist, it adds it
         to the list. The naming of this function is intentional even though it does the same thing as 'add attribute'
         """
-        if name in self.__attributes.keys():
+        self.prepare_attribute_write(name)
+        if self.__store is not None:
+            self.__store.set_value(self.__slot, name, value)
+        elif name in self.__attributes.keys():
             self.__attributes[name] = value
         else:
             self.__attributes[name] = value
 
     def get_attribute(self, name):
         """Tries to return the value of attribute by name, if KeyError, returns None."""
+        if self.__store is not None:
+            return self.__store.get_value(self.__slot, name)
         try:
             return self.__attributes[name]
         except KeyError:
             return None
 
     def get_all_attributes(self):
-        """Returns the entire dictionary, use sparingly or primarily for exporting data."""
+        """Returns the entire dictionary, use sparingly or primarily for exporting data. If the component is attached
+        to a columnar store, this is a copy and changes to it are not written back."""
+        if self.__store is not None:
+            return self.__store.get_slot_attributes(self.__slot)
         return self.__attributes
 
     def remove_attribute(self, name):
         """Removes the attribute from the attributes list with the given 'name'."""
+        self.prepare_attribute_write(name)
+        if self.__store is not None:
+            return self.__store.remove_value(self.__slot, name)
         try:
             self.__attributes.pop(name)
             return True
         except KeyError:
             return False
 
+    def attach_attribute_store(self, store, slot):
+        """Moves all attributes of the component into the slot 'slot' of the UBAttributeTable 'store'. From then on,
+        all attribute methods read and write the table."""
+        for name, value in self.__attributes.items():
+            store.set_value(slot, name, value)
+        self.__attributes = {}
+        self.__store = store
+        self.__slot = slot
+        return True
+
+    def detach_attribute_store(self):
+        """Releases the component's slot in its attribute table and moves the attributes back into the component's
+        own dictionary."""
+        if self.__store is None:
+            return False
+        self.__attributes = self.__store.release_slot(self.__slot)
+        self.__store = None
+        self.__slot = None
+        return True
+
+    def get_attribute_store(self):
+        """Returns the [UBAttributeTable, slot] the component is attached to, [None, None] if it is not."""
+        return [self.__store, self.__slot]
+
+    def set_overlay_registry(self, registry):
+        """Links the component to the UBOverlayRegistry of its collection, done when a snapshot is taken."""
+        self.__registry = registry
+
+    def prepare_attribute_write(self, name):
+        """Copies the current value of the attribute 'name' into the overlays of all live snapshots that still read it
+        from this component, so that the following write does not show up in the snapshots."""
+        if self.__registry is None:
+            return
+        for overlay in self.__registry.get_overlays(self):
+            overlay.preserve_attribute(name, self.get_attribute(name))
+
+
+class UBComponent(UBAttributeContainer):
+    """The most basic data container in UrbanBEATS, the UBComponent(), which can be used to store and manage
+    any form of non-spatial data, e.g. an attributes list. It has several functions that allows its children
+    to access when inherited. The attribute methods are those of UBAttributeContainer.
+    """
+    def __init__(self):
+        UBAttributeContainer.__init__(self)
+
+    def __setstate__(self, state):
+        """Restores a pickled component, including those pickled before the attribute methods were moved into
+        UBAttributeContainer."""
+        for name in ["__attributes", "__store", "__slot"]:
+            if "_UBComponent" + name in state:
+                state["_UBAttributeContainer" + name] = state.pop("_UBComponent" + name)
+        self.__dict__.update(state)
+
 
 class UBStakeholder(UBComponent):
     """UrbanBEATS Stakeholder Data Format, inherited from UBComponent, it stores stakeholder based information and also
@@ -237,6 +687,9 @@ class UBVector(UBComponent):
     :param edges: A list of edges belonging to the Vector Component
     :param interior: A list of polygon coordinates if the feature is a Polygon with a hole (i.e., a donut)
     """
+    __shapelygeom = None    # Class-level defaults keep vectors pickled before geometry caching was added loadable
+    __preparedgeom = None
+
     def __init__(self, points, edges=None, interiors=[]):
         UBComponent.__init__(self)
         self.__dtype = ""
@@ -246,11 +699,20 @@ class UBVector(UBComponent):
         self.__extents = []
         self.__centroidXY = []
         self.__nativeEPSG = None
+        self.__shapelygeom = None      # Cached Shapely geometry, created on first request
+        self.__preparedgeom = None     # Cached prepared Shapely geometry, created on first request
         # self.__edges has None type if the data type is a point otherwise a tuple array of edges
         # of format ( ( (x1, y1), (x2, y2) ), ( ... ),  ... )
 
         self.determine_geometry()
 
+    def __getstate__(self):
+        """Pickles the vector without its cached Shapely geometries, prepared geometries cannot be pickled."""
+        state = self.__dict__.copy()
+        state.pop("_UBVector__shapelygeom", None)
+        state.pop("_UBVector__preparedgeom", None)
+        return state
+
     def set_epsg(self, epsg):
         """Sets the native EPSG coordinate system code of the UBVector"""
         self.__nativeEPSG = epsg
@@ -264,7 +726,8 @@ class UBVector(UBComponent):
         which is communicated as a warning."""
         currentgeometry = self.__dtype
         self.__points = points
-        self.determine_geometry(self.__points)
+        self.clear_geometry_cache()
+        self.determine_geometry()
         if currentgeometry != self.__dtype:
             print("WARNING: GEOMETRY TYPE HAS CHANGED!")
 
@@ -287,12 +750,37 @@ class UBVector(UBComponent):
         return self.__interiors
 
     def get_geometry_as_shapely_polygon(self):
-        """Returns the UBVector geometry as a Shapely polygon only if it is of dtype FACE, else returns None"""
+        """Returns the UBVector geometry as a Shapely polygon only if it is of dtype FACE, else returns None. The
+        polygon is created once and cached."""
         if self.__dtype == "FACE":
-            return Polygon(self.__points, self.__interiors)
+            return self.get_shapely_geometry()
         else:
             return None
 
+    def get_shapely_geometry(self):
+        """Returns the UBVector geometry as a Shapely Point, LineString or Polygon depending on its dtype. The
+        geometry is created on the first call and cached until the coordinates change."""
+        if self.__shapelygeom is None:
+            if self.__dtype == "POINT":
+                self.__shapelygeom = Point(self.__points[0])
+            elif self.__dtype == "FACE":
+                self.__shapelygeom = Polygon(self.__points, self.__interiors)
+            else:
+                self.__shapelygeom = LineString(self.__points)
+        return self.__shapelygeom
+
+    def get_prepared_geometry(self):
+        """Returns a prepared version of the Shapely geometry for fast repeated predicates (intersects, contains,
+        etc.) against many other geometries. Created on the first call and cached until the coordinates change."""
+        if self.__preparedgeom is None:
+            self.__preparedgeom = prep(self.get_shapely_geometry())
+        return self.__preparedgeom
+
+    def clear_geometry_cache(self):
+        """Removes the cached Shapely and prepared geometries, e.g. to free memory after an overlay."""
+        self.__shapelygeom = None
+        self.__preparedgeom = None
+
     def get_geometry_as_ogr_spec(self):
         """Returns the UBVector geometry as a list of coordinates for use with osgeo OGR library if dtype is FACE,
         returns None otherwise."""
@@ -376,16 +864,438 @@ class UBVector(UBComponent):
         return True
 
 
+class UBCompactVector(UBAttributeContainer):
+    """Memory-saving variant of UBVector for large grids of simple geometries (fishnets, parcels, patches). Instead of
+    an instance dictionary, point tuples and edge tuples, it uses __slots__ and keeps its coordinates in a
+    UBCoordinateBuffer shared by all vectors of a collection. Edges, extents and the centroid are derived from the
+    coordinates when requested. Coordinates are returned as floats.
+
+    The attribute methods are those of UBAttributeContainer, shared with UBComponent.
+
+    :param points: A tuple list of points belonging to the Vector Component
+    :param buffer: the UBCoordinateBuffer to store the coordinates in, usually UBCollection.get_coordinate_buffer()
+    :param interiors: A list of polygon coordinates if the feature is a Polygon with a hole (i.e., a donut)
+    """
+    __slots__ = ("_UBAttributeContainer__attributes", "_UBAttributeContainer__store", "_UBAttributeContainer__slot",
+                 "_UBAttributeContainer__registry", "__buffer", "__offset", "__ringsizes", "__ndims", "__dtype",
+                 "__nativeEPSG")
+    __statenames = ("__attributes", "__store", "__slot", "__buffer", "__offset", "__ringsizes", "__ndims", "__dtype",
+                    "__nativeEPSG")
+
+    def __init__(self, points, buffer, interiors=None):
+        UBAttributeContainer.__init__(self)
+        self._UBAttributeContainer__store = None    # Slots have no class-level default, these are set explicitly
+        self._UBAttributeContainer__slot = None
+        self._UBAttributeContainer__registry = None
+        self.__buffer = buffer
+        self.__nativeEPSG = None
+        self.__set_rings(points, interiors)
+
+    def __getstate__(self):
+        return {name: getattr(self, self.__get_slot_name(name)) for name in self.__statenames}
+
+    def __setstate__(self, state):
+        for name in self.__statenames:
+            setattr(self, self.__get_slot_name(name), state[name])
+        self._UBAttributeContainer__registry = None     # Snapshots are not pickled along with their parent
+
+    @staticmethod
+    def __get_slot_name(name):
+        """Returns the slot of a pickled state entry, the attribute slots belong to UBAttributeContainer."""
+        if name in ["__attributes", "__store", "__slot"]:
+            return "_UBAttributeContainer" + name
+        return "_UBCompactVector" + name
+
+    def __set_rings(self, points, interiors):
+        """Writes the exterior and interior rings to the buffer and determines the geometry type."""
+        rings = [points] + [ring for ring in (interiors or [])]
+        self.__ndims = len(points[0])
+        self.__offset = self.__buffer.append_points([pt for ring in rings for pt in ring])
+        self.__ringsizes = tuple([len(ring) for ring in rings])
+        npoints = self.__ringsizes[0]
+        if npoints == 1:
+            self.__dtype = "POINT"
+        elif npoints == 2:
+            self.__dtype = "LINE"
+        elif tuple(points[0]) == tuple(points[npoints - 1]):
+            self.__dtype = "FACE"
+        else:
+            self.__dtype = "POLYLINE"
+
+    def __get_ring_array(self, index):
+        """Returns the coordinates of the ring at 'index' (0 = exterior) as a read-only numpy array."""
+        offset = self.__offset + sum(self.__ringsizes[:index]) * self.__ndims
+        return self.__buffer.get_array(offset, self.__ringsizes[index], self.__ndims)
+
+    def __get_ring(self, index):
+        return [tuple(pt) for pt in self.__get_ring_array(index).tolist()]
+
+    # --- GEOMETRY ---
+    def set_epsg(self, epsg):
+        """Sets the native EPSG coordinate system code of the vector"""
+        self.__nativeEPSG = epsg
+
+    def get_epsg(self):
+        """Returns the native EPSG code of the vector."""
+        return self.__nativeEPSG
+
+    def change_coordinates(self, points):
+        """Replaces the exterior coordinates, keeping the interiors. The new coordinates are appended to the buffer."""
+        currentgeometry = self.__dtype
+        self.__set_rings(points, self.get_interiors())
+        if currentgeometry != self.__dtype:
+            print("WARNING: GEOMETRY TYPE HAS CHANGED!")
+
+    def get_points(self, option=None):
+        """Returns an array of points (tuples), each having (x, y, z) sets of coordinates, see UBVector."""
+        points = self.__get_ring(0)
+        if len(points) == 1:
+            return points[0]
+        if option is None:
+            return points
+        if option == "all":     # Exterior and interior coordinates
+            for i in range(1, len(self.__ringsizes)):
+                points += self.__get_ring(i)
+            return points
+
+    def get_points_array(self):
+        """Returns the exterior coordinates as a read-only (n x dims) numpy array without creating tuples."""
+        return self.__get_ring_array(0)
+
+    def get_interiors(self):
+        return [self.__get_ring(i) for i in range(1, len(self.__ringsizes))]
+
+    def get_geometry_as_shapely_polygon(self):
+        """Returns the geometry as a Shapely polygon only if it is of dtype FACE, else returns None"""
+        if self.__dtype == "FACE":
+            return self.get_shapely_geometry()
+        else:
+            return None
+
+    def get_shapely_geometry(self):
+        """Returns the geometry as a Shapely Point, LineString or Polygon depending on its dtype. Unlike UBVector,
+        the geometry is not cached to keep the vector small."""
+        if self.__dtype == "POINT":
+            return Point(self.__get_ring_array(0)[0])
+        elif self.__dtype == "FACE":
+            return Polygon(self.__get_ring_array(0),
+                           [self.__get_ring_array(i) for i in range(1, len(self.__ringsizes))])
+        return LineString(self.__get_ring_array(0))
+
+    def get_prepared_geometry(self):
+        """Returns a prepared version of the Shapely geometry, see UBVector. Not cached."""
+        return prep(self.get_shapely_geometry())
+
+    def get_geometry_as_ogr_spec(self):
+        """Returns the geometry as a list of coordinates for use with osgeo OGR library if dtype is FACE,
+        returns None otherwise."""
+        if self.__dtype == "FACE":
+            return [self.__get_ring(i) for i in range(len(self.__ringsizes))]
+        else:
+            return None
+
+    def get_edges(self):
+        """Returns the edges of all rings as tuples of consecutive points, None if the geometry is a point."""
+        if self.__dtype == "POINT":
+            return None
+        edges = []
+        for i in range(len(self.__ringsizes)):
+            ring = self.__get_ring(i)
+            edges += [(ring[p], ring[p + 1]) for p in range(len(ring) - 1)]
+        return edges
+
+    def get_extents(self):
+        """Returns the map extents as [xmin, xmax, ymin, ymax]"""
+        coords = self.__get_ring_array(0)
+        return [float(coords[:, 0].min()), float(coords[:, 0].max()),
+                float(coords[:, 1].min()), float(coords[:, 1].max())]
+
+    def get_centroid(self):
+        """Returns the centroid XY coordinates."""
+        extents = self.get_extents()
+        return [(extents[0] + extents[1]) / 2.0, (extents[2] + extents[3]) / 2.0]
+
+    def shares_geometry(self, geom_object, geom_type="points", select="all"):
+        """Determines whether the current geometry shares points or edges with another vector, see UBVector."""
+        if geom_type == "points":
+            checkpoints, thisgeom = geom_object.get_points(), self.__get_ring(0)
+        elif geom_type == "edges":
+            checkpoints, thisgeom = geom_object.get_edges(), self.get_edges()
+        else:
+            return False
+        if select != "all":
+            thisgeom = [thisgeom[i] for i in select]
+        for item in thisgeom:
+            if item in checkpoints:
+                return True
+        return False
+
+    def get_geometry_type(self):
+        return self.__dtype
+
+
+class UBOverlayRegistry(object):
+    """Keeps track of the live snapshots of a collection, see UBCollection.snapshot(). Assets of the collection ask the
+    registry for their overlays before an attribute is written, so that the snapshots keep the old value. Snapshots
+    are only weakly referenced and drop out once they are no longer used."""
+    def __init__(self):
+        self.__snapshots = []   # weakref.ref() of each snapshot UBCollection()
+
+    def __getstate__(self):
+        return {"snapshots": None}   # Snapshots are not pickled along with their parent
+
+    def __setstate__(self, state):
+        self.__snapshots = []
+
+    def add_snapshot(self, collection):
+        self.__snapshots.append(weakref.ref(collection))
+
+    def has_snapshots(self):
+        """Returns True if at least one snapshot of the collection is still alive."""
+        self.__snapshots = [ref for ref in self.__snapshots if ref() is not None]
+        return len(self.__snapshots) > 0
+
+    def get_overlays(self, asset):
+        """Returns the UBAssetOverlay() objects of all live snapshots that read from 'asset'."""
+        overlays = []
+        for ref in list(self.__snapshots):
+            snap = ref()
+            if snap is None:
+                self.__snapshots.remove(ref)
+                continue
+            overlay = snap.get_overlay_of_asset(asset)
+            if overlay is not None:
+                overlays.append(overlay)
+        return overlays
+
+
+class UBAssetOverlay(object):
+    """Copy-on-write view of an asset, used by the assets of a UBCollection.snapshot(). Attribute reads fall through
+    to the base asset of the parent collection until the attribute is changed in the snapshot, changes are kept in the
+    overlay only. Writes to the base asset first copy the old value into the overlay (see preserve_attribute()) and
+    list, dict and set values are copied into the overlay when they are first read, so the snapshot is isolated from
+    the parent in both directions. Geometry methods are passed to the base asset, changing the coordinates or the EPSG
+    code first makes a private copy of the base geometry so that the parent is never modified.
+
+    :param base: the asset (UBComponent, UBVector, UBCompactVector) in the parent collection
+    :param owner: the snapshot UBCollection() the overlay belongs to
+    :param typekey: the asset type key of the asset, e.g. "Block", None for assets without a type (e.g. "meta")
+    """
+    __slots__ = ("__base", "__changes", "__removed", "__copied", "__pinned", "__owner", "__typekey", "__registry")
+
+    def __init__(self, base, owner=None, typekey=None):
+        self.__base = base
+        self.__changes = None   # {name: value} of attributes changed in the snapshot, created on the first write
+        self.__removed = None   # set() of attribute names removed in the snapshot, created on the first removal
+        self.__copied = False   # True once the base geometry has been copied for a geometry change
+        self.__pinned = None    # set() of names in changes/removed that only keep the parent's value, not a change
+        self.__owner = owner
+        self.__typekey = typekey
+        self.__registry = None  # UBOverlayRegistry of the snapshot, set if a snapshot is taken of the snapshot
+
+    def __getstate__(self):
+        state = {name: getattr(self, "_UBAssetOverlay" + name) for name in self.__slots__}
+        state["__registry"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, "_UBAssetOverlay" + name, state.get(name))
+        self.__copied = bool(self.__copied)
+
+    def __getattr__(self, name):
+        """Passes all other methods (geometry, points, extents, etc.) on to the base asset."""
+        if name.startswith("_UBAssetOverlay"):
+            raise AttributeError(name)
+        return getattr(self.__base, name)
+
+    def get_base_asset(self):
+        """Returns the asset of the parent collection this overlay reads from."""
+        return self.__base
+
+    def is_modified(self):
+        """Returns True if any attribute or the geometry has been changed in the snapshot."""
+        pinned = self.__pinned or set()
+        return any([name not in pinned for name in list(self.__changes or {}) + list(self.__removed or [])]) or \
+            self.__copied
+
+    # --- ATTRIBUTES ---
+    def add_attribute(self, name, value):
+        """Adds or changes the attribute in the snapshot only."""
+        self.prepare_attribute_write(name)
+        if self.__changes is None:
+            self.__changes = {}
+        self.__changes[name] = value
+        if self.__removed is not None:
+            self.__removed.discard(name)
+        if self.__pinned is not None:
+            self.__pinned.discard(name)
+        return True
+
+    def set_attribute(self, name, value):
+        return self.add_attribute(name, value)
+
+    def change_attribute(self, name, value):
+        self.add_attribute(name, value)
+
+    def get_attribute(self, name):
+        """Returns the attribute value changed in the snapshot, else the value of the base asset. Lists, dicts and
+        sets of the base asset are copied into the snapshot on first access, so changing them in place (e.g.
+        appending to "UpstrIDs") does not change the parent."""
+        if self.__changes is not None and name in self.__changes:
+            return self.__changes[name]
+        if self.__removed is not None and name in self.__removed:
+            return None
+        value = self.__base.get_attribute(name)
+        if isinstance(value, (list, dict, set)):
+            value = copy.deepcopy(value)
+            self.__pin(name)
+            self.__changes[name] = value
+        return value
+
+    def get_all_attributes(self):
+        """Returns a new dictionary of all attributes as seen from the snapshot. Mutable values of the base asset are
+        copies."""
+        attributes = dict(self.__base.get_all_attributes())
+        for name in self.__removed or []:
+            attributes.pop(name, None)
+        for name, value in attributes.items():
+            if isinstance(value, (list, dict, set)):
+                attributes[name] = copy.deepcopy(value)
+        attributes.update(self.__changes or {})
+        return attributes
+
+    def remove_attribute(self, name):
+        """Removes the attribute in the snapshot only."""
+        self.prepare_attribute_write(name)
+        exists = name in self.get_all_attributes()
+        if self.__changes is not None:
+            self.__changes.pop(name, None)
+        if self.__removed is None:
+            self.__removed = set()
+        self.__removed.add(name)
+        if self.__pinned is not None:
+            self.__pinned.discard(name)
+        return exists
+
+    def preserve_attribute(self, name, value):
+        """Called by the base asset before its attribute 'name' is written in the parent collection. Unless the
+        snapshot has its own value, the current value 'value' (None if absent) is kept in the overlay."""
+        if (self.__changes is not None and name in self.__changes) or \
+                (self.__removed is not None and name in self.__removed):
+            return
+        self.__pin(name)
+        if value is None:
+            self.__removed = set() if self.__removed is None else self.__removed
+            self.__removed.add(name)
+        else:
+            self.__changes[name] = copy.deepcopy(value) if isinstance(value, (list, dict, set)) else value
+
+    def __pin(self, name):
+        """Marks the attribute 'name' as held in the overlay only to keep the parent's value."""
+        if self.__changes is None:
+            self.__changes = {}
+        if self.__pinned is None:
+            self.__pinned = set()
+        self.__pinned.add(name)
+
+    def set_overlay_registry(self, registry):
+        """Links the overlay to the UBOverlayRegistry of its snapshot, done when a snapshot of the snapshot is taken."""
+        self.__registry = registry
+
+    def prepare_attribute_write(self, name):
+        """Keeps the current value of 'name' in the overlays of snapshots taken of this snapshot, see UBComponent."""
+        if self.__registry is None:
+            return
+        for overlay in self.__registry.get_overlays(self):
+            overlay.preserve_attribute(name, self.get_attribute(name))
+
+    def attach_attribute_store(self, store, slot):
+        return False    # Overlays keep their changes themselves, the base asset may be attached to the parent's store
+
+    def detach_attribute_store(self):
+        return False
+
+    def get_attribute_store(self):
+        return [None, None]
+
+    # --- GEOMETRY WRITES ---
+    def change_coordinates(self, points):
+        """Changes the coordinates of a private copy of the base geometry. The snapshot's spatial index of the asset
+        type is dropped, as it still holds the old geometry."""
+        self.__copy_base()
+        self.__base.change_coordinates(points)
+        if self.__owner is not None and self.__typekey is not None:
+            self.__owner.clear_spatial_index(self.__typekey)
+
+    def set_epsg(self, epsg):
+        self.__copy_base()
+        self.__base.set_epsg(epsg)
+
+    def __copy_base(self):
+        """Replaces the base asset by a shallow copy before its geometry is changed. The copy still reads its
+        attributes from the parent, which the overlay never writes to."""
+        if not self.__copied:
+            self.__base = copy.copy(self.__base)
+            self.__copied = True
+
+
 class UBCollection(object):
     """The UrbanBEATS Collection class structure. A collection stores a whole array of assets
     from the modelling outputs. It ca be used to organise geometric and non-geometric assets based
-    on scenarios or other aspects of the spatial environment."""
-    def __init__(self, identifier, containertype="Other"):
+    on scenarios or other aspects of the spatial environment.
+
+    If 'columnar' is True, the attributes of all assets following the "<Type>ID<n>" naming convention are held in one
+    UBAttributeTable per asset type instead of one dictionary per asset. Asset attribute methods keep working, while
+    modules can access whole columns through get_attribute_table()."""
+    def __init__(self, identifier, containertype="Other", columnar=False):
         self.__containername = identifier
         self.__containertype = containertype    # "Scenario", "Standalone", "Other"
         self.__assettypes = {}      # Type: [AssetGeometry, count]
         self.__globalassetcount = 0
         self.__assets = {}
+        self.__typeindex = {}       # Type: {asset name: sequence}, ordered index of asset names by "<Type>ID" prefix
+        self.__assetsequence = 0    # Running insertion number, used to restore asset order of any subset of names
+        self.__columnar = columnar
+        self.__attributetables = {}     # Type: UBAttributeTable(), only used if the columnar store is active
+        self.__coordinatebuffer = None  # UBCoordinateBuffer() shared by all UBCompactVector() assets, created on demand
+        self.__spatialindex = {}    # Type: [STRtree, [asset names], [geometries], {id(geometry): index}, extents]
+        self.__adjacency = {}       # Type: [array of asset IDs (row order), {weight name: scipy.sparse CSR matrix}]
+        self.__idlookup = {}        # Type: numpy object array with each asset at the index of its integer ID
+        self.__parentname = None    # Name of the collection this one is a snapshot of, None if it is not a snapshot
+        self.__overlayregistry = None   # UBOverlayRegistry() of the live snapshots of this collection
+        self.__overlaylookup = {}   # id(parent asset): (parent asset, UBAssetOverlay()), only used by snapshots
+
+    def __getstate__(self):
+        """Pickles the collection without its spatial indices, these are rebuilt on the next query."""
+        state = self.__dict__.copy()
+        state["_UBCollection__spatialindex"] = {}
+        state["_UBCollection__idlookup"] = {}
+        state["_UBCollection__overlaylookup"] = {}      # Keyed by id(), only valid while the parent is in memory
+        return state
+
+    def __setstate__(self, state):
+        """Restores a pickled collection, filling in any properties that did not exist when it was saved."""
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_UBCollection__columnar", False)
+        self.__dict__.setdefault("_UBCollection__attributetables", {})
+        self.__dict__.setdefault("_UBCollection__coordinatebuffer", None)
+        self.__dict__.setdefault("_UBCollection__spatialindex", {})
+        self.__dict__.setdefault("_UBCollection__adjacency", {})
+        self.__dict__.setdefault("_UBCollection__idlookup", {})
+        self.__dict__.setdefault("_UBCollection__parentname", None)
+        self.__dict__.setdefault("_UBCollection__overlayregistry", None)
+        self.__dict__.setdefault("_UBCollection__overlaylookup", {})
+        if "_UBCollection__typeindex" not in self.__dict__ or "_UBCollection__assetsequence" not in self.__dict__:
+            self.__rebuild_type_index()
+
+    def __rebuild_type_index(self):
+        """Rebuilds the per-type asset index from the asset dictionary, preserving the asset order."""
+        self.__typeindex = {}
+        self.__assetsequence = 0
+        for name in self.__assets.keys():
+            self.__typeindex.setdefault(name.split("ID")[0], {})[name] = self.__assetsequence
+            self.__assetsequence += 1
 
     # General container management
     def get_container_name(self):
@@ -401,11 +1311,172 @@ class UBCollection(object):
     def get_asset_types(self):
         return self.__assettypes
 
+    def snapshot(self, name):
+        """Returns a copy-on-write snapshot of the collection, e.g. to test a design variant. The snapshot holds a
+        UBAssetOverlay() for every asset that reads geometry and attributes from this collection and keeps any changes
+        to itself. Unchanged geometry, attribute dictionaries and columns are shared, so creating a snapshot costs one
+        small object per asset. Attribute writes to this collection's assets after the snapshot was taken first copy
+        the old value into the snapshot, so the snapshot keeps the state at the time it was taken. Bulk writes
+        through set_attribute_array() are covered, writes directly into an attribute table's columns and geometry
+        changes of this collection's assets are not.
+
+        :param name: the name of the new collection
+        :return: UBCollection() of type "Scenario"
+        """
+        if self.__overlayregistry is None:
+            self.__overlayregistry = UBOverlayRegistry()
+        snap = UBCollection(name, "Scenario")
+        snap.__parentname = self.__containername
+        snap.__assettypes = dict([(k, list(v)) for k, v in self.__assettypes.items()])
+        snap.__globalassetcount = self.__globalassetcount
+        typekeys = dict([(n, k) for k, names in self.__typeindex.items() for n in names])
+        for n, a in self.__assets.items():
+            a.set_overlay_registry(self.__overlayregistry)
+            snap.__assets[n] = UBAssetOverlay(a, snap, typekeys.get(n))
+            snap.__overlaylookup[id(a)] = (a, snap.__assets[n])
+        snap.__typeindex = dict([(k, v.copy()) for k, v in self.__typeindex.items()])
+        snap.__assetsequence = self.__assetsequence
+        snap.__coordinatebuffer = self.__coordinatebuffer   # Append-only, so new geometries never overwrite shared ones
+        snap.__spatialindex = self.__spatialindex.copy()    # Overlays drop their type's tree if they change geometry
+        snap.__adjacency = self.__adjacency.copy()
+        self.__overlayregistry.add_snapshot(snap)
+        return snap
+
+    def get_overlay_of_asset(self, asset):
+        """Returns the UBAssetOverlay() of this snapshot that reads from the parent's 'asset', None if there is none."""
+        entry = self.__overlaylookup.get(id(asset))
+        if entry is None or entry[0] is not asset:
+            return None
+        return entry[1]
+
+    def memory_report(self):
+        """Measures the memory taken up by the collection, broken down per asset type and attribute. Python object
+        sizes are measured with sys.getsizeof() and followed through tuples, lists, dicts and sets, numpy arrays count
+        their data buffer. Objects shared between assets (e.g. points used in several edges) are counted once.
+
+        List-valued attributes whose longest list grows with the number of assets (e.g. UpstrIDs/DownstrIDs) make the
+        collection grow quadratically and are flagged in the "warnings" list.
+
+        :return: dictionary {"name", "assets", "total_bytes", "object_bytes", "array_bytes", "types", "shared",
+                "warnings"}, where "types" holds a dictionary per asset type with the keys "count", "instance_bytes",
+                "geometry_bytes", "attribute_bytes", "object_bytes", "array_bytes" and "attributes" (per attribute:
+                "bytes", "lists", "list_items", "max_list_length")
+        """
+        seen = set()
+        report = {"name": self.__containername, "assets": len(self.__assets), "types": {}, "shared": {},
+                  "warnings": []}
+        for typekey, names in self.__typeindex.items():
+            t = {"count": len(names), "instance_bytes": 0, "geometry_bytes": 0, "attribute_bytes": 0,
+                 "object_bytes": 0, "array_bytes": 0, "attributes": {}}
+            for name in names:
+                measure_asset_memory(self.__assets[name], t, seen)
+
+            table = self.__attributetables.get(typekey)
+            if table is not None:   # Columnar attributes are array data, object columns also hold Python objects
+                t["array_bytes"] += table.get_nbytes()
+                t["attribute_bytes"] += table.get_nbytes()
+                for attname in table.get_column_names():
+                    values, present = table.get_column(attname)
+                    att = t["attributes"].setdefault(attname, new_attribute_record())
+                    att["bytes"] += table.get_nbytes(attname)
+                    t["array_bytes"] += table.get_nbytes(attname)
+                    t["attribute_bytes"] += table.get_nbytes(attname)
+                    if values.dtype == object:
+                        for v in values[present].tolist():
+                            measure_attribute_memory(v, att, t, seen)
+
+            for attname, att in t["attributes"].items():
+                if att["lists"] > 0 and att["max_list_length"] >= max(16, 0.05 * t["count"]):
+                    report["warnings"].append(typekey + ": list attribute '" + attname + "' holds up to " +
+                                              str(att["max_list_length"]) + " items per asset (" +
+                                              str(att["list_items"]) + " in total for " + str(t["count"]) +
+                                              " assets), its size grows faster than the number of assets")
+            report["types"][typekey] = t
+
+        if self.__coordinatebuffer is not None:
+            report["shared"]["coordinate_buffer"] = self.__coordinatebuffer.get_nbytes()
+        adjacencybytes = 0
+        for ids, matrices in self.__adjacency.values():
+            adjacencybytes += ids.nbytes
+            for m in matrices.values():
+                adjacencybytes += m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+        if adjacencybytes:
+            report["shared"]["adjacency"] = adjacencybytes
+
+        report["object_bytes"] = sum([t["object_bytes"] for t in report["types"].values()])
+        report["array_bytes"] = sum([t["array_bytes"] for t in report["types"].values()]) + \
+            sum(report["shared"].values())
+        report["total_bytes"] = report["object_bytes"] + report["array_bytes"]
+        return report
+
+    def get_parent_name(self):
+        """Returns the name of the collection this collection is a snapshot of, None if it is not a snapshot."""
+        return self.__parentname
+
     # Simulation management - asset creation, modification etc.
+    # Columnar attribute store management
+    def is_columnar(self):
+        """Returns True if the asset attributes are held in the columnar store."""
+        return self.__columnar
+
+    def enable_columnar_store(self):
+        """Switches the collection to the columnar attribute store and moves the attributes of all existing assets
+        into their asset type's UBAttributeTable."""
+        if self.__columnar:
+            return True
+        self.__columnar = True
+        for name, asset in self.__assets.items():
+            self.__attach_to_table(name, asset)
+        return True
+
+    def disable_columnar_store(self):
+        """Moves all attributes back into the individual assets and drops the attribute tables."""
+        if not self.__columnar:
+            return True
+        for asset in self.__assets.values():
+            if isinstance(asset, (UBComponent, UBCompactVector)):
+                asset.detach_attribute_store()
+        self.__columnar = False
+        self.__attributetables = {}
+        return True
+
+    def get_coordinate_buffer(self):
+        """Returns the UBCoordinateBuffer that UBCompactVector() assets of this collection store their coordinates in,
+        creating it on first use."""
+        if self.__coordinatebuffer is None:
+            self.__coordinatebuffer = UBCoordinateBuffer()
+        return self.__coordinatebuffer
+
+    def get_attribute_table(self, assettype):
+        """Returns the UBAttributeTable of the given asset type (e.g. "Block" or "BlockID"), None if the collection
+        is not columnar or has no assets of that type."""
+        return self.__attributetables.get(get_asset_type_key(assettype))
+
+    def __attach_to_table(self, name, asset):
+        """Attaches the asset to the attribute table of its type if it follows the "<Type>ID<n>" naming convention."""
+        if not isinstance(asset, (UBComponent, UBCompactVector)) or "ID" not in name:
+            return False
+        assettype = name.split("ID")[0]
+        if assettype not in self.__attributetables:
+            self.__attributetables[assettype] = UBAttributeTable(assettype)
+        table = self.__attributetables[assettype]
+        asset.attach_attribute_store(table, table.allocate_slot(name))
+        return True
+
     def add_asset(self, name, asset):
         """Adds a new asset with the given 'name' to the asset library and increases the global asset and
         asset type counters respectively."""
+        if self.__columnar:
+            if name in self.__assets and isinstance(self.__assets[name], (UBComponent, UBCompactVector)):
+                self.__assets[name].detach_attribute_store()    # The asset is replaced, release its slot
+            self.__attach_to_table(name, asset)
+        self.__spatialindex.pop(name.split("ID")[0], None)      # Rebuilt on the next spatial query
+        if name not in self.__assets:   # A replaced asset keeps its position, just like in the asset dictionary
+            self.__adjacency.pop(name.split("ID")[0], None)     # A new asset is not part of the adjacency matrix
+            self.__typeindex.setdefault(name.split("ID")[0], {})[name] = self.__assetsequence
+            self.__assetsequence += 1
         self.__assets[name] = asset
+        self.__update_id_lookup(name, asset)
         self.__globalassetcount += 1
         try:
             self.__assettypes[name.split("ID")[0]][1] += 1
@@ -420,8 +1491,9 @@ class UBCollection(object):
             return None
 
     def get_assets_with_identifier(self, idstring, **kwargs):
-        """Scans the complete Asset List and returns all assets with the idstring contained in their name
-        e.g. BlockID contained in the name "BlockID1", "BlockID2", etc.)
+        """Returns all assets with the idstring contained in their name e.g. BlockID contained in the name "BlockID1",
+        "BlockID2", etc.). Asset type identifiers (e.g. "BlockID", "Block", "meta") are looked up in the per-type index
+        and returned in the order the assets were added, any other idstring scans the complete Asset List.
 
         :param idstring: the part of the string to search the asset database for (e.g. "BlockID")
         :param **kwargs: 'assetcol' = {} custom dictionary of assets
@@ -431,11 +1503,198 @@ class UBCollection(object):
             tempassetcol = kwargs["assetcol"]
         except KeyError:
             tempassetcol = self.__assets
+            typekey = get_asset_type_key(idstring)
+            if typekey in self.__typeindex:
+                return [tempassetcol[name] for name in self.__typeindex[typekey]]
+            elif typekey in self.__assettypes:
+                return assetcollection      # A registered asset type that currently has no assets
         for i in tempassetcol:
             if idstring in i:
                 assetcollection.append(tempassetcol[i])
         return assetcollection
 
+    # Integer ID lookups
+    def get_asset_by_id(self, asset_type, asset_id):
+        """Returns the asset of the given type and ID, e.g. ("BlockID", 5) returns the asset named "BlockID5". Integer
+        IDs are looked up by position in an array instead of building and hashing the name. Returns None if the asset
+        does not exist.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param asset_id: the ID of the asset, non-integer IDs (e.g. geohashes) are looked up by name
+        """
+        typekey = get_asset_type_key(asset_type)
+        lookup = self.__get_id_lookup(typekey)
+        if lookup is None or not isinstance(asset_id, (int, np.integer)):
+            return self.__assets.get(typekey + "ID" + str(asset_id))
+        if 0 <= asset_id < len(lookup):
+            return lookup[asset_id]
+        return None
+
+    def get_many(self, asset_type, id_array):
+        """Returns the assets of the given type for all IDs in 'id_array' in one vectorized lookup.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param id_array: array-like of asset IDs
+        :return: list [] of assets in the order of id_array, None where an asset does not exist
+        """
+        typekey = get_asset_type_key(asset_type)
+        lookup = self.__get_id_lookup(typekey)
+        ids = np.asarray(id_array)
+        if lookup is None or ids.dtype.kind not in "iu":
+            return [self.__assets.get(typekey + "ID" + str(i)) for i in ids.tolist()]
+        ids = ids.ravel()
+        assets = np.full(len(ids), None, dtype=object)
+        valid = (ids >= 0) & (ids < len(lookup))
+        assets[valid] = lookup[ids[valid]]
+        return assets.tolist()
+
+    def __get_id_lookup(self, typekey):
+        """Returns the ID lookup array of the asset type, building it on first use. None if the assets of that type do
+        not all have non-negative integer IDs in their names."""
+        if typekey not in self.__idlookup:
+            names = self.__typeindex.get(typekey, {})
+            ids = [name[len(typekey) + 2:] for name in names]
+            if len(ids) == 0 or not all([i.isdigit() for i in ids]):
+                self.__idlookup[typekey] = None
+            else:
+                lookup = np.full(max([int(i) for i in ids]) + 1, None, dtype=object)
+                for name, i in zip(names, ids):
+                    lookup[int(i)] = self.__assets[name]
+                self.__idlookup[typekey] = lookup
+        return self.__idlookup[typekey]
+
+    def __update_id_lookup(self, name, asset):
+        """Writes an added (or removed if asset is None) asset into the ID lookup array of its type, if it exists."""
+        typekey = name.split("ID")[0]
+        lookup = self.__idlookup.get(typekey)
+        if lookup is None:
+            self.__idlookup.pop(typekey, None)  # Rebuilt on demand, the new asset may make integer lookups possible
+            return True
+        suffix = name[len(typekey) + 2:]
+        if not suffix.isdigit():
+            self.__idlookup[typekey] = None
+            return True
+        if int(suffix) >= len(lookup):
+            if asset is None:
+                return True
+            lookup = np.concatenate([lookup, np.full(max(int(suffix) + 1, 2 * len(lookup)) - len(lookup), None,
+                                                     dtype=object)])
+            self.__idlookup[typekey] = lookup
+        lookup[int(suffix)] = asset
+        return True
+
+    # Spatial queries
+    def query_intersecting(self, asset_type, geometry_or_bbox):
+        """Returns all assets of the given type whose geometry intersects (or touches) the input geometry, using an
+        STRtree of the asset type that is built on first use and rebuilt after assets of that type are added or
+        removed. Assets are returned in the order they were added to the collection.
+
+        Note that changing an asset's coordinates does not update the index, call clear_spatial_index() if needed.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param geometry_or_bbox: a Shapely geometry or extents in the format [xmin, xmax, ymin, ymax]
+        :return: list [] of assets
+        """
+        index = self.__get_spatial_index(asset_type)
+        if index is None:
+            return []
+        geometry = geometry_or_bbox
+        if isinstance(geometry, (list, tuple)):
+            geometry = box(geometry[0], geometry[2], geometry[1], geometry[3])
+        hits = [i for i in strtree_query_indices(index[0], index[3], geometry) if index[2][i].intersects(geometry)]
+        return [self.__assets[index[1][i]] for i in sorted(hits)]
+
+    def query_nearest(self, asset_type, point, k=1):
+        """Returns the k assets of the given type closest to the input point, ordered by distance. The search
+        queries the STRtree with a box around the point that is doubled in size until k assets are found within it.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param point: Shapely Point or (x, y) tuple
+        :param k: number of assets to return
+        :return: list [] of assets, nearest first
+        """
+        index = self.__get_spatial_index(asset_type)
+        if index is None or k < 1:
+            return []
+        if not isinstance(point, Point):
+            point = Point(point[0], point[1])
+        k = min(k, len(index[1]))
+        xmin, xmax, ymin, ymax = index[4]
+        reach = max(abs(point.x - xmin), abs(point.x - xmax), abs(point.y - ymin), abs(point.y - ymax))
+        radius = max(xmax - xmin, ymax - ymin) / max(len(index[1]), 1) ** 0.5
+        radius = radius if radius > 0 else 1.0
+        while True:
+            searchbox = box(point.x - radius, point.y - radius, point.x + radius, point.y + radius)
+            hits = sorted(strtree_query_indices(index[0], index[3], searchbox))
+            distances = sorted([(index[2][i].distance(point), i) for i in hits])
+            if (len(distances) >= k and distances[k - 1][0] <= radius) or radius >= reach:
+                # Every geometry closer than 'radius' intersects the search box, so the k nearest are known
+                return [self.__assets[index[1][i]] for d, i in distances[:k]]
+            radius *= 2.0
+
+    def clear_spatial_index(self, asset_type=None):
+        """Removes the STRtree of the given asset type, or all of them if asset_type is None."""
+        if asset_type is None:
+            self.__spatialindex = {}
+        else:
+            self.__spatialindex.pop(get_asset_type_key(asset_type), None)
+        return True
+
+    def __get_spatial_index(self, asset_type):
+        """Returns the spatial index entry of the asset type, building it if necessary. None if there are no assets
+        of that type with a geometry."""
+        typekey = get_asset_type_key(asset_type)
+        if typekey not in self.__spatialindex:
+            names, geoms = [], []
+            for name in self.__typeindex.get(typekey, {}):
+                geometry = get_asset_geometry(self.__assets[name])
+                if geometry is not None and not geometry.is_empty:
+                    names.append(name)
+                    geoms.append(geometry)
+            if len(geoms) == 0:
+                self.__spatialindex[typekey] = None
+            else:
+                bounds = np.array([g.bounds for g in geoms])
+                extents = [bounds[:, 0].min(), bounds[:, 2].max(), bounds[:, 1].min(), bounds[:, 3].max()]
+                self.__spatialindex[typekey] = [STRtree(geoms), names, geoms,
+                                                dict([(id(geoms[i]), i) for i in range(len(geoms))]), extents]
+        return self.__spatialindex[typekey]
+
+    # Neighbourhood adjacency
+    def set_adjacency_matrix(self, asset_type, ids, matrices):
+        """Stores the neighbourhood adjacency of an asset type as sparse matrices, where row and column i refer to the
+        asset with ID ids[i]. The matrices are dropped as soon as assets of that type are added or removed.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param ids: array-like of asset IDs in row order
+        :param matrices: dictionary {weight name: scipy.sparse matrix}, e.g. {"connectivity": ..., "distance": ...}
+        """
+        self.__adjacency[get_asset_type_key(asset_type)] = [np.asarray(ids), dict(matrices)]
+        return True
+
+    def get_adjacency_matrix(self, asset_type, weight="connectivity"):
+        """Returns the sparse adjacency matrix of the asset type with the given edge weight, None if it does not
+        exist. Row and column order is given by get_adjacency_ids()."""
+        adjacency = self.__adjacency.get(get_asset_type_key(asset_type))
+        if adjacency is None:
+            return None
+        return adjacency[1].get(weight)
+
+    def get_adjacency_ids(self, asset_type):
+        """Returns the array of asset IDs corresponding to the rows of the adjacency matrices, None if there are
+        no adjacency matrices for the asset type."""
+        adjacency = self.__adjacency.get(get_asset_type_key(asset_type))
+        if adjacency is None:
+            return None
+        return adjacency[0]
+
+    def get_adjacency_weights(self, asset_type):
+        """Returns the names of the edge weights stored for the asset type."""
+        adjacency = self.__adjacency.get(get_asset_type_key(asset_type))
+        if adjacency is None:
+            return []
+        return list(adjacency[1].keys())
+
     def retrieve_attribute_value_list(self, asset_identifier, attribute_name, asset_ids):
         """Returns a list [] of the attribute value specified by "attribute_name" for all asset of type "asset_identifier"
         with the IDs "asset_ids". Note that with asset identifiers, use only the legal identifiers, refer to ubglobals
@@ -445,25 +1704,132 @@ class UBCollection(object):
         :param asset_ids: list() of all ID numbers to search for
         :return: list() object containing all values in the ascending order of asset_ids
         """
-        assetcol = self.get_assets_with_identifier(asset_identifier)
-        if "ID" in asset_identifier:  # e.g. if someone wrote "BlockID" as the asset identifier...
-            nameid = asset_identifier
-        else:
-            nameid = asset_identifier + "ID"
+        typekey = get_asset_type_key(asset_identifier)
+        nameid = typekey + "ID"
+        typeindex = self.__typeindex.get(typekey, {})
+
+        # Look up only the requested assets, then restore the order in which they were added to the collection
+        names = set(nameid + str(i) for i in asset_ids)
+        names = sorted([n for n in names if n in typeindex], key=typeindex.get)
 
         attribute_values = [[], []]  # Asset ID, Asset Value
-        for asset in assetcol:
-            if asset.get_attribute(nameid) in asset_ids:
-                attribute_values[0].append(asset.get_attribute(nameid))
-                attribute_values[1].append(asset.get_attribute(attribute_name))
+        for n in names:
+            asset = self.__assets[n]
+            attribute_values[0].append(asset.get_attribute(nameid))
+            attribute_values[1].append(asset.get_attribute(attribute_name))
         return attribute_values  # returned in ascending order of the asset_ids
 
+    def get_asset_ids(self, asset_type, status_only=False):
+        """Returns a numpy array of the IDs of all assets of the given type (e.g. "BlockID") in the order they were
+        added to the collection. This is the order used by get_attribute_array() and set_attribute_array() when no
+        IDs are given.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param status_only: if True, skips assets with Status == 0
+        :return: numpy array of asset IDs
+        """
+        typekey = get_asset_type_key(asset_type)
+        assets = self.__get_assets_of_type(typekey, None, status_only)
+        return build_column_array([a.get_attribute(typekey + "ID") for a in assets], None)
+
+    def get_attribute_array(self, asset_type, attribute_name, ids=None, status_only=False, nodata=np.nan):
+        """Returns the values of an attribute for many assets of a type at once as a numpy array.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param attribute_name: str() name of the attribute to read
+        :param ids: array-like of asset IDs to read, values are returned in this order. If None, reads all assets of
+                    the type in the order of get_asset_ids()
+        :param status_only: if True and ids is None, skips assets with Status == 0. If ids are given, assets with
+                    Status == 0 are returned as nodata
+        :param nodata: fill value for missing assets, missing attributes and inactive assets
+        :return: numpy array of values, dtype is the smallest that holds all values and the nodata fill
+        """
+        typekey = get_asset_type_key(asset_type)
+        assets = self.__get_assets_of_type(typekey, ids, status_only)
+        table = self.__attributetables.get(typekey)
+
+        if table is None:   # Dictionary based assets, collect values one by one
+            return build_column_array([None if a is None else a.get_attribute(attribute_name) for a in assets],
+                                      nodata)
+
+        # Columnar store: gather the asset slots and index the column in one operation
+        slots = np.array([-1 if a is None else a.get_attribute_store()[1] for a in assets], dtype=np.int64)
+        values, present = table.get_column(attribute_name)
+        if values is None:
+            return build_column_array([None] * len(slots), nodata)
+        valid = slots >= 0
+        valid[valid] = present[slots[valid]]
+        dtype = table.get_column_dtype(attribute_name, slots[valid])   # Same dtype as from dictionary based assets
+        if valid.all():
+            return values[slots].astype(dtype, copy=False)
+        attribute_array = np.full(len(slots), nodata, dtype=promote_column_dtype(dtype, infer_column_dtype(nodata)))
+        attribute_array[valid] = values[slots[valid]]
+        return attribute_array
+
+    def set_attribute_array(self, asset_type, attribute_name, values, ids=None, status_only=False):
+        """Writes the values of an attribute for many assets of a type at once.
+
+        :param asset_type: str() of the asset type e.g. "BlockID" or "Block"
+        :param attribute_name: str() name of the attribute to write
+        :param values: numpy array, list or tuple of values in the order of 'ids' (or of get_asset_ids() if ids is
+                    None), or a single value that is written to all assets. A list or tuple always holds one value per
+                    asset, which may itself be a list (e.g. "Neighbours")
+        :param ids: array-like of asset IDs to write to, IDs that do not exist in the collection are skipped
+        :param status_only: if True, assets with Status == 0 are not written to
+        :return: the number of assets written to
+        """
+        typekey = get_asset_type_key(asset_type)
+        assets = self.__get_assets_of_type(typekey, ids, status_only and ids is None)
+        if isinstance(values, (list, tuple)):
+            if len(values) != len(assets):
+                raise ValueError("Expected "+str(len(assets))+" values for "+attribute_name+", got "+str(len(values)))
+            values = build_column_array(list(values), None)     # Element-wise, so list values are kept as objects
+        else:
+            values = np.broadcast_to(np.asarray(values), (len(assets),))
+        keep = [i for i in range(len(assets)) if assets[i] is not None and not
+                (status_only and assets[i].get_attribute("Status") == 0)]
+        table = self.__attributetables.get(typekey)
+
+        if table is None:
+            datalist = values.tolist()      # Native Python types, as if written with add_attribute()
+            for i in keep:
+                assets[i].add_attribute(attribute_name, datalist[i])
+        else:
+            if self.__overlayregistry is not None and self.__overlayregistry.has_snapshots():
+                for i in keep:      # Live snapshots keep the old values, see snapshot()
+                    assets[i].prepare_attribute_write(attribute_name)
+            slots = np.array([assets[i].get_attribute_store()[1] for i in keep], dtype=np.int64)
+            table.set_column(attribute_name, values[keep], slots)
+        return len(keep)
+
+    def __get_assets_of_type(self, typekey, ids, status_only):
+        """Returns a list of the assets of type 'typekey' with the given IDs (None where an ID does not exist) or all
+        assets of that type if ids is None, optionally leaving out assets with Status == 0."""
+        if ids is None:
+            assets = [self.__assets[name] for name in self.__typeindex.get(typekey, {})]
+            if status_only:
+                assets = [a for a in assets if a.get_attribute("Status") != 0]
+            return assets
+        assets = self.get_many(typekey, ids)
+        if status_only:
+            assets = [None if a is None or a.get_attribute("Status") == 0 else a for a in assets]
+        return assets
+
     def remove_asset_by_name(self, name):
         """Removes an asset from the collection based on the name specified
         :param name: the key of the asset in the self.__assets dictionary.
         """
         try:
-            del self.__assets[name]
+            asset = self.__assets.pop(name)
+            typekey = name.split("ID")[0]
+            del self.__typeindex[typekey][name]
+            self.__spatialindex.pop(typekey, None)
+            self.__adjacency.pop(typekey, None)
+            self.__update_id_lookup(name, None)
+            if len(self.__typeindex[typekey]) == 0:
+                del self.__typeindex[typekey]
+            if isinstance(asset, (UBComponent, UBCompactVector)):
+                asset.detach_attribute_store()
             self.__globalassetcount -= 1
             try:
                 self.__assettypes[name.split("ID")[0]][1] -= 1
@@ -475,6 +1841,12 @@ class UBCollection(object):
     def reset_assets(self):
         """Erases all assets, leaves an empty assets dictionary. Carried out when resetting the simulation."""
         self.__assets = {}
+        self.__typeindex = {}
+        self.__attributetables = {}
+        self.__coordinatebuffer = None
+        self.__spatialindex = {}
+        self.__adjacency = {}
+        self.__idlookup = {}
         self.__assettypes = {}
         self.__globalassetcount = 0
         gc.collect()
@@ -629,6 +2001,143 @@ class NeighbourhoodInfluenceFunction(object):
         return True
 
 
+MEMORY_REPORT_ATTRIBUTE_KEYS = ["_UBAttributeContainer__attributes", "__attributes", "__changes"]
+MEMORY_REPORT_SKIPPED_KEYS = ["_UBAttributeContainer__store", "_UBAttributeContainer__slot",
+                              "_UBAttributeContainer__registry", "__store", "__slot", "__registry", "__buffer",
+                              "__base", "__removed", "__copied", "__pinned", "__owner", "__typekey"]
+
+
+def new_attribute_record():
+    """Returns an empty per-attribute record of UBCollection.memory_report()."""
+    return {"bytes": 0, "lists": 0, "list_items": 0, "max_list_length": 0}
+
+
+def get_deep_size(obj, seen):
+    """Returns the size of 'obj' in bytes including the tuples, lists, dicts and sets it contains. Objects whose id()
+    is in 'seen' are not counted again, numpy arrays count their data buffer."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) if obj.base is None else obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += get_deep_size(k, seen) + get_deep_size(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += get_deep_size(v, seen)
+    return size
+
+
+def measure_attribute_memory(value, att, typerecord, seen):
+    """Adds the size of an attribute value to its record 'att' and to the asset type record of memory_report()."""
+    size = get_deep_size(value, seen)
+    att["bytes"] += size
+    typerecord["attribute_bytes"] += size
+    typerecord["object_bytes"] += size
+    if isinstance(value, (list, tuple, set)):
+        att["lists"] += 1
+        att["list_items"] += len(value)
+        att["max_list_length"] = max(att["max_list_length"], len(value))
+
+
+def measure_asset_memory(asset, typerecord, seen):
+    """Measures one asset for UBCollection.memory_report() and adds the sizes to the asset type record. Attributes
+    held in a columnar store and shared objects (coordinate buffer, base assets of snapshots) are measured with the
+    collection instead."""
+    instance = sys.getsizeof(asset)
+    if hasattr(type(asset), "__slots__"):
+        state = asset.__getstate__()    # Slotted classes, the slots are part of the instance size
+    else:
+        state = asset.__dict__
+        instance += sys.getsizeof(state)
+    typerecord["instance_bytes"] += instance
+    typerecord["object_bytes"] += instance
+
+    for key, value in state.items():
+        if value is None or key in MEMORY_REPORT_SKIPPED_KEYS:
+            continue
+        elif key in MEMORY_REPORT_ATTRIBUTE_KEYS:
+            size = sys.getsizeof(value)     # The dictionary itself, its contents are counted per attribute
+            typerecord["attribute_bytes"] += size
+            typerecord["object_bytes"] += size
+            for attname, attvalue in value.items():
+                measure_attribute_memory(attvalue, typerecord["attributes"].setdefault(attname,
+                                                                                     new_attribute_record()),
+                                         typerecord, seen)
+        else:
+            size = get_deep_size(value, seen)
+            typerecord["geometry_bytes"] += size
+            typerecord["object_bytes"] += size
+
+
+def format_memory_report(report):
+    """Formats the dictionary returned by UBCollection.memory_report() as a text table for the console or log."""
+    mb = 1024.0 * 1024.0
+    lines = ["Memory report of collection: " + str(report["name"]) + " (" + str(report["assets"]) + " assets)",
+             "Total: %.2f MB (Python objects %.2f MB, array data %.2f MB)" %
+             (report["total_bytes"] / mb, report["object_bytes"] / mb, report["array_bytes"] / mb), "",
+             "%-16s %10s %12s %12s %12s %12s %12s" % ("Asset type", "Count", "Instances", "Geometry", "Attributes",
+                                                      "Objects", "Arrays")]
+    for typekey, t in sorted(report["types"].items(), key=lambda x: -(x[1]["object_bytes"] + x[1]["array_bytes"])):
+        lines.append("%-16s %10d %10.2fMB %10.2fMB %10.2fMB %10.2fMB %10.2fMB" %
+                     (typekey, t["count"], t["instance_bytes"] / mb, t["geometry_bytes"] / mb,
+                      t["attribute_bytes"] / mb, t["object_bytes"] / mb, t["array_bytes"] / mb))
+        for attname, att in sorted(t["attributes"].items(), key=lambda x: -x[1]["bytes"]):
+            lines.append("    %-28s %10.2fMB" % (attname, att["bytes"] / mb) +
+                         ("" if att["lists"] == 0 else "   lists: %d, items: %d, longest: %d" %
+                          (att["lists"], att["list_items"], att["max_list_length"])))
+    for name, size in report["shared"].items():
+        lines.append("Shared %-20s %10.2fMB" % (name, size / mb))
+    if len(report["warnings"]):
+        lines.append("")
+        lines += ["WARNING: " + w for w in report["warnings"]]
+    return "\n".join(lines)
+
+
+def get_asset_geometry(asset):
+    """Returns the Shapely geometry of a UBVector() or UBCompactVector() asset based on its geometry type (Point,
+    LineString or Polygon), None if the asset has no geometry."""
+    if not hasattr(asset, "get_shapely_geometry") or asset.get_geometry_type() == "":
+        return None
+    return asset.get_shapely_geometry()
+
+
+def strtree_query_indices(tree, geomlookup, geometry):
+    """Returns the indices of the geometries in the STRtree whose bounding boxes intersect that of 'geometry'. Shapely
+    2 returns the indices directly, Shapely 1.x returns the geometries, which are looked up by id() in 'geomlookup'."""
+    result = tree.query(geometry)
+    if isinstance(result, np.ndarray) and result.dtype.kind in "iu":
+        return result.tolist()
+    return [geomlookup[id(g)] for g in result]
+
+
+def build_column_array(values, nodata):
+    """Converts a list of attribute values into a numpy array of the smallest suitable dtype, replacing None with
+    'nodata'. Lists, strings and other non-numeric values result in an object array."""
+    dtype = None
+    for v in values:
+        vtype = infer_column_dtype(nodata if v is None else v)
+        dtype = vtype if dtype is None else promote_column_dtype(dtype, vtype)
+    if dtype is None:   # Empty list
+        dtype = infer_column_dtype(nodata) if nodata is not None else np.dtype(np.int64)
+    if dtype != object:
+        return np.array([nodata if v is None else v for v in values], dtype=dtype)
+    column = np.empty(len(values), dtype=object)
+    for i in range(len(values)):     # Element-wise so that list values are not unpacked into extra dimensions
+        column[i] = nodata if values[i] is None else values[i]
+    return column
+
+
+def get_asset_type_key(assettype):
+    """Returns the asset type key used by the collection's indices for either form of asset type identifier, i.e.
+    both "Block" and "BlockID" return "Block"."""
+    if assettype.endswith("ID"):
+        return assettype[:-2]
+    return assettype
+
+
 def save_asset_collection(fullpath, collection):
     """Save the asset collection to a serialized object using pickle into the 'collections' folder of the project
     directory."""
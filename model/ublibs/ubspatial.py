@@ -25,25 +25,68 @@ __copyright__ = "Copyright 2018. Peter M. Bach"
 
 import osgeo.osr as osr
 import osgeo.ogr as ogr
+import osgeo.gdal as gdal
 import numpy as np
 from shapely.geometry import Polygon
 import rasterio
 import rasterio.features
+import rasterio.coords
+import rasterio.crs
+import rasterio.transform
+import rasterio.windows
+import shapely
+import shapely.affinity
+from shapely.strtree import STRtree
+import scipy.sparse as sparse
+from rasterio.windows import Window
 import os, math
+import hashlib
+import json
+import multiprocessing
 import geopandas as gpd
 import numpy as np
 
 # URBANBEATS IMPORT
 from . import ubdatatypes as ubdata
 
-def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug=False):
+def read_raster_window(rastermap, row_start, row_stop, col_start, col_stop, band=None):
+    """Reads the rows [row_start, row_stop) and columns [col_start, col_stop) of the first band of a raster. Only this
+    window is read from disk, unless the band has been loaded already and is passed as 'band'. The window is clipped
+    to the raster's extent.
+
+    :param rastermap: the loaded rasterio object of the raster map
+    :param band: optional numpy array of the entire first band, which is sliced instead of reading from disk
+    :return: 2D numpy array of the window, which has zero height or width if the window lies outside the raster
+    """
+    row_start, row_stop = max(row_start, 0), min(row_stop, rastermap.height)
+    col_start, col_stop = max(col_start, 0), min(col_stop, rastermap.width)
+    if band is not None:
+        return band[row_start:max(row_stop, row_start), col_start:max(col_stop, col_start)]
+    if row_stop <= row_start or col_stop <= col_start:
+        return np.zeros((max(row_stop - row_start, 0), max(col_stop - col_start, 0)), dtype=rastermap.dtypes[0])
+    return rastermap.read(1, window=Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+
+
+def read_raster_value_at_point(rastermap, x, y, band=None):
+    """Returns the value of the raster cell at the map coordinates (x, y) of the raster's coordinate system, reading
+    only that cell from disk. Returns None if the point lies outside the raster."""
+    loc = rastermap.index(x, y)
+    datamatrix = read_raster_window(rastermap, loc[0], loc[0] + 1, loc[1], loc[1] + 1, band)
+    if 0 in datamatrix.shape:
+        return None
+    return datamatrix[0, 0]
+
+
+def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug=False, band=None):
     """ Extracts data points from a raster map based on a polygon mask. Function returns a single-dimensional array of
-    all data points representing the masked data, which can be analysed or tallied depending on the function.
+    all data points representing the masked data, which can be analysed or tallied depending on the function. Only the
+    window of the raster covering the asset's bounding box is read from disk.
 
     :param rastermap: the loaded rasterio object representing the raster map to mask the polygon onto
     :param asset: the UrbanBEATS asset object, Polygonal
     :param xllcorner: the global xllcorner of the simulation map
     :param yllcorner: the global yllcorner of the simulation map
+    :param band: optional numpy array of the raster's first band if it has been loaded already (e.g. for small maps)
     return: A list of data points within the mask area, None if there is no data within the mask.
     """
     cellsize = rastermap.res  # Some basic raster properties
@@ -60,11 +103,9 @@ def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug
         reppoint = assetpoly.representative_point()
         xpoint = reppoint.x + xllcorner
         ypoint = reppoint.y + yllcorner
-        loc = rastermap.index(xpoint, ypoint)
-        # if debug: print(reppoint, xpoint, ypoint, loc)
-        datapoint = rastermap.read(1)[loc[0], loc[1]]
+        datapoint = read_raster_value_at_point(rastermap, xpoint, ypoint, band)
         # if debug: print(datapoint)
-        if datapoint == rastermap.nodata:
+        if datapoint is None or datapoint == rastermap.nodata:
             return np.array([])
         else:
             return np.array([datapoint])
@@ -81,10 +122,12 @@ def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug
     llindex = rastermap.index(assetbounds[0], assetbounds[1])
     urindex = rastermap.index(assetbounds[2], assetbounds[3])
 
-    # Readjust index in ll and ur indices if -ve to 0
-    datamatrix = rastermap.read(1)[
-                 min(max(llindex[0], 0), max(urindex[0], 0)):max(max(llindex[0], 0), max(urindex[0], 0)) + 1,
-                 min(max(llindex[1], 0), max(urindex[1], 0)):max(max(llindex[1], 0), max(urindex[1], 0)) + 1]
+    # Readjust index in ll and ur indices if -ve to 0, then read only that window of the raster
+    datamatrix = read_raster_window(rastermap,
+                                    min(max(llindex[0], 0), max(urindex[0], 0)),
+                                    max(max(llindex[0], 0), max(urindex[0], 0)) + 1,
+                                    min(max(llindex[1], 0), max(urindex[1], 0)),
+                                    max(max(llindex[1], 0), max(urindex[1], 0)) + 1, band)
                 # max index + 1 (inclusive)
     # datamatrix = np.flip(datamatrix, 0)     # Flip the raster upside down
 
@@ -112,7 +155,7 @@ def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug
         maskint_set = []
         for pt in range(len(assetinteriors[grp])):
             x = assetinteriors[grp][pt][0]
-            y = assetinteriors[grp][pt][0]
+            y = assetinteriors[grp][pt][1]
             maskint_set.append((float((x - maskoffsets[0]) / cellsize[0]),
                                float((y - maskoffsets[1]) / cellsize[1])))
         maskinteriors.append(maskint_set)
@@ -137,17 +180,965 @@ def retrieve_raster_data_from_mask(rastermap, asset, xllcorner, yllcorner, debug
         reppoint = assetpoly.representative_point()
         xpoint = reppoint.x + xllcorner
         ypoint = reppoint.y + yllcorner
-        loc = rastermap.index(xpoint, ypoint)
-        # if debug: print(reppoint, xpoint, ypoint, loc)
-        datapoint = rastermap.read(1)[loc[0], loc[1]]
+        datapoint = read_raster_value_at_point(rastermap, xpoint, ypoint, band)
         # if debug: print(datapoint)
-        if datapoint == rastermap.nodata:
+        if datapoint is None or datapoint == rastermap.nodata:
             return np.array([])
         else:
             return np.array([datapoint])
     return extractdata
 
 
+# --- ZONAL STATISTICS ENGINE ---
+ZONAL_STATISTICS = ["pixels", "count", "sum", "mean", "min", "max", "std", "nodatafraction"]
+ZONAL_TILE_PIXELS = 4194304     # Target number of cells per tile when streaming a raster, approx. 32 MB of float64
+LABEL_CACHE_FOLDER = "labelcache"   # Folder in the project directory holding cached label rasters
+LABEL_CACHE_KEEP = 8    # Number of most recently used label rasters and overlay matrices kept in the label cache
+
+
+def get_valid_data_mask(data, nodata):
+    """Returns a boolean array marking all cells of 'data' that are not the raster's nodata value (or NaN)."""
+    valid = np.ones(data.shape, dtype=bool)
+    if nodata is not None:
+        valid &= data != nodata
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    return valid
+
+
+def get_raster_tile_windows(rastermap, maxpixels=ZONAL_TILE_PIXELS):
+    """Splits the raster into tiles made up of whole blocks of the dataset's natural block size (e.g. 256 x 256 tiles
+    or single row strips of a GeoTIFF), with tiles of up to approx. maxpixels cells.
+
+    :param rastermap: the loaded rasterio object of the raster map
+    :param maxpixels: the target number of cells per tile, a tile is never smaller than one block
+    :return: list of [row_start, row_stop, col_start, col_stop] windows covering the raster
+    """
+    blockrows, blockcols = rastermap.block_shapes[0]
+    tilecols = min(rastermap.width, blockcols * max(1, int(math.sqrt(maxpixels)) // blockcols))
+    tilerows = min(rastermap.height, blockrows * max(1, maxpixels // (tilecols * blockrows)))
+    windows = []
+    for row in range(0, rastermap.height, tilerows):
+        for col in range(0, rastermap.width, tilecols):
+            windows.append([row, min(row + tilerows, rastermap.height), col, min(col + tilecols, rastermap.width)])
+    return windows
+
+
+def get_asset_label_shapes(assets, xllcorner, yllcorner):
+    """Returns the polygons of a list of assets in the raster's coordinate system as (geometry, label) pairs for
+    rasterization, where label = list index + 1, and a numpy array of their bounds [xmin, ymin, xmax, ymax]. Assets
+    that are not polygons (e.g. points) are left out."""
+    shapes = []
+    for i in range(len(assets)):
+        geom = ubdata.get_asset_geometry(assets[i])
+        if geom is None or geom.geom_type != "Polygon" or geom.is_empty:
+            continue
+        shapes.append((shapely.affinity.translate(geom, xllcorner, yllcorner), i + 1))
+    bounds = np.array([shp[0].bounds for shp in shapes], dtype=np.float64).reshape(len(shapes), 4)
+    return shapes, bounds
+
+
+def rasterize_label_shapes(shapes, out_shape, transform):
+    """Burns (geometry, label) pairs into a label raster of the given shape and transform. A cell carries the label of
+    the shape containing its centre and 0 if it is not covered by any shape."""
+    if len(shapes) == 0:
+        return np.zeros(out_shape, dtype=np.int32)
+    return rasterio.features.rasterize(shapes, out_shape=out_shape, transform=transform, fill=0, dtype="int32")
+
+
+def rasterize_asset_labels(rastermap, assets, xllcorner, yllcorner):
+    """Burns a list of polygonal assets into a single label raster aligned to the cells of the raster map. A cell
+    carries the label i + 1 if its centre lies within assets[i] and 0 if it is not covered by any asset.
+
+    :param rastermap: the loaded rasterio object of the raster map to align the labels to
+    :param assets: list of UrbanBEATS assets, the list index determines the label
+    :param xllcorner: the global xllcorner of the simulation map
+    :param yllcorner: the global yllcorner of the simulation map
+    :return: 2D numpy int32 array of labels with the shape of the raster map
+    """
+    shapes = get_asset_label_shapes(assets, xllcorner, yllcorner)[0]
+    return rasterize_label_shapes(shapes, rastermap.shape, rastermap.transform)
+
+
+def new_zonal_accumulator(nzones, categories=None):
+    """Creates the running totals of the zonal statistics of nzones zones, into which the partial statistics of each
+    tile are merged with merge_zonal_statistics(). If categories (a list of class values) are given, a histogram of
+    the number of cells of each class is kept per zone."""
+    accumulator = {"pixels": np.zeros(nzones, dtype=np.int64), "count": np.zeros(nzones, dtype=np.int64),
+                   "sum": np.zeros(nzones), "sumsq": np.zeros(nzones),
+                   "min": np.full(nzones, np.inf), "max": np.full(nzones, -np.inf)}
+    if categories is not None:
+        accumulator["categories"] = np.asarray(categories)
+        accumulator["histogram"] = np.zeros((nzones, len(categories)), dtype=np.int64)
+    return accumulator
+
+
+def calculate_partial_zonal_statistics(data, labels, nodata, categories=None):
+    """Reduces one tile of raster data by the zones of its label raster in a single vectorized pass. Cells with label 0
+    are ignored, nodata cells count towards 'pixels' but not towards any of the statistics.
+
+    :param data: 2D numpy array of raster values
+    :param labels: 2D numpy array of the same shape with zone labels starting at 1 (0 = no zone)
+    :param nodata: the raster's nodata value or None
+    :param categories: optional sorted list of class values to count in a histogram per zone
+    :return: dict with the zero-based indices of the zones present in the tile under "zones" and the arrays "pixels",
+            "count", "sum", "sumsq", "min", "max" (and "histogram") aligned to them
+    """
+    labels = labels.ravel()
+    data = data.ravel()
+    labelled = labels > 0
+    zones, inverse = np.unique(labels[labelled], return_inverse=True)
+    inverse = inverse.ravel()
+    nz = len(zones)
+    pixels = np.bincount(inverse, minlength=nz)
+
+    valid = get_valid_data_mask(data[labelled], nodata)
+    zoneidx = inverse[valid]
+    values = data[labelled][valid]
+    fvalues = values.astype(np.float64)
+
+    partial = {"zones": zones - 1, "pixels": pixels,
+               "count": np.bincount(zoneidx, minlength=nz),
+               "sum": np.bincount(zoneidx, weights=fvalues, minlength=nz),
+               "sumsq": np.bincount(zoneidx, weights=fvalues * fvalues, minlength=nz),
+               "min": np.full(nz, np.inf), "max": np.full(nz, -np.inf)}
+    if len(fvalues) > 0:    # Sort by zone once, then reduce each run of equal zones
+        order = np.argsort(zoneidx, kind="stable")
+        sortedzones = zoneidx[order]
+        sortedvalues = fvalues[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sortedzones)) + 1))
+        partial["min"][sortedzones[starts]] = np.minimum.reduceat(sortedvalues, starts)
+        partial["max"][sortedzones[starts]] = np.maximum.reduceat(sortedvalues, starts)
+
+    if categories is not None:
+        categories = np.asarray(categories)
+        ncat = len(categories)
+        catidx = np.minimum(np.searchsorted(categories, values), max(ncat - 1, 0))
+        match = categories[catidx] == values if ncat > 0 else np.zeros(len(values), dtype=bool)
+        partial["histogram"] = np.bincount(zoneidx[match] * ncat + catidx[match],
+                                           minlength=nz * ncat).reshape(nz, ncat)
+    return partial
+
+
+def merge_zonal_statistics(accumulator, partial):
+    """Merges the partial statistics of a tile into the running totals of the accumulator."""
+    zones = partial["zones"]        # Unique within a tile, so fancy indexed += is safe
+    for key in ["pixels", "count", "sum", "sumsq"]:
+        accumulator[key][zones] += partial[key]
+    accumulator["min"][zones] = np.minimum(accumulator["min"][zones], partial["min"])
+    accumulator["max"][zones] = np.maximum(accumulator["max"][zones], partial["max"])
+    if "histogram" in accumulator:
+        accumulator["histogram"][zones] += partial["histogram"]
+    return accumulator
+
+
+def finalize_zonal_statistics(accumulator):
+    """Converts the running totals of an accumulator into the final zonal statistics.
+
+    :return: dict of numpy arrays of length nzones (index i = label i + 1) for all keys in ZONAL_STATISTICS and the
+            "histogram" if categories were counted. The mean, min, max and std of zones without valid data are NaN.
+    """
+    count = accumulator["count"]
+    pixels = accumulator["pixels"]
+    hasdata = count > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(hasdata, accumulator["sum"] / count, np.nan)
+        std = np.sqrt(np.maximum(np.where(hasdata, accumulator["sumsq"] / count, np.nan) - mean * mean, 0.0))
+        nodatafraction = np.where(pixels > 0, 1.0 - count / pixels, np.nan)
+    stats = {"pixels": pixels, "count": count, "sum": accumulator["sum"], "mean": mean,
+             "min": np.where(hasdata, accumulator["min"], np.nan), "max": np.where(hasdata, accumulator["max"], np.nan),
+             "std": std, "nodatafraction": nodatafraction}
+    if "histogram" in accumulator:
+        stats["categories"] = accumulator["categories"]
+        stats["histogram"] = accumulator["histogram"]
+    return stats
+
+
+def calculate_zonal_statistics(data, labels, nzones, nodata, categories=None):
+    """Calculates the statistics of all zones of an in-memory label raster in one vectorized pass over the data, see
+    calculate_partial_zonal_statistics() and finalize_zonal_statistics()."""
+    accumulator = new_zonal_accumulator(nzones, categories)
+    merge_zonal_statistics(accumulator, calculate_partial_zonal_statistics(data, labels, nodata, categories))
+    return finalize_zonal_statistics(accumulator)
+
+
+def get_label_cache_path(projectpath):
+    """Returns the folder of the project in which label rasters are cached, None if there is no project path."""
+    if not projectpath:
+        return None
+    return os.path.join(projectpath, LABEL_CACHE_FOLDER)
+
+
+def prune_label_cache(cachepath, keep=LABEL_CACHE_KEEP):
+    """Bounds the size of the label cache folder by removing all but the 'keep' most recently used label rasters
+    (.npy) and overlay matrices (overlay_*.npz, see retrieve_overlay_matrix()). Files are ordered by their
+    modification time, which is updated whenever a cached file is read.
+
+    :param cachepath: the label cache folder, see get_label_cache_path()
+    :param keep: number of cached files to keep
+    :return: list of the removed file names
+    """
+    if cachepath is None or not os.path.isdir(cachepath):
+        return []
+    cached = []
+    for name in os.listdir(cachepath):
+        if name.endswith(".npy") or (name.startswith(OVERLAY_CACHE_PREFIX) and name.endswith(".npz")):
+            try:
+                cached.append((os.path.getmtime(os.path.join(cachepath, name)), name))
+            except OSError:
+                continue    # Removed in the meantime
+    removed = []
+    for mtime, name in sorted(cached, reverse=True)[max(keep, 0):]:
+        if remove_cache_file(os.path.join(cachepath, name)):
+            removed.append(name)
+    return removed
+
+
+def remove_cache_file(cachefile):
+    """Removes a cache file, e.g. a partially written .tmp file, ignoring files that cannot be removed (still open in
+    another process) or no longer exist. Returns True if the file was removed."""
+    try:
+        os.remove(cachefile)
+    except OSError:
+        return False
+    return True
+
+
+def touch_cache_file(cachefile):
+    """Marks a cache file as recently used for prune_label_cache()."""
+    try:
+        os.utime(cachefile, None)
+    except OSError:
+        pass
+
+
+def get_label_cache_key(shapes, rastermap):
+    """Returns a content hash of the asset shapes and labels (see get_asset_label_shapes()) and of the raster grid
+    (shape, transform and CRS) they are burned into. Any raster on the same grid shares the same key."""
+    crs = "" if rastermap.crs is None else rastermap.crs.to_wkt()
+    contenthash = hashlib.sha1(repr([rastermap.shape, tuple(rastermap.transform)[:6], crs]).encode("utf-8"))
+    for geom, label in shapes:
+        contenthash.update(np.int64(label).tobytes())
+        contenthash.update(geom.wkb)
+    return contenthash.hexdigest()
+
+
+def load_label_raster_from_cache(cachefile, shape):
+    """Opens a cached label raster as a read-only memory map, returns None if it does not exist or is unreadable."""
+    if not os.path.exists(cachefile):
+        return None
+    try:
+        labels = np.load(cachefile, mmap_mode="r")
+    except (ValueError, OSError):
+        return None
+    if labels.shape != tuple(shape):
+        return None
+    touch_cache_file(cachefile)
+    return labels
+
+
+def calculate_label_zonal_statistics(rastermap, assets, xllcorner, yllcorner, band=None, categories=None,
+                                     maxpixels=ZONAL_TILE_PIXELS, cachepath=None, processes=1):
+    """Streams the raster in tiles, burns the assets overlapping each tile into a label raster of that tile (or reads
+    it from the label cache) and merges the partial statistics of all tiles. See retrieve_zonal_statistics() for the
+    parameters."""
+    nodata = rastermap.nodata
+    shapes, bounds = get_asset_label_shapes(assets, xllcorner, yllcorner)
+    accumulator = new_zonal_accumulator(len(assets), categories)
+
+    # Use the cached label raster of this set of assets and raster grid if there is one, otherwise write it
+    cachedlabels, newlabels, cachefile, tmpfile = None, None, None, None
+    if cachepath is not None:
+        cachefile = os.path.join(cachepath, get_label_cache_key(shapes, rastermap) + ".npy")
+        cachedlabels = load_label_raster_from_cache(cachefile, rastermap.shape)
+        if cachedlabels is None:
+            os.makedirs(cachepath, exist_ok=True)
+            tmpfile = cachefile + ".tmp"
+            newlabels = np.lib.format.open_memmap(tmpfile, mode="w+", dtype=np.int32,
+                                                  shape=rastermap.shape)    # Zero-filled, i.e., no labels
+
+    try:
+        # Tiles and the shapes of the assets overlapping them: [tile, shapes, transform of the tile]
+        tasks = []
+        for tile in get_raster_tile_windows(rastermap, maxpixels):
+            window = Window(tile[2], tile[0], tile[3] - tile[2], tile[1] - tile[0])
+            left, bottom, right, top = rastermap.window_bounds(window)
+            overlap = np.flatnonzero((bounds[:, 0] < right) & (bounds[:, 2] > left) &
+                                     (bounds[:, 1] < top) & (bounds[:, 3] > bottom))
+            if len(overlap) == 0:
+                continue
+            tileshapes = [] if cachedlabels is not None else [shapes[i] for i in overlap]
+            tasks.append([tile, tileshapes, rastermap.window_transform(window)])
+
+        rastersource = get_raster_source(rastermap) if processes > 1 and len(tasks) > 1 else None
+        if rastersource is not None:
+            labelmode, labelfile = None, None
+            if cachedlabels is not None:
+                labelmode, labelfile = "read", cachefile
+            elif newlabels is not None:
+                newlabels.flush()       # The workers write their tiles of the label raster into the file themselves
+                labelmode, labelfile = "write", tmpfile
+            partials = map_tiles_in_parallel(rastersource, rastermap.nodata, tasks, categories, processes, labelmode,
+                                             labelfile)
+            for partial in partials:        # Merged in tile order, just like the serial run
+                merge_zonal_statistics(accumulator, partial)
+        else:
+            for tile, tileshapes, transform in tasks:
+                if cachedlabels is not None:
+                    labels = np.asarray(cachedlabels[tile[0]:tile[1], tile[2]:tile[3]])
+                else:
+                    labels = rasterize_label_shapes(tileshapes, (tile[1] - tile[0], tile[3] - tile[2]), transform)
+                    if newlabels is not None:
+                        newlabels[tile[0]:tile[1], tile[2]:tile[3]] = labels
+                data = read_raster_window(rastermap, tile[0], tile[1], tile[2], tile[3], band)
+                merge_zonal_statistics(accumulator,
+                                       calculate_partial_zonal_statistics(data, labels, nodata, categories))
+
+        if newlabels is not None:       # Only publish the cache file once it is complete
+            newlabels.flush()
+            newlabels = None
+            os.replace(tmpfile, cachefile)
+            tmpfile = None
+            prune_label_cache(cachepath)
+    finally:
+        if tmpfile is not None:     # The label raster is incomplete, do not leave the partial file behind
+            newlabels = None
+            remove_cache_file(tmpfile)
+
+    return finalize_zonal_statistics(accumulator)
+
+
+def map_tiles_in_parallel(rastersource, nodata, tasks, categories, processes, labelmode=None, labelfile=None):
+    """Computes the partial zonal statistics of a list of tiles (see calculate_label_zonal_statistics()) in a pool of
+    worker processes. Each worker opens the raster itself and only reads the windows of its tiles, so the band is
+    never held in memory as a whole.
+
+    :param rastersource: [path, open options] of the raster, see get_raster_source()
+    :param nodata: the raster's nodata value
+    :param tasks: list of [tile, shapes, transform] to process
+    :param processes: number of worker processes
+    :param labelmode: None to rasterize the shapes, "read" to read labels from 'labelfile' or "write" to rasterize and
+            write the labels of each tile into 'labelfile', a .npy file of the raster's shape
+    :return: list of the partial statistics of each tile, in the order of tasks
+    """
+    workertasks = [{"source": rastersource, "nodata": nodata, "categories": categories, "tile": tile,
+                    "shapes": tileshapes, "transform": transform, "labelmode": labelmode, "labelfile": labelfile}
+                   for tile, tileshapes, transform in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        partials = pool.map(calculate_tile_statistics, workertasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return partials
+
+
+def calculate_tile_statistics(task):
+    """Worker of map_tiles_in_parallel(), computes the partial zonal statistics of one tile, reading only the tile's
+    window of the raster."""
+    row_start, row_stop, col_start, col_stop = task["tile"]
+    rastermap = open_raster_source(task["source"])
+    try:
+        data = read_raster_window(rastermap, row_start, row_stop, col_start, col_stop)
+    finally:
+        rastermap.close()
+    if task["labelmode"] == "read":
+        labels = np.array(np.load(task["labelfile"], mmap_mode="r")[row_start:row_stop, col_start:col_stop])
+    else:
+        labels = rasterize_label_shapes(task["shapes"], (row_stop - row_start, col_stop - col_start),
+                                        task["transform"])
+        if task["labelmode"] == "write":    # Tiles do not overlap, so workers never write the same cells
+            labelfile = np.load(task["labelfile"], mmap_mode="r+")
+            labelfile[row_start:row_stop, col_start:col_stop] = labels
+            labelfile.flush()
+            del labelfile
+    return calculate_partial_zonal_statistics(data, labels, task["nodata"], task["categories"])
+
+
+def get_raster_source(rastermap):
+    """Returns [path, open options] with which worker processes can open the same raster, overview level or
+    UBMemmapRaster again (see open_raster_source()), None if it cannot be reopened, e.g. an in-memory dataset.
+
+    :param rastermap: the loaded rasterio object of the raster map or a UBMemmapRaster
+    """
+    if isinstance(rastermap, UBMemmapRaster):
+        source = [rastermap.name, None]
+    elif str(rastermap.name).startswith("/vsimem/"):
+        return None     # Only exists in the memory of this process
+    else:
+        source = [rastermap.name, dict(getattr(rastermap, "options", None) or {})]   # e.g. the OVERVIEW_LEVEL
+    try:
+        reopened = open_raster_source(source)
+    except (OSError, ValueError):
+        return None
+    shape = reopened.shape
+    reopened.close()
+    if shape != rastermap.shape:
+        return None     # Open options that are not reported by rasterio, e.g. an overview level in older versions
+    return source
+
+
+def open_raster_source(source):
+    """Opens a raster from its [path, open options], see get_raster_source()."""
+    if source[1] is None:
+        return UBMemmapRaster(source[0])
+    return rasterio.open(source[0], **source[1])
+
+
+def get_square_grid_from_meta(meta):
+    """Returns [BlockSize, BlocksWide, BlocksTall] of the simulation grid if it is made of regular SQUARES, else None.
+
+    :param meta: the 'meta' asset of the asset collection
+    """
+    if meta is None or meta.get_attribute("Geometry") != "SQUARES":
+        return None
+    return [meta.get_attribute("BlockSize"), meta.get_attribute("BlocksWide"), meta.get_attribute("BlocksTall")]
+
+
+def get_square_grid_alignment(rastermap, blocksize, blockstall, xllcorner, yllcorner):
+    """Checks whether a grid of square blocks lines up with the cells of a north-up raster with square cells, i.e. the
+    block size is an integer multiple k of the resolution and the grid's edges fall on cell edges. Returns
+    [k, row, col], the cells per block side and the raster row and column of the grid's top left corner (which may
+    lie outside the raster), or None if the grid and the raster are not aligned."""
+    transform = rastermap.transform
+    res = transform.a
+    if transform.b != 0 or transform.d != 0 or res <= 0 or abs(transform.e + res) > 1e-9 * res:
+        return None
+    values = [blocksize / res, (transform.f - (yllcorner + blockstall * blocksize)) / res,
+              (xllcorner - transform.c) / res]
+    if any([abs(v - round(v)) > 1e-6 for v in values]) or round(values[0]) < 1:
+        return None
+    return [int(round(v)) for v in values]
+
+
+def calculate_square_grid_statistics(rastermap, squaregrid, xllcorner, yllcorner, band=None, categories=None,
+                                     maxpixels=ZONAL_TILE_PIXELS):
+    """Computes the zonal statistics of all blocks of a regular SQUARES grid that is aligned to the raster (see
+    get_square_grid_alignment()) without any polygon masking. The raster is read in strips of whole block rows, each
+    strip is reshaped to (rows, k, blocks wide, k) and reduced over the inner axes. Blocks only partly covered by the
+    raster count only the cells within the raster.
+
+    :param squaregrid: [BlockSize, BlocksWide, BlocksTall] as returned by get_square_grid_from_meta()
+    :return: dict of numpy arrays as finalize_zonal_statistics() with index BlockID - 1 for every possible block
+    """
+    blockswide, blockstall = int(squaregrid[1]), int(squaregrid[2])
+    k, toprow, leftcol = get_square_grid_alignment(rastermap, squaregrid[0], blockstall, xllcorner, yllcorner)
+    nodata = rastermap.nodata
+    accumulator = new_zonal_accumulator(blockswide * blockstall, categories)
+    stripblocks = max(1, maxpixels // (blockswide * k * k))     # Number of block rows per strip
+
+    for t0 in range(0, blockstall, stripblocks):
+        t1 = min(t0 + stripblocks, blockstall)
+        rows = [toprow + t0 * k, toprow + t1 * k]
+        cols = [leftcol, leftcol + blockswide * k]
+        data = read_raster_window(rastermap, rows[0], rows[1], cols[0], cols[1], band)
+        if 0 in data.shape:
+            continue
+
+        # Pad the window to whole blocks, cells outside the raster are neither pixels nor valid data
+        r0, c0 = max(rows[0], 0) - rows[0], max(cols[0], 0) - cols[0]
+        inner = (slice(r0, r0 + data.shape[0]), slice(c0, c0 + data.shape[1]))
+        inside = np.zeros((rows[1] - rows[0], cols[1] - cols[0]), dtype=bool)
+        inside[inner] = True
+        valid = np.zeros(inside.shape, dtype=bool)
+        valid[inner] = get_valid_data_mask(data, nodata)
+        values = np.zeros(inside.shape)
+        values[inner] = data
+
+        shape = (t1 - t0, k, blockswide, k)
+        blockrows = blockstall - 1 - np.arange(t0, t1)      # Block rows count from the bottom of the grid
+        zones = (blockrows[:, None] * blockswide + np.arange(blockswide)[None, :]).ravel()
+        partial = {"zones": zones,
+                   "pixels": inside.reshape(shape).sum(axis=(1, 3)).ravel(),
+                   "count": valid.reshape(shape).sum(axis=(1, 3)).ravel(),
+                   "sum": np.where(valid, values, 0.0).reshape(shape).sum(axis=(1, 3)).ravel(),
+                   "sumsq": np.where(valid, values * values, 0.0).reshape(shape).sum(axis=(1, 3)).ravel(),
+                   "min": np.where(valid, values, np.inf).reshape(shape).min(axis=(1, 3)).ravel(),
+                   "max": np.where(valid, values, -np.inf).reshape(shape).max(axis=(1, 3)).ravel()}
+        if categories is not None:
+            partial["histogram"] = np.stack([(valid & (values == c)).reshape(shape).sum(axis=(1, 3)).ravel()
+                                             for c in categories], axis=1).reshape(len(zones), len(categories))
+        merge_zonal_statistics(accumulator, partial)
+    return finalize_zonal_statistics(accumulator)
+
+
+def select_zonal_statistics(stats, indices):
+    """Returns the zonal statistics of only the zones at the given indices, in that order."""
+    indices = np.asarray(indices, dtype=np.int64)
+    selection = dict([(key, stats[key][indices]) for key in stats.keys() if key != "categories"])
+    if "categories" in stats:
+        selection["categories"] = stats["categories"]
+    return selection
+
+
+def retrieve_zonal_statistics(rastermap, assets, xllcorner, yllcorner, band=None, categories=None,
+                              maxpixels=ZONAL_TILE_PIXELS, cachepath=None, squaregrid=None, processes=1):
+    """Computes the zonal statistics of a raster map for a whole list of assets at once, replacing repeated calls of
+    retrieve_raster_data_from_mask(). The raster is streamed in tiles of whole blocks, the assets overlapping each tile
+    are rasterized into a label raster of that tile and the partial statistics of all tiles are merged at the end, so
+    memory use is bound by the tile size rather than the raster size. Assets that do not cover the centre of any cell
+    (e.g. smaller than a cell) fall back to the value at their representative point as
+    retrieve_raster_data_from_mask() does. If the assets are Blocks of a SQUARES grid aligned to the raster cells, the
+    blocks are reduced directly by reshaping the raster without any rasterization.
+
+    :param rastermap: the loaded rasterio object of the raster map
+    :param assets: list of UrbanBEATS assets, the statistics are returned in the same order
+    :param xllcorner: the global xllcorner of the simulation map
+    :param yllcorner: the global yllcorner of the simulation map
+    :param band: optional numpy array of the raster's first band if it has been loaded already
+    :param categories: optional sorted list of class values (e.g. land use categories) to count per asset
+    :param maxpixels: the target number of cells per tile
+    :param cachepath: optional folder in which the label raster is cached, keyed by the content of the assets and the
+            raster grid, so that repeat runs or other rasters on the same grid skip the rasterization. Only the
+            LABEL_CACHE_KEEP most recently used files are kept, see prune_label_cache()
+    :param squaregrid: optional [BlockSize, BlocksWide, BlocksTall] if the assets are Blocks of a SQUARES grid, see
+            get_square_grid_from_meta()
+    :param processes: number of worker processes to spread the tiles across, 1 runs serially. Each process opens the
+            raster file itself and reads only the windows of its tiles, nothing is shared between processes. The
+            results are identical to a serial run (the SQUARES fast path is always serial)
+    :return: dict of numpy arrays, see finalize_zonal_statistics(). An asset with 'pixels' of 0 lies outside the
+            raster, one with 'count' of 0 only covers nodata.
+    """
+    nodata = rastermap.nodata
+    if squaregrid is not None and get_square_grid_alignment(rastermap, squaregrid[0], squaregrid[2], xllcorner,
+                                                            yllcorner) is not None:
+        gridstats = calculate_square_grid_statistics(rastermap, squaregrid, xllcorner, yllcorner, band, categories,
+                                                     maxpixels)
+        stats = select_zonal_statistics(gridstats, [asset.get_attribute("BlockID") - 1 for asset in assets])
+    else:
+        stats = calculate_label_zonal_statistics(rastermap, assets, xllcorner, yllcorner, band, categories, maxpixels,
+                                                 cachepath, processes)
+
+    for i in np.flatnonzero(stats["pixels"] == 0):     # Last ditch attempt to get a measurement for unlabelled assets
+        geom = ubdata.get_asset_geometry(assets[i])
+        if geom is None or geom.is_empty:
+            continue
+        reppoint = geom.representative_point()
+        datapoint = read_raster_value_at_point(rastermap, reppoint.x + xllcorner, reppoint.y + yllcorner, band)
+        if datapoint is None:
+            continue
+        stats["pixels"][i] = 1
+        if get_valid_data_mask(np.array([datapoint]), nodata)[0]:
+            stats["count"][i] = 1
+            for key in ["sum", "mean", "min", "max"]:
+                stats[key][i] = float(datapoint)
+            stats["std"][i] = 0.0
+            stats["nodatafraction"][i] = 0.0
+            if categories is not None:
+                stats["histogram"][i] = stats["categories"] == datapoint
+        else:
+            stats["nodatafraction"][i] = 1.0
+    return stats
+
+
+# --- MEMORY-MAPPED RASTER CACHE ---
+RASTER_CACHE_EXT = [".npy", ".json"]    # Cached band and its sidecar with the georeferencing, appended to the filename
+
+
+class UBMemmapRaster(object):
+    """A read-only single band raster backed by an uncompressed .npy memory map and a JSON sidecar, as written by
+    convert_raster_to_memmap(). It offers the parts of the rasterio dataset interface used by the raster mapping
+    functions (shape, transform, nodata, read(), index(), windows), but read() returns zero-copy views of the band
+    instead of decoding the file again."""
+    def __init__(self, cachefile):
+        """Opens the cached raster.
+
+        :param cachefile: full path of the cache without extension, i.e. the files cachefile + RASTER_CACHE_EXT
+        """
+        f = open(cachefile + ".json", "r")
+        sidecar = json.load(f)
+        f.close()
+        self.__data = np.load(cachefile + ".npy", mmap_mode="r")
+        self.name = cachefile
+        self.height, self.width = self.__data.shape
+        self.shape = self.__data.shape
+        self.count = 1
+        self.dtypes = [str(self.__data.dtype)]
+        self.nodata = sidecar["nodata"]
+        self.transform = rasterio.transform.Affine(*sidecar["transform"])
+        self.res = (self.transform.a, -self.transform.e)
+        self.crs = rasterio.crs.CRS.from_wkt(sidecar["crs"]) if sidecar["crs"] else None
+        self.bounds = rasterio.coords.BoundingBox(*rasterio.transform.array_bounds(self.height, self.width,
+                                                                                   self.transform))
+        self.block_shapes = [(1, self.width)]     # Rows are contiguous in the memory map
+
+    def read(self, indexes=1, window=None):
+        """Returns a read-only view of the band or of a window of it, without copying the data."""
+        if window is None:
+            return self.__data
+        row, col = int(window.row_off), int(window.col_off)
+        return self.__data[row:row + int(window.height), col:col + int(window.width)]
+
+    def index(self, x, y):
+        """Returns the (row, col) of the cell containing the map coordinates (x, y)."""
+        col, row = ~self.transform * (x, y)
+        return int(math.floor(row)), int(math.floor(col))
+
+    def window_bounds(self, window):
+        """Returns the (left, bottom, right, top) bounds of a window."""
+        return rasterio.windows.bounds(window, self.transform)
+
+    def window_transform(self, window):
+        """Returns the affine transform of a window."""
+        return rasterio.windows.transform(window, self.transform)
+
+    def close(self):
+        self.__data = None
+
+
+def get_raster_source_signature(rasterpath):
+    """Returns the size and modification time of a raster file to detect whether its cache is out of date."""
+    return [os.path.getsize(rasterpath), os.path.getmtime(rasterpath)]
+
+
+def convert_raster_to_memmap(rasterpath, cachefile):
+    """Decodes the first band of a raster file once and writes it as an uncompressed .npy file with a JSON sidecar
+    holding the transform, nodata value and CRS, so that it can be opened as a UBMemmapRaster. The band is converted
+    tile by tile, so the raster need not fit into memory.
+
+    :param rasterpath: full path of the raster file, e.g. a GeoTIFF
+    :param cachefile: full path of the cache without extension
+    :return: True if the cache was written
+    """
+    rastermap = rasterio.open(rasterpath)
+    band = np.lib.format.open_memmap(cachefile + ".npy.tmp", mode="w+", dtype=rastermap.dtypes[0],
+                                     shape=rastermap.shape)
+    for tile in get_raster_tile_windows(rastermap):
+        band[tile[0]:tile[1], tile[2]:tile[3]] = read_raster_window(rastermap, tile[0], tile[1], tile[2], tile[3])
+    band.flush()
+    del band
+    sidecar = {"source": os.path.basename(rasterpath), "signature": get_raster_source_signature(rasterpath),
+               "transform": list(rastermap.transform)[:6], "nodata": rastermap.nodata,
+               "crs": "" if rastermap.crs is None else rastermap.crs.to_wkt()}
+    rastermap.close()
+    os.replace(cachefile + ".npy.tmp", cachefile + ".npy")
+    f = open(cachefile + ".json", "w")
+    json.dump(sidecar, f)
+    f.close()
+    return True
+
+
+def open_raster(rasterpath, cachefile=None, cellsize=None, tolerance=None):
+    """Opens a raster for mapping. If a cell size of the simulation grid is given and the raster has an overview that
+    is fine enough for it (see open_raster_overview()), returns that overview. Else if a memory-mapped cache of the
+    raster exists and is not older than the raster file, returns a UBMemmapRaster of the cache, otherwise the rasterio
+    dataset of the file.
+
+    :param rasterpath: full path of the raster file
+    :param cachefile: optional full path of the raster's cache without extension, see convert_raster_to_memmap()
+    :param cellsize: optional cell size of the simulation grid to pick an overview for, None uses full resolution
+    :param tolerance: how many times finer than the cell size the overview must at least be, default
+            OVERVIEW_TOLERANCE
+    """
+    if cellsize is not None:
+        overview = open_raster_overview(rasterpath, cellsize, OVERVIEW_TOLERANCE if tolerance is None else tolerance)
+        if overview is not None:
+            return overview
+    if cachefile is not None and all([os.path.exists(cachefile + ext) for ext in RASTER_CACHE_EXT]):
+        f = open(cachefile + ".json", "r")
+        sidecar = json.load(f)
+        f.close()
+        if not os.path.exists(rasterpath) or get_raster_source_signature(rasterpath) == sidecar["signature"]:
+            return UBMemmapRaster(cachefile)
+    return rasterio.open(rasterpath)
+
+
+# --- RASTER OVERVIEWS ---
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32, 64]    # Decimation factors of the overview levels built for imported rasters
+OVERVIEW_TOLERANCE = 10.0   # Overview cells must be at least this many times smaller than the simulation grid cells
+
+
+def build_raster_overviews(rasterpath, resampling="AVERAGE"):
+    """Builds GDAL overview levels of a raster or reuses the ones it already has. The file is opened read-only, so
+    GDAL writes the overviews to an external .ovr file next to it.
+
+    :param rasterpath: full path of the raster file
+    :param resampling: GDAL resampling method, e.g. "AVERAGE" for continuous and "NEAREST" for categorical data
+    :return: list of the decimation factors of the raster's overviews
+    """
+    rastermap = rasterio.open(rasterpath)
+    factors = rastermap.overviews(1)
+    shape = rastermap.shape
+    rastermap.close()
+    if len(factors) > 0:
+        return factors
+    factors = [f for f in OVERVIEW_FACTORS if min(shape) // f >= 1]
+    if len(factors) == 0:
+        return factors
+    dataset = gdal.Open(rasterpath, gdal.GA_ReadOnly)
+    dataset.BuildOverviews(resampling, factors)
+    dataset = None      # Closes the dataset and flushes the overviews to disk
+    return factors
+
+
+def get_simgrid_cell_size(meta):
+    """Returns the typical cell size of the simulation grid as the square root of the asset area recorded in the
+    'meta' asset (Blocks, Hexagons, raster cells, Geohashes), None if the grid has no uniform area (e.g. patches)."""
+    if meta is None or meta.get_attribute("Area") is None:
+        return None
+    return math.sqrt(meta.get_attribute("Area"))
+
+
+def open_raster_overview(rasterpath, cellsize, tolerance=OVERVIEW_TOLERANCE):
+    """Opens the coarsest overview level of a raster whose resolution is still at least 'tolerance' times finer than
+    the cell size of the simulation grid.
+
+    :param rasterpath: full path of the raster file
+    :param cellsize: the cell size of the simulation grid, see get_simgrid_cell_size()
+    :param tolerance: how many times finer than the cell size the overview must at least be
+    :return: the rasterio dataset of the overview level, None if no overview is fine enough or there are none
+    """
+    rastermap = rasterio.open(rasterpath)
+    factors = rastermap.overviews(1)
+    resolution = max(rastermap.res)
+    rastermap.close()
+    level = None
+    for i in range(len(factors)):
+        if resolution * factors[i] * tolerance <= cellsize:
+            level = i
+    if level is None:
+        return None
+    return rasterio.open(rasterpath, OVERVIEW_LEVEL=level)
+
+
+# --- VECTOR OVERLAY ---
+VECTORIZED_SHAPELY = hasattr(shapely, "intersection")   # Shapely 2 exposes the GEOS operations as array functions
+OVERLAY_CACHE_PREFIX = "overlay_"   # Prefix of the cached intersection area matrices in the label cache folder
+
+
+def build_overlay_index(geometries):
+    """Builds the spatial index used to overlay a list of Shapely geometries (e.g. the features of an input map) with
+    other geometries.
+
+    :param geometries: list of Shapely geometries, their list index identifies them in all overlay queries
+    :return: [STRtree, object array of the geometries, {id(geometry): index}]
+    """
+    geoms = np.empty(len(geometries), dtype=object)     # Element-wise so that the geometries are not unpacked
+    for i in range(len(geometries)):
+        geoms[i] = geometries[i]
+    return [STRtree(list(geometries)), geoms, {id(geometries[i]): i for i in range(len(geometries))}]
+
+
+def query_overlay_candidates(overlayindex, geometry):
+    """Returns the sorted indices of the indexed geometries whose bounding boxes intersect that of 'geometry'."""
+    if len(overlayindex[1]) == 0:
+        return np.zeros(0, dtype=np.int64)
+    indices = ubdata.strtree_query_indices(overlayindex[0], overlayindex[2], geometry)
+    return np.sort(np.array(indices, dtype=np.int64))
+
+
+def calculate_overlay_areas(overlayindex, geometry):
+    """Calculates the area of intersection between 'geometry' and all indexed geometries that overlap it. Candidates
+    come from the STRtree and are tested in a single vectorized call under Shapely 2, one by one under Shapely 1.x.
+
+    :param overlayindex: the index returned by build_overlay_index()
+    :param geometry: the Shapely polygon to overlay, e.g. the geometry of a simulation grid asset
+    :return: [indices, areas], arrays of the overlapping geometries in ascending order and their intersection areas,
+        geometries that only touch 'geometry' (zero intersection area) are left out.
+    """
+    candidates = query_overlay_candidates(overlayindex, geometry)
+    if VECTORIZED_SHAPELY:
+        geoms = overlayindex[1][candidates]
+        hits = shapely.intersects(geoms, geometry)
+        candidates = candidates[hits]
+        areas = shapely.area(shapely.intersection(geoms[hits], geometry))
+    else:
+        hits = [i for i in candidates if overlayindex[1][i].intersects(geometry)]
+        candidates = np.array(hits, dtype=np.int64)
+        areas = np.array([overlayindex[1][i].intersection(geometry).area for i in hits], dtype=np.float64)
+    nonzero = areas != 0
+    return [candidates[nonzero], areas[nonzero]]
+
+
+def calculate_overlay_lengths(overlayindex, geometry):
+    """Calculates the length of the indexed lines (e.g. rivers or drains) inside 'geometry', see
+    calculate_overlay_areas(). Unlike areas, lines that only touch 'geometry' are kept, with a length of zero.
+
+    :return: [indices, lengths], arrays of the intersecting lines in ascending order and their lengths inside geometry
+    """
+    candidates = query_overlay_candidates(overlayindex, geometry)
+    if VECTORIZED_SHAPELY:
+        geoms = overlayindex[1][candidates]
+        hits = shapely.intersects(geoms, geometry)
+        return [candidates[hits], shapely.length(shapely.intersection(geoms[hits], geometry))]
+    hits = [i for i in candidates if overlayindex[1][i].intersects(geometry)]
+    lengths = [overlayindex[1][i].intersection(geometry).length for i in hits]
+    return [np.array(hits, dtype=np.int64), np.array(lengths, dtype=np.float64)]
+
+
+def build_overlay_matrix(features, geometries):
+    """Builds the sparse matrix of intersection areas between a set of geometries (rows) and the features of an input
+    map (columns). Any attribute of the features is then distributed over the geometries with one matrix-vector
+    product, e.g. matrix.dot(values / featureareas) for area-weighted totals.
+
+    :param features: list of Shapely polygons of the input map's features
+    :param geometries: list of Shapely polygons to overlay the features with, e.g. those of the simulation grid
+    :return: scipy.sparse CSR matrix of shape (len(geometries), len(features))
+    """
+    overlayindex = build_overlay_index(features)
+    rows, cols, areas = [], [], []
+    for i in range(len(geometries)):
+        overlap = calculate_overlay_areas(overlayindex, geometries[i])
+        rows.append(np.full(len(overlap[0]), i, dtype=np.int64))
+        cols.append(overlap[0])
+        areas.append(overlap[1])
+    if len(geometries) == 0:
+        return sparse.csr_matrix((0, len(features)))
+    return sparse.csr_matrix((np.concatenate(areas), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(len(geometries), len(features)))
+
+
+def get_overlay_cache_key(sourcepath, geometries, xllcorner, yllcorner):
+    """Returns a content hash of the input map file (path, size and modification time), the offsets its features were
+    imported with and the geometries overlaid with it. Renaming or rebuilding the asset collection with the same
+    geometries therefore keeps the key."""
+    signature = [os.path.abspath(sourcepath)] + get_raster_source_signature(sourcepath) + [xllcorner, yllcorner]
+    contenthash = hashlib.sha1(repr(signature).encode("utf-8"))
+    for geom in geometries:
+        contenthash.update(geom.wkb)
+    return contenthash.hexdigest()
+
+
+def retrieve_overlay_matrix(sourcepath, features, geometries, xllcorner, yllcorner, cachepath=None):
+    """Returns the intersection area matrix of the geometries and the input map's features (see build_overlay_matrix()),
+    reading it from the cache folder if the same map was overlaid with the same geometries before.
+
+    :param sourcepath: full path of the input map file the features were imported from
+    :param features: list of Shapely polygons of the input map's features
+    :param geometries: list of Shapely polygons to overlay the features with
+    :param xllcorner: the x offset the features were imported with
+    :param yllcorner: the y offset the features were imported with
+    :param cachepath: optional folder in which the matrix is cached, see get_label_cache_path()
+    :return: scipy.sparse CSR matrix of shape (len(geometries), len(features))
+    """
+    if cachepath is None:
+        return build_overlay_matrix(features, geometries)
+
+    cachefile = os.path.join(cachepath, OVERLAY_CACHE_PREFIX +
+                             get_overlay_cache_key(sourcepath, geometries, xllcorner, yllcorner) + ".npz")
+    if os.path.exists(cachefile):
+        try:
+            matrix = sparse.load_npz(cachefile).tocsr()
+            if matrix.shape == (len(geometries), len(features)):
+                touch_cache_file(cachefile)
+                return matrix
+        except (ValueError, OSError):
+            pass    # Unreadable cache, rebuild it
+
+    matrix = build_overlay_matrix(features, geometries)
+    os.makedirs(cachepath, exist_ok=True)
+    tmpfile = cachefile + ".tmp"
+    try:
+        f = open(tmpfile, "wb")
+        try:
+            sparse.save_npz(f, matrix)
+        finally:
+            f.close()
+        os.replace(tmpfile, cachefile)
+        tmpfile = None
+    finally:
+        if tmpfile is not None:     # Do not leave a partially written matrix behind
+            remove_cache_file(tmpfile)
+    prune_label_cache(cachepath)
+    return matrix
+
+
+# --- GRID TRAVERSAL ---
+def get_segment_square_cells(p0, p1, cellsize, cols, rows):
+    """Supercover traversal of a line segment over a grid of square cells anchored at the origin (0, 0), such as the
+    SQUARES simulation grid or the fishnet of a RASTER grid. Walks the grid one column at a time, so the work is
+    proportional to the number of cells the segment crosses.
+
+    :param p0: (x, y) start of the segment in grid coordinates
+    :param p1: (x, y) end of the segment in grid coordinates
+    :param cellsize: the width and height of each cell
+    :param cols: the number of cells wide of the grid
+    :param rows: the number of cells tall of the grid
+    :return: list of zero-based [col, row] of all cells the segment passes through or touches
+    """
+    x0, y0, x1, y1 = p0[0], p0[1], p1[0], p1[1]
+    xmin, xmax = min(x0, x1), max(x0, x1)
+    cells = []
+    for c in range(max(int(math.ceil(xmin / cellsize)) - 1, 0), min(int(math.floor(xmax / cellsize)), cols - 1) + 1):
+        xa, xb = max(xmin, c * cellsize), min(xmax, (c + 1) * cellsize)     # Part of the segment within the column
+        if xa > xb:
+            continue
+        if x1 == x0:
+            ya, yb = y0, y1
+        else:   # Endpoints keep their exact y, interpolating them can miss cells that only touch the segment's end
+            ya, yb = [y0 if x == x0 else (y1 if x == x1 else y0 + (x - x0) * (y1 - y0) / (x1 - x0)) for x in (xa, xb)]
+        ylo, yhi = min(ya, yb), max(ya, yb)
+        for r in range(max(int(math.ceil(ylo / cellsize)) - 1, 0), min(int(math.floor(yhi / cellsize)), rows - 1) + 1):
+            if r * cellsize <= yhi and (r + 1) * cellsize >= ylo:
+                cells.append([c, r])
+    return cells
+
+
+def get_hex_grid_layout(meta):
+    """Returns the layout of a HEXAGONS simulation grid from its metadata for get_segment_hex_candidates(). Hexes are
+    arranged in bands (rows for "EW", columns for "NS" orientation), every second band shifted by half a hex.
+
+    :return: [transpose, radius, bandspacing, bandoffset, alongspacing, alongoffset, bands, hexes per band]
+    """
+    hs = meta.get_attribute("HexSize")
+    hexfactor = meta.get_attribute("Area") / (1.5 * hs * hs)
+    width = float('%.5f' % (hexfactor * hs))    # Distance between parallel edges, rounded as in the grid geometry
+    if meta.get_attribute("HexOrient") == "NS":
+        yshift = meta.get_attribute("mapheight") - meta.get_attribute("HexTall") * width
+        return [True, hs, 1.5 * hs, 0.5 * hs, width, yshift + 0.5 * width,
+                meta.get_attribute("HexWide"), meta.get_attribute("HexTall")]
+    return [False, hs, 1.5 * hs, 0.0, width, 0.0, meta.get_attribute("HexTall"), meta.get_attribute("HexWide")]
+
+
+def get_segment_hex_candidates(p0, p1, layout):
+    """Walks a line segment band by band over a hexagonal grid and returns all hexes whose circumcircle it may
+    touch. Every hex the segment intersects is among them, see segment_intersects_convex_polygon() for the exact test.
+
+    :param p0: (x, y) start of the segment in grid coordinates
+    :param p1: (x, y) end of the segment in grid coordinates
+    :param layout: the hex grid layout, see get_hex_grid_layout()
+    :return: list of zero-based [col, row] of the candidate hexes
+    """
+    transpose, radius, bandspacing, bandoffset, alongspacing, alongoffset, bands, alongcount = layout
+    if transpose:       # Work in the frame of (along, band) coordinates
+        a0, b0, a1, b1 = p0[1], p0[0], p1[1], p1[0]
+    else:
+        a0, b0, a1, b1 = p0[0], p0[1], p1[0], p1[1]
+
+    candidates = []
+    kmin = max(int(math.ceil((min(b0, b1) - radius - bandoffset) / bandspacing)), 0)
+    kmax = min(int(math.floor((max(b0, b1) + radius - bandoffset) / bandspacing)), bands - 1)
+    for k in range(kmin, kmax + 1):
+        centre = k * bandspacing + bandoffset
+        if b1 == b0:
+            alo, ahi = min(a0, a1), max(a0, a1)
+        else:   # Part of the segment within reach of the hexes of this band
+            ta = min(max((centre - radius - b0) / (b1 - b0), 0.0), 1.0)
+            tb = min(max((centre + radius - b0) / (b1 - b0), 0.0), 1.0)
+            alo, ahi = sorted([a0 + ta * (a1 - a0), a0 + tb * (a1 - a0)])
+        shift = alongoffset + 0.5 * alongspacing * (k % 2)
+        for j in range(max(int(math.ceil((alo - radius - shift) / alongspacing)), 0),
+                       min(int(math.floor((ahi + radius - shift) / alongspacing)), alongcount - 1) + 1):
+            candidates.append([k, j] if transpose else [j, k])
+    return candidates
+
+
+def segment_intersects_convex_polygon(p0, p1, ring):
+    """Separating axis test of a line segment and a convex polygon, True if they intersect or touch.
+
+    :param ring: the closed exterior ring of the polygon, list of (x, y[, z]) coordinates
+    """
+    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+    segment = np.array([p0[:2], p1[:2]], dtype=np.float64)
+    edges = np.diff(ring, axis=0)
+    axes = np.column_stack([-edges[:, 1], edges[:, 0]])     # Edge normals and the normal of the segment
+    direction = segment[1] - segment[0]
+    axes = np.vstack([axes, [-direction[1], direction[0]]])
+    ringproj = ring.dot(axes.T)
+    segproj = segment.dot(axes.T)
+    return not np.any((ringproj.max(axis=0) < segproj.min(axis=0)) | (segproj.max(axis=0) < ringproj.min(axis=0)))
+
+
 def import_polygonal_map(filepath, option, naming, global_offsets, **kwargs):
     """Imports a polygonal map and saves the information into a UBVector format. Returns a list [ ] of UBVector()
     objects.
@@ -98,6 +98,8 @@ class UrbanBeatsSim(object):
             "logstyle": self.__global_options["projectlogstyle"],
             "projectpath": self.__global_options["defaultpath"],
             "keepcopy": 0,
+            "rastercache": 0,
+            "rasteroverviews": 0,
             "project_coord_sys": self.__global_options["defaultcoordsys"],
             "project_epsg": self.__global_options["customepsg"]
         }
@@ -470,7 +472,9 @@ class UrbanBeatsSim(object):
 
             # Create a new data library
             datalib = ubdatalibrary.UrbanBeatsDataLibrary(self.__projectpath,
-                                                          self.get_project_parameter("keepcopy"))
+                                                          self.get_project_parameter("keepcopy"),
+                                                          self.get_project_parameter("rastercache"),
+                                                          self.get_project_parameter("rasteroverviews"))
             self.set_data_library(datalib)
             for m in self.__modules_collection.keys():
                 self.__modules_collection[m].set_module_data_library(datalib)